@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are loaded
+from omnipost_api.event_stream import EventStreamApplication  # noqa: E402
+
+# Event streams are served without Django's thread per request, see omnipost_api.event_stream
+application = EventStreamApplication(django_application)
@@ -139,6 +139,114 @@ RQ_QUEUES = {
     }
 }
 
+# Keys derived from the platform instance passwords are cached per worker (omnipost_api.fernet)
+FERNET_KEY_CACHE = {
+    'MAX_SIZE': int(os.environ.get('FERNET_KEY_CACHE_SIZE', 256)),
+    'TTL': float(os.environ.get('FERNET_KEY_CACHE_TTL', 300)),
+}
+
+# Outbound calls to platform APIs go through per-host keep-alive sessions (omnipost_api.http_pool)
+OUTBOUND_HTTP = {
+    'POOL_CONNECTIONS': int(os.environ.get('HTTP_POOL_CONNECTIONS', 10)),
+    'POOL_MAXSIZE': int(os.environ.get('HTTP_POOL_MAXSIZE', 20)),
+    'POOL_BLOCK': False,
+    'CONNECT_TIMEOUT': float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5)),
+    'READ_TIMEOUT': float(os.environ.get('HTTP_READ_TIMEOUT', 60)),
+}
+
+# Publishing to many platform instances: instances per job, action chains run at once per job
+# and the number of entries accepted by one /publish/bulk/ request
+PUBLISH_FANOUT = {
+    'BATCH_SIZE': int(os.environ.get('PUBLISH_FANOUT_BATCH_SIZE', 10)),
+    'CONCURRENCY': int(os.environ.get('PUBLISH_FANOUT_CONCURRENCY', 8)),
+    'BULK_MAX_ENTRIES': int(os.environ.get('PUBLISH_BULK_MAX_ENTRIES', 500)),
+}
+
+# Post media is streamed to S3 with multipart uploads (omnipost_api.storage).
+# Set AWS_S3_ENDPOINT_URL to use a local S3 stand-in such as MinIO.
+MEDIA_UPLOAD = {
+    'BUCKET': os.environ.get('AWS_BUCKET_NAME', 'omnipost-images'),
+    'ENDPOINT_URL': os.environ.get('AWS_S3_ENDPOINT_URL'),
+    'REGION': os.environ.get('AWS_REGION'),
+    'PART_SIZE': int(os.environ.get('S3_UPLOAD_PART_SIZE', 8 * 1024 * 1024)),
+    'MAX_CONCURRENCY': int(os.environ.get('S3_UPLOAD_CONCURRENCY', 4)),
+}
+
+# Platform configs are cached per process and invalidated over Redis pub/sub (omnipost_api.platform_registry)
+PLATFORM_REGISTRY = {
+    'CHANNEL': 'omnipost:platforms',
+    'MAX_AGE': int(os.environ.get('PLATFORM_REGISTRY_MAX_AGE', 300)),
+}
+
+# Publish jobs carry a handle to the password instead of the password (omnipost_api.job_secrets).
+# Handles expire TTL seconds after the job is due.
+JOB_SECRETS = {
+    'TTL': int(os.environ.get('JOB_SECRET_TTL', 3600)),
+}
+
+# Token bucket limits of calls to platform APIs are declared in Platform.config["RATE_LIMITS"]
+# (omnipost_api.rate_limit). Longest wait for a token, and how long a 429 without Retry-After
+# pauses the platform instance.
+RATE_LIMIT = {
+    'MAX_WAIT': float(os.environ.get('RATE_LIMIT_MAX_WAIT', 120)),
+    'DEFAULT_PAUSE': float(os.environ.get('RATE_LIMIT_DEFAULT_PAUSE', 30)),
+}
+
+# Default retry policy of action steps, which a step can override with its "retry" option
+# (omnipost_api.retry). Steps that still fail are kept as DeadLetters to be replayed.
+STEP_RETRY = {
+    'MAX_ATTEMPTS': int(os.environ.get('STEP_RETRY_MAX_ATTEMPTS', 3)),
+    'BACKOFF': float(os.environ.get('STEP_RETRY_BACKOFF', 1)),
+    'MAX_BACKOFF': float(os.environ.get('STEP_RETRY_MAX_BACKOFF', 60)),
+    'RETRY_ON': [429, 502, 503, 504],
+}
+
+# Action steps with an "upload" option stream the post's media in chunks (omnipost_api.chunked_upload)
+CHUNKED_UPLOAD = {
+    'CHUNK_SIZE': int(os.environ.get('CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)),
+}
+
+# Media is probed once per upload and the results cached in Redis by SHA-256 (omnipost_api.media_probe)
+MEDIA_PROBE = {
+    'CACHE_TTL': int(os.environ.get('MEDIA_PROBE_CACHE_TTL', 30 * 24 * 3600)),
+}
+
+# Notifications from the workers are buffered and written in batches (omnipost_api.notification_sink)
+NOTIFICATION_SINK = {
+    'MAX_BATCH': int(os.environ.get('NOTIFICATION_SINK_MAX_BATCH', 100)),
+    'MAX_DELAY': float(os.environ.get('NOTIFICATION_SINK_MAX_DELAY', 2.0)),
+    'MAX_BUFFER': int(os.environ.get('NOTIFICATION_SINK_MAX_BUFFER', 10000)),
+}
+
+# Notifications and post state changes are streamed to clients over server-sent events (omnipost_api.events)
+EVENTS = {
+    'KEEPALIVE': int(os.environ.get('EVENTS_KEEPALIVE', 15)),
+}
+
+# Scheduled posts are stored as PublishIntents and enqueued when they come due (omnipost_api.dispatcher)
+PUBLISH_DISPATCHER = {
+    'BATCH_SIZE': int(os.environ.get('PUBLISH_DISPATCHER_BATCH_SIZE', 100)),
+    'POLL_INTERVAL': float(os.environ.get('PUBLISH_DISPATCHER_POLL_INTERVAL', 1.0)),
+}
+
+# Async read views (omnipost_api.views.AsyncReadView) that query the database at a time, per web process
+ASYNC_READS = {
+    'MAX_DB_CONCURRENCY': int(os.environ.get('ASYNC_READS_MAX_DB_CONCURRENCY', 20)),
+}
+
+# Image variants for the platforms' IMAGE_PROFILEs are rendered in a process pool (omnipost_api.image_derivatives)
+IMAGE_DERIVATIVES = {
+    'PROCESSES': int(os.environ.get('IMAGE_DERIVATIVE_PROCESSES', 2)),
+    'TIMEOUT': int(os.environ.get('IMAGE_DERIVATIVE_TIMEOUT', 120)),
+}
+
+# Uploaded files are hashed while they stream in, for the content-addressed media in the bucket (MediaObject)
+FILE_UPLOAD_HANDLERS = [
+    'omnipost_api.uploads.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -153,4 +153,53 @@ class NotificationAdmin(admin.ModelAdmin):
         'error',
     )
     list_filter = ('platform_instance', 'user', 'created_at', 'error')
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'created_at'
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'platform_instance',
+        'post_type',
+        'object_id',
+        'action',
+        'step',
+        'status_code',
+        'created_at',
+        'replayed_at',
+    )
+    list_filter = ('platform_instance', 'user', 'created_at', 'status_code')
+    date_hierarchy = 'created_at'
+
+
+
+@admin.register(PublishIntent)
+class PublishIntentAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'user',
+        'post_type',
+        'object_id',
+        'action',
+        'due_at',
+        'dispatched_at',
+        'cancelled_at',
+    )
+    list_filter = ('user', 'post_type', 'due_at')
+    date_hierarchy = 'due_at'
+    # The encrypted password
+    exclude = ('secret',)
+
+@admin.register(MediaObject)
+class MediaObjectAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'key',
+        'size',
+        'ref_count',
+        'uploaded',
+        'created_at',
+    )
+    list_filter = ('uploaded', 'created_at')
+    search_fields = ('digest',)
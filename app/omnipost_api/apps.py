@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class OmnipostApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'omnipost_api'
+
+    def ready(self):
+        from omnipost_api import platform_registry
+        from omnipost_api.models import POST_MODELS, release_post_media
+
+        Platform = self.get_model('Platform')
+        post_save.connect(platform_registry.platform_changed, sender=Platform)
+        post_delete.connect(platform_registry.platform_changed, sender=Platform)
+        for model in POST_MODELS.values():
+            # Drops the post's reference to its deduplicated media
+            post_delete.connect(release_post_media, sender=model)
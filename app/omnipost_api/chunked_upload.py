@@ -0,0 +1,163 @@
+"""
+Chunked uploads of post media to platforms that do not pull media from a URL.
+
+A step with an `upload` option is sent once per chunk of the post's media file
+instead of once with a JSON payload. It is meant to sit between a plain INIT
+step and a plain FINALIZE step:
+```
+[
+    {"base_url": ..., "endpoint": "/media/upload", "method": "POST", "headers": {...},
+     "params": {"command": "APPEND", "media_id": "MEDIA_ID", "segment_index": "CHUNK_INDEX"}, "payload": {}},
+    204,
+    {},
+    {"upload": {"chunk_size": 4194304, "body": "multipart", "field": "media"}}
+]
+```
+The request of every chunk is rendered with these extra placeholders:
+`CHUNK_INDEX`, `CHUNK_START`, `CHUNK_END` (inclusive), `CHUNK_LENGTH`, `TOTAL_SIZE`
+and `TOTAL_CHUNKS`, eg. `"Content-Range": "bytes CHUNK_START-CHUNK_END/TOTAL_SIZE"`.
+
+Upload options:
+- `chunk_size`: bytes per chunk, defaults to `CHUNKED_UPLOAD["CHUNK_SIZE"]`
+- `body`: `"raw"` sends the chunk as the request body, `"multipart"` sends it as the
+  file `field` of a multipart form whose other fields are the request's `payload`
+- `chunk_codes`: status codes besides the expected one that accept a chunk, eg. 308
+  for resumable uploads that only answer 200 to the last chunk
+
+The file is read one chunk at a time, so memory use does not depend on its size:
+through a memory map when it is in local storage, or else with ranged GETs of the
+copy in the media bucket. Each chunk is retried on its own with the step's retry
+policy, and the variables are extracted from the response to the last chunk.
+"""
+import contextlib
+import math
+import mmap
+import os
+
+from django.conf import settings
+
+from omnipost_api import storage
+
+
+DEFAULTS = {
+    "CHUNK_SIZE": 8 * 1024 * 1024,
+}
+
+BODY_TYPES = ("raw", "multipart")
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "CHUNKED_UPLOAD", {})}
+
+
+class ChunkedUpload:
+    """
+    The compiled `upload` option of a step.
+    """
+    __slots__ = ("chunk_size", "body", "field", "chunk_codes")
+
+    def __init__(self, options: dict):
+        self.chunk_size = int(options.get("chunk_size") or get_config()["CHUNK_SIZE"])
+        self.body = options.get("body", "raw")
+        self.field = options.get("field", "media")
+        self.chunk_codes = frozenset(int(code) for code in options.get("chunk_codes", []))
+        if self.chunk_size < 1:
+            raise ValueError("chunk_size of an upload step must be positive.")
+        if self.body not in BODY_TYPES:
+            raise ValueError(f"body of an upload step must be one of {', '.join(BODY_TYPES)}.")
+
+    def request_body(self, request: dict, chunk: bytes, file_name: str) -> dict:
+        """
+        The body keyword arguments of the request that sends `chunk`.
+        """
+        if self.body == "multipart":
+            return {
+                "data": request["payload"],
+                "files": {self.field: (file_name, chunk, "application/octet-stream")},
+            }
+        return {"data": chunk}
+
+
+class LocalMedia:
+    """
+    A media file in local storage, read through a memory map.
+    """
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # A zero-length file can not be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def read(self, start: int, length: int) -> bytes:
+        return self._map[start:start + length]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class BucketMedia:
+    """
+    A media file in the media bucket, read with ranged GETs.
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self.size = storage.object_size(key)
+
+    def read(self, start: int, length: int) -> bytes:
+        return storage.read_range(self.key, start, length)
+
+    def close(self) -> None:
+        pass
+
+
+@contextlib.contextmanager
+def open_media(field_file, key: str = None):
+    """
+    Open the file of a `FileField` for reading in chunks, from local storage if it is there.
+
+    Otherwise it is read from the bucket at `key`, the key of the post's `MediaObject`
+    (see `storage.content_key`), or at the file's name if the post has no object.
+
+    Raises:
+        ValueError: If the file is empty or can not be found
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        # Storages without a local filesystem path
+        path = None
+
+    if path is not None and os.path.exists(path):
+        media = LocalMedia(path)
+    else:
+        try:
+            media = BucketMedia(key or field_file.name)
+        except Exception as e:
+            raise ValueError(f"Media file {key or field_file.name} could not be opened: {e}")
+    try:
+        if not media.size:
+            raise ValueError(f"Media file {field_file.name} is empty.")
+        yield media
+    finally:
+        media.close()
+
+
+def iter_chunks(media, chunk_size: int):
+    """
+    Yield `(placeholders, chunk)` for every chunk of the media, in order.
+    """
+    total_chunks = math.ceil(media.size / chunk_size)
+    for index in range(total_chunks):
+        start = index * chunk_size
+        length = min(chunk_size, media.size - start)
+        placeholders = {
+            "CHUNK_INDEX": index,
+            "CHUNK_START": start,
+            "CHUNK_END": start + length - 1,
+            "CHUNK_LENGTH": length,
+            "TOTAL_SIZE": media.size,
+            "TOTAL_CHUNKS": total_chunks,
+        }
+        yield placeholders, media.read(start, length)
@@ -0,0 +1,139 @@
+"""
+Enqueues the publishes of scheduled posts when they come due.
+
+`publish_many` stores the jobs of a scheduled post as `PublishIntent` rows instead of
+RQ scheduled jobs, so Redis only ever holds the jobs that are about to run. The
+dispatcher polls the pending intents that are due, oldest first, in batches of
+`BATCH_SIZE`. A batch is locked with `SELECT ... FOR UPDATE SKIP LOCKED`, so several
+dispatchers can run side by side without enqueueing an intent twice: each one skips
+the rows another is dispatching. The jobs of a batch and their secret handles are
+written in one Redis pipeline and the rows marked dispatched in the same transaction.
+
+Run it with `python manage.py dispatch_publish_intents`.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django_rq import get_queue
+from rq import Queue
+
+from omnipost_api import job_secrets, platform_registry
+from omnipost_api.models import POST_MODELS, PlatformInstance, PublishIntent, publish_job_timeout, run_action_chains
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "BATCH_SIZE": 100,
+    # Seconds between polls while nothing is due
+    "POLL_INTERVAL": 1.0,
+    "QUEUE": "default",
+}
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "PUBLISH_DISPATCHER", {})}
+
+
+def _job_timeouts(intents: list) -> list:
+    """
+    The `job_timeout` of every intent's job, from the current platform configs and media sizes.
+    """
+    instance_platforms = dict(
+        PlatformInstance.objects.filter(
+            id__in={platform_instance_id for intent in intents for platform_instance_id in intent.platform_instance_ids}
+        ).values_list('id', 'platform_id')
+    )
+    post_ids = {}
+    for intent in intents:
+        post_ids.setdefault(intent.post_type, set()).add(intent.object_id)
+    media_sizes = {
+        (post_type, post_id): (media_info or {}).get("size")
+        for post_type, ids in post_ids.items()
+        for post_id, media_info in POST_MODELS[post_type].objects.filter(id__in=ids).values_list('id', 'media_info')
+    }
+    job_timeouts = []
+    for intent in intents:
+        try:
+            job_timeout = publish_job_timeout(
+                [
+                    platform_registry.get_platform(instance_platforms[platform_instance_id])
+                    for platform_instance_id in intent.platform_instance_ids if platform_instance_id in instance_platforms
+                ],
+                intent.action,
+                media_sizes.get((intent.post_type, intent.object_id)),
+            )
+        except Exception as e:
+            # The job fails on its own, eg. if the platform lost the action; it should not hold up the batch
+            logger.warning("Could not compute the timeout of %s: %s", intent, e)
+            job_timeout = None
+        job_timeouts.append(job_timeout)
+    return job_timeouts
+
+
+def dispatch_due(now=None) -> int:
+    """
+    Enqueue one batch of the intents that are due.
+
+    Returns:
+        int: The number of intents dispatched
+    """
+    config = get_config()
+    now = now or timezone.now()
+    with transaction.atomic():
+        intents = list(
+            PublishIntent.objects.select_for_update(skip_locked=True)
+            .filter(dispatched_at=None, cancelled_at=None, due_at__lte=now)
+            .order_by('due_at', 'id')[:config["BATCH_SIZE"]]
+        )
+        if not intents:
+            return 0
+
+        q = get_queue(config["QUEUE"])
+        job_timeouts = _job_timeouts(intents)
+        with q.connection.pipeline() as pipe:
+            jobs = []
+            for intent, job_timeout in zip(intents, job_timeouts):
+                kwargs = dict(
+                    post_type=intent.post_type,
+                    post_id=intent.object_id,
+                    platform_instance_ids=intent.platform_instance_ids,
+                    action=intent.action,
+                    secret=job_secrets.stash_encrypted(intent.secret, pipeline=pipe),
+                )
+                if intent.step:
+                    kwargs["step"] = intent.step
+                if intent.variables:
+                    kwargs["variables"] = intent.variables
+                jobs.append(Queue.prepare_data(run_action_chains, kwargs=kwargs, timeout=job_timeout))
+            q.enqueue_many(jobs, pipeline=pipe)
+            # Marked before the jobs are written: if Redis fails, the rows are rolled back with the lock
+            PublishIntent.objects.filter(id__in=[intent.id for intent in intents]).update(
+                dispatched_at=timezone.now(), secret=""
+            )
+            pipe.execute()
+    return len(intents)
+
+
+def run() -> None:
+    """
+    Dispatch due intents until the process is stopped.
+    """
+    while True:
+        config = get_config()
+        try:
+            dispatched = dispatch_due()
+        except Exception:
+            logger.exception("Could not dispatch the due publish intents")
+            dispatched = 0
+        finally:
+            # As at the end of a request, so a dropped database connection is replaced
+            close_old_connections()
+        if dispatched:
+            logger.info("Dispatched %s publish intents", dispatched)
+        # A full batch means more may be due already
+        if dispatched < config["BATCH_SIZE"]:
+            time.sleep(config["POLL_INTERVAL"])
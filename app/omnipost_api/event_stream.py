@@ -0,0 +1,105 @@
+"""
+ASGI application that serves the event streams of `omnipost_api.events`.
+
+Django's ASGI handler gives every request a thread of its own for the sync parts of
+the request (middleware, authentication) and keeps it until the response ends. An
+event stream stays open for hours, so that would be a thread per connected client.
+This application answers GET requests to `EVENTS["PATH"]` itself: the client is
+authenticated with the API's authentication classes on a shared thread pool, after
+which the stream is served by the event loop alone. Every other request goes to the
+Django application it wraps, see `app.asgi`.
+"""
+import asyncio
+import io
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.utils.functional import SimpleLazyObject
+
+from omnipost_api import events
+from omnipost_api.views import authenticate_request
+
+
+def _authenticate(request):
+    # What SessionMiddleware and AuthenticationMiddleware would have set, for SessionAuthentication
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    request.user = SimpleLazyObject(lambda: get_user(request))
+    try:
+        return authenticate_request(request)
+    finally:
+        # As at the end of a request; the pool threads are shared by all the streams being opened
+        close_old_connections()
+
+
+async def _disconnected(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class EventStreamApplication:
+    def __init__(self, application):
+        self.application = application
+        self.path = events.get_config()["PATH"]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path or scope["method"] != "GET":
+            return await self.application(scope, receive, send)
+
+        request = ASGIRequest(scope, io.BytesIO())
+        user = await sync_to_async(_authenticate, thread_sensitive=False)(request)
+        headers = []
+        if getattr(settings, "CORS_ALLOW_ALL_ORIGINS", False) and "origin" in request.headers:
+            headers.append((b"access-control-allow-origin", b"*"))
+        if user is None:
+            await send({
+                "type": "http.response.start",
+                "status": 401,
+                "headers": [(b"content-type", b"application/json"), *headers],
+            })
+            await send({
+                "type": "http.response.body",
+                "body": b'{"error": "Authentication credentials were not provided."}',
+            })
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                # Proxies must pass events through as they come instead of buffering the response
+                (b"x-accel-buffering", b"no"),
+                *headers,
+            ],
+        })
+        await self.stream(user.id, receive, send)
+
+    async def stream(self, user_id: int, receive, send) -> None:
+        config = events.get_config()
+        hub = events.get_hub()
+        queue = await hub.subscribe(user_id)
+        disconnected = asyncio.ensure_future(_disconnected(receive))
+        try:
+            await send({"type": "http.response.body", "body": f"retry: {config['RETRY']}\n\n".encode(), "more_body": True})
+            while True:
+                message = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {message, disconnected}, timeout=config["KEEPALIVE"], return_when=asyncio.FIRST_COMPLETED
+                )
+                if message in done:
+                    chunk = events.format_event(message.result())
+                else:
+                    message.cancel()
+                    if disconnected in done:
+                        break
+                    chunk = events.KEEPALIVE_COMMENT
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        finally:
+            disconnected.cancel()
+            await hub.unsubscribe(user_id, queue)
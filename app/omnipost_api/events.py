@@ -0,0 +1,187 @@
+"""
+Live events of a user: new notifications and changes to the publish state of posts.
+
+Workers publish events on a Redis pub/sub channel per user. Web processes stream
+them to clients as server-sent events on `/events/` (`omnipost_api.event_stream`
+under ASGI, `EventStreamView` otherwise), so clients do not have to poll
+`/notifications` to learn how a publish went.
+
+Each process holds a single Redis connection for all of its streams (`EventHub`):
+it subscribes to the channel of a user while at least one of their streams is open
+and hands every message to the streams' queues. An idle stream costs one task and
+one queue, not a connection to Redis. Events are not stored; a client that was
+disconnected catches up with `/notifications`.
+
+Events are JSON objects with a `type`:
+- `notification`: a `Notification` was written, with its `id`, `notification`, `error`,
+  `post_type`, `post_id`, `platform_instance_id` and `created_at`
+- `media_status`: the media of a post is `READY` or `FAILED`
+- `published`: a post was published on a platform instance
+"""
+import asyncio
+import json
+import logging
+import weakref
+
+import django_rq
+import redis.asyncio
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "CHANNEL_PREFIX": "omnipost:events:",
+    # Served by omnipost_api.event_stream under ASGI
+    "PATH": "/events/",
+    "REDIS_QUEUE": "default",
+    # Seconds between keep-alive comments on an idle stream
+    "KEEPALIVE": 15,
+    # Milliseconds a client waits before reconnecting
+    "RETRY": 3000,
+    # Events kept for a stream that reads slowly; the oldest are dropped beyond that
+    "QUEUE_SIZE": 100,
+}
+
+KEEPALIVE_COMMENT = ": keep-alive\n\n"
+
+# Keyword arguments of a sync Redis connection that also apply to an async one
+CONNECTION_KWARGS = ("host", "port", "db", "username", "password", "path")
+
+# One hub per event loop, as its connection and tasks belong to the loop
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "EVENTS", {})}
+
+
+def channel(user_id: int) -> str:
+    return f"{get_config()['CHANNEL_PREFIX']}{user_id}"
+
+
+def publish_many(events: list) -> None:
+    """
+    Publish (user id, type, data) events in a single round trip. Failures are only logged.
+    """
+    if not events:
+        return
+    try:
+        with django_rq.get_connection(get_config()["REDIS_QUEUE"]).pipeline(transaction=False) as pipe:
+            for user_id, event_type, data in events:
+                pipe.publish(channel(user_id), json.dumps({"type": event_type, **data}, default=str))
+            pipe.execute()
+    except Exception as e:
+        logger.warning("Could not publish %s events: %s", len(events), e)
+
+
+def publish(user_id: int, event_type: str, **data) -> None:
+    publish_many([(user_id, event_type, data)])
+
+
+class EventHub:
+    """
+    Fans the events of one Redis connection out to the open streams of an event loop.
+    """
+    def __init__(self):
+        self.config = get_config()
+        sync_kwargs = django_rq.get_connection(self.config["REDIS_QUEUE"]).connection_pool.connection_kwargs
+        self.redis = redis.asyncio.Redis(**{key: sync_kwargs[key] for key in CONNECTION_KWARGS if key in sync_kwargs})
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        # user id -> queues of the user's open streams
+        self.listeners = {}
+        self.reader = None
+        # Concurrent first commands would each open a connection and orphan all but one
+        self.lock = asyncio.Lock()
+
+    async def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.config["QUEUE_SIZE"])
+        queues = self.listeners.setdefault(user_id, set())
+        queues.add(queue)
+        if len(queues) == 1:
+            async with self.lock:
+                await self.pubsub.subscribe(channel(user_id))
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.create_task(self._read())
+        return queue
+
+    async def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self.listeners.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.listeners[user_id]
+            try:
+                async with self.lock:
+                    await self.pubsub.unsubscribe(channel(user_id))
+            except Exception as e:
+                # Messages for users without streams are dropped anyway
+                logger.warning("Could not unsubscribe from the events of user %s: %s", user_id, e)
+
+    def _dispatch(self, message: dict) -> None:
+        name = message["channel"].decode() if isinstance(message["channel"], bytes) else message["channel"]
+        try:
+            user_id = int(name[len(self.config["CHANNEL_PREFIX"]):])
+        except ValueError:
+            return
+        for queue in self.listeners.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message["data"])
+
+    async def _read(self) -> None:
+        while True:
+            if self.pubsub.connection is None:
+                # The first subscribe has not connected yet
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The connection is re-established and resubscribed by the next read
+                logger.warning("Event hub disconnected from Redis: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if message is not None and message["type"] == "message":
+                self._dispatch(message)
+
+
+def get_hub() -> EventHub:
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = EventHub()
+    return hub
+
+
+def format_event(data) -> str:
+    """
+    A message from the channel as a server-sent event.
+    """
+    if isinstance(data, bytes):
+        data = data.decode()
+    event_type = json.loads(data).get("type", "message")
+    return f"event: {event_type}\ndata: {data}\n\n"
+
+
+async def stream(user_id: int):
+    """
+    The server-sent events of a user, with keep-alive comments while there are none.
+    """
+    config = get_config()
+    hub = get_hub()
+    queue = await hub.subscribe(user_id)
+    try:
+        yield f"retry: {config['RETRY']}\n\n"
+        while True:
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout=config["KEEPALIVE"])
+            except asyncio.TimeoutError:
+                yield KEEPALIVE_COMMENT
+                continue
+            yield format_event(data)
+    finally:
+        await hub.unsubscribe(user_id, queue)
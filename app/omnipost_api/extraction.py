@@ -0,0 +1,140 @@
+"""
+Compiled extraction of step variables from platform responses.
+
+The keys of a step's `variable_mapping` are path expressions into the response,
+the values are the names of the variables they are stored under:
+```
+{
+    "id": "CONTAINER_ID",                   # top-level key of the JSON body
+    "data.id": "POST_ID",                   # nested key
+    "media[0].id": "MEDIA_ID",              # array index, negative indices count from the end
+    "upload['url.v2']": "UPLOAD_URL",       # key that contains dots or brackets
+    "headers.Location": "UPLOAD_URL",       # response header, case-insensitive
+    "data.cursor ?? null": "NEXT_CURSOR",   # default (JSON, or a plain string) if the path is missing
+    "terminal_request": true                # marks the step that publishes the post
+}
+```
+Each expression is parsed once into a list of accessors when the step is compiled,
+and cached with the platform config. A response body is parsed at most once, and
+not at all if only headers are extracted.
+"""
+import json
+import re
+
+
+TERMINAL_KEY = "terminal_request"
+HEADERS_PREFIX = "headers."
+
+# name | [index] | ['key'] / ["key"]
+SEGMENT_PATTERN = re.compile(r"""\.?([^.\[\]]+)|\[(-?\d+)\]|\[(['"])(.*?)\3\]""")
+
+_MISSING = object()
+
+
+class ExtractionError(ValueError):
+    pass
+
+
+def parse_path(path: str) -> list:
+    """
+    Split a path such as `data.items[0]['a.b']` into its keys and indices.
+
+    Raises:
+        ValueError: If the path is malformed
+    """
+    segments = []
+    position = 0
+    while position < len(path):
+        match = SEGMENT_PATTERN.match(path, position)
+        if match is None or (match.group(0).startswith(".") and position == 0):
+            raise ValueError(f"Invalid path expression '{path}' at position {position}.")
+        name, index, _, quoted = match.groups()
+        if index is not None:
+            segments.append(int(index))
+        elif quoted is not None:
+            segments.append(quoted)
+        else:
+            segments.append(name.strip())
+        position = match.end()
+    if not segments:
+        raise ValueError("Empty path expression.")
+    return segments
+
+
+def _parse_default(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def compile_expression(expression: str):
+    """
+    Compile one mapping key into `accessor(body, headers) -> value`.
+
+    `body` is a callable returning the parsed JSON body, so that it is only parsed when needed.
+    """
+    path, has_default, default = expression, False, None
+    if "??" in expression:
+        path, default_text = expression.split("??", 1)
+        path, has_default, default = path.strip(), True, _parse_default(default_text.strip())
+
+    if path.startswith(HEADERS_PREFIX):
+        header = path[len(HEADERS_PREFIX):]
+
+        def from_headers(body, headers):
+            value = headers.get(header, _MISSING)
+            if value is _MISSING:
+                if has_default:
+                    return default
+                raise ExtractionError(f"Response has no '{header}' header.")
+            return value
+        return from_headers
+
+    segments = parse_path(path)
+
+    def from_body(body, headers):
+        value = body()
+        for segment in segments:
+            try:
+                value = value[segment]
+            except (KeyError, IndexError, TypeError):
+                if has_default:
+                    return default
+                raise ExtractionError(f"Response has no '{path}'.")
+        return value
+    return from_body
+
+
+class Extractor:
+    """
+    The compiled `variable_mapping` of a step.
+    """
+    __slots__ = ("accessors", "terminal")
+
+    def __init__(self, variable_mapping: dict):
+        self.terminal = bool(variable_mapping.get(TERMINAL_KEY))
+        self.accessors = [
+            (name, compile_expression(expression))
+            for expression, name in variable_mapping.items()
+            if expression != TERMINAL_KEY
+        ]
+
+    def extract(self, response) -> dict:
+        """
+        The variables of a `requests.Response`, by variable name.
+
+        Raises:
+            ExtractionError: If a path without a default is not in the response
+        """
+        parsed = []
+
+        def body():
+            if not parsed:
+                try:
+                    parsed.append(response.json())
+                except ValueError:
+                    raise ExtractionError(f"Response is not JSON: {response.text[:200]}")
+            return parsed[0]
+
+        return {name: accessor(body, response.headers) for name, accessor in self.accessors}
@@ -1,22 +1,129 @@
 import base64
+import hashlib
+import hmac
 import os
-from typing import Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Hashable
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from django.conf import settings
+
+
+DEFAULTS = {
+    "MAX_SIZE": 256,
+    # Seconds a derived key is kept for
+    "TTL": 300,
+}
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "FERNET_KEY_CACHE", {})}
+
+
+class DerivedKeyCache:
+    """
+    Bounded LRU cache of derived Fernet instances with a time to live.
+    
+    Entries are keyed on a caller supplied scope (eg. the platform instance id), the salt
+    and an HMAC of the password under a per-process secret, so neither the password nor
+    anything that can be checked against it offline is kept as a key. Entries expire
+    `ttl` seconds after they were derived, whether or not they are being used.
+    
+    `max_size` and `ttl` default to `settings.FERNET_KEY_CACHE`, read when the cache is used.
+    """
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+    
+    @property
+    def max_size(self) -> int:
+        return self._max_size if self._max_size is not None else int(get_config()["MAX_SIZE"])
+    
+    @property
+    def ttl(self) -> float:
+        return self._ttl if self._ttl is not None else float(get_config()["TTL"])
+    
+    def _key(self, scope: Hashable, salt: bytes, password: bytes) -> tuple:
+        password_hash = hmac.new(self._secret, password, hashlib.sha256).digest()
+        return (scope, bytes(salt), password_hash)
+    
+    def get_or_derive(self, scope: Hashable, salt: bytes, password: bytes, derive: Callable[[], Fernet]) -> Fernet:
+        """Return the cached Fernet for this scope, salt and password, deriving it on a miss."""
+        max_size, ttl = self.max_size, self.ttl
+        if max_size <= 0 or ttl <= 0:
+            return derive()
+        
+        key = self._key(scope, salt, password)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                fernet, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return fernet
+                del self._entries[key]
+            self.misses += 1
+        
+        # Derive outside the lock so that other keys are not held up by the KDF
+        fernet = derive()
+        with self._lock:
+            self._entries[key] = (fernet, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return fernet
+    
+    def clear(self) -> None:
+        """Drop every cached key."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
+
+
+# Worker-local cache shared by every encryptor created with a cache scope
+derived_key_cache = DerivedKeyCache()
+
 
 class FernetEncryptor:
-    def __init__(self, password: str = None, salt: bytes = None):
+    def __init__(self, password: str = None, salt: bytes = None, cache_scope: Hashable = None):
         """
         Initialize the encryptor with password and optional salt.
         If salt is not provided, a random one will be generated.
+        If a `cache_scope` is given along with a salt, the derived key is looked up in
+        (and stored to) `derived_key_cache` instead of running the KDF every time.
         """
         if password is None:
             password = base64.urlsafe_b64encode(os.urandom(32)).decode('utf-8')
         self.password = password.encode()
         self.salt = salt or os.urandom(16)  # Generate salt if not provided
-        self.fernet = self._create_fernet()
+        if cache_scope is not None and salt:
+            self.fernet = derived_key_cache.get_or_derive(cache_scope, self.salt, self.password, self._create_fernet)
+        else:
+            self.fernet = self._create_fernet()
     
     def _create_fernet(self) -> Fernet:
         """Create a Fernet instance using the password and salt."""
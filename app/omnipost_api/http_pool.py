@@ -0,0 +1,149 @@
+"""
+Per-process keep-alive HTTP sessions for calls to platform APIs.
+
+One `requests.Session` is kept per scheme and host, so consecutive requests to
+the same platform reuse an open TCP/TLS connection instead of resolving and
+handshaking again. Sessions are shared by every account on a platform, so they
+never store cookies. Pool sizes and timeouts come from `settings.OUTBOUND_HTTP`.
+"""
+import http.cookiejar
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+DEFAULTS = {
+    "POOL_CONNECTIONS": 10,
+    "POOL_MAXSIZE": 20,
+    "POOL_BLOCK": False,
+    "CONNECT_TIMEOUT": 5.0,
+    "READ_TIMEOUT": 60.0,
+}
+
+_sessions = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "OUTBOUND_HTTP", {})}
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _new_session(config: dict) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=config["POOL_CONNECTIONS"],
+        pool_maxsize=config["POOL_MAXSIZE"],
+        pool_block=config["POOL_BLOCK"],
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # The session is shared by every user and platform instance on the host, so cookies set
+    # by the response to one account must never be sent with the requests of another
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Return the pooled session for the host of `url`, creating it on first use.
+    """
+    host = _host_key(url)
+    session = _sessions.get(host)
+    if session is None:
+        with _lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _new_session(get_config())
+                _sessions[host] = session
+                _counters[host] = {"requests": 0, "errors": 0}
+    return session
+
+
+def _count(host: str, counter: str) -> None:
+    with _lock:
+        if host in _counters:
+            _counters[host][counter] += 1
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Drop-in for `requests.request` that goes through the host's pooled session.
+
+    A `(connect, read)` timeout from the config is applied unless one is passed.
+    """
+    if "timeout" not in kwargs:
+        config = get_config()
+        kwargs["timeout"] = (config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"])
+
+    host = _host_key(url)
+    session = get_session(url)
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        _count(host, "errors")
+        raise
+    _count(host, "requests")
+    return response
+
+
+def retry_after(response: requests.Response) -> float:
+    """
+    Seconds to wait according to the response's `Retry-After` header, or None if it has none.
+
+    The header holds either a number of seconds or an HTTP date.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def pool_stats() -> dict:
+    """
+    Per host request counters and connection pool usage of this process.
+
+    `connections` is the number of connections opened so far; it stays flat
+    while keep-alive connections are being reused.
+    """
+    stats = {}
+    with _lock:
+        for host, session in _sessions.items():
+            adapter = session.get_adapter(host)
+            pools = [adapter.poolmanager.pools[key] for key in adapter.poolmanager.pools.keys()]
+            stats[host] = {
+                **_counters[host],
+                "connections": sum(pool.num_connections for pool in pools),
+                "pooled_requests": sum(pool.num_requests for pool in pools),
+                # The pool queue is pre-filled with None placeholders; count real connections only
+                "idle": sum(1 for pool in pools if pool.pool is not None for conn in list(pool.pool.queue) if conn is not None),
+            }
+    return stats
+
+
+def close_all() -> None:
+    """
+    Close every pooled session, eg. before forking or on shutdown.
+    """
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _counters.clear()
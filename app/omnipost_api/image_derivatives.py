@@ -0,0 +1,193 @@
+"""
+Per-platform derivatives of image posts.
+
+Platforms that want images in a particular shape declare an `IMAGE_PROFILE` in
+`Platform.config`:
+```
+"IMAGE_PROFILE": {"max_width": 1440, "max_height": 1800, "min_aspect_ratio": 0.8, "max_aspect_ratio": 1.91,
+                  "format": "JPEG", "quality": 85}
+```
+The offload job renders one variant of the post's image per distinct profile: it is
+center-cropped into the aspect ratio range, scaled down to fit the maximum size (never
+up) and re-encoded. Each platform then publishes the URL of its own variant as its
+`IMAGE_URL`; platforms without a profile keep the original.
+
+Rendering is CPU bound, so it runs in a pool of worker processes rather than in the
+job's threads. Variants are stored in the bucket under the SHA-256 of the source and
+a hash of the profile, with their dimensions in the object metadata, so an image that
+was already rendered for a profile is never rendered again. They are deleted with the
+source, see `MediaObject.release`.
+"""
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from omnipost_api import storage
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "PROCESSES": 2,
+    # Seconds to wait for one variant before publishing the original instead
+    "TIMEOUT": 120,
+}
+
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+# Formats that can not store an alpha channel
+OPAQUE_FORMATS = {"JPEG"}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "IMAGE_DERIVATIVES", {})}
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    The process pool of this worker, started on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the worker has threads (platform registry, HTTP pool)
+            _pool = ProcessPoolExecutor(
+                max_workers=get_config()["PROCESSES"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def profile_id(profile: dict) -> str:
+    return hashlib.sha256(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def render(source, profile: dict) -> tuple:
+    """
+    Render the variant of an image for a profile. Runs in the pool, so it only takes plain data.
+
+    Args:
+        source: Path of the image or its bytes
+        profile (dict): An `IMAGE_PROFILE`
+    Returns:
+        tuple: (encoded image, info) where info has the `format`, `width`, `height` and `size`
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    image_format = profile.get("format", "JPEG").upper()
+    with Image.open(source) as image:
+        max_width, max_height = profile.get("max_width"), profile.get("max_height")
+        if max_width and max_height and not image.getexif().get(0x0112):
+            # Lets JPEG decode at a reduced scale that is still at least the target size
+            image.draft("RGB", (max_width, max_height))
+        image = ImageOps.exif_transpose(image)
+
+        width, height = image.size
+        low, high = profile.get("min_aspect_ratio"), profile.get("max_aspect_ratio")
+        if low and width / height < low:
+            crop = round(width / low)
+            top = (height - crop) // 2
+            image = image.crop((0, top, width, top + crop))
+        elif high and width / height > high:
+            crop = round(height * high)
+            left = (width - crop) // 2
+            image = image.crop((left, 0, left + crop, height))
+
+        image.thumbnail((max_width or image.width, max_height or image.height), Image.LANCZOS)
+        if image_format in OPAQUE_FORMATS and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, image_format, quality=profile.get("quality", 85), optimize=True)
+        info = {"format": image_format, "width": image.width, "height": image.height}
+    data = output.getvalue()
+    info["size"] = len(data)
+    return data, info
+
+
+def derived_prefix(digest: str) -> str:
+    return f"{storage.get_config()['DERIVED_PREFIX']}{digest}/"
+
+
+def _read_source(field_file, source_key: str):
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path is not None and os.path.exists(path):
+        return path
+    return storage.read_object(source_key)
+
+
+def derive_for_platforms(field_file, source_key: str, digest: str, platforms) -> dict:
+    """
+    Render, or find in the bucket, the variants of an image for the platforms with an `IMAGE_PROFILE`.
+
+    A variant that fails to render is logged and left out; its platforms publish the original.
+
+    Args:
+        field_file: The post's image
+        source_key (str): Key of the image in the bucket, read if it is not in local storage
+        digest (str): SHA-256 of the image
+        platforms: `Platform`s the post may be published on
+    Returns:
+        dict: By platform name, the `url` of the platform's variant and its `format`,
+            `width`, `height` and `size`
+    """
+    profiles = {}
+    for platform in platforms:
+        profile = (platform.config or {}).get("IMAGE_PROFILE")
+        if profile:
+            profiles.setdefault(profile_id(profile), (profile, []))[1].append(platform.name)
+    if not profiles:
+        return {}
+
+    variants = {}
+    pending = {}
+    source = None
+    for pid, (profile, names) in profiles.items():
+        extension = FORMAT_EXTENSIONS.get(profile.get("format", "JPEG").upper(), "")
+        key = f"{derived_prefix(digest)}{pid}{extension}"
+        metadata = storage.object_metadata(key)
+        if metadata:
+            variants[pid] = {
+                "url": storage.public_url(key),
+                "format": metadata.get("format"),
+                "width": int(metadata.get("width", 0)),
+                "height": int(metadata.get("height", 0)),
+                "size": int(metadata.get("size", 0)),
+            }
+            continue
+        if source is None:
+            source = _read_source(field_file, source_key)
+        pending[pid] = (key, get_pool().submit(render, source, profile))
+
+    timeout = get_config()["TIMEOUT"]
+    for pid, (key, future) in pending.items():
+        try:
+            data, info = future.result(timeout=timeout)
+            content_type = Image.MIME.get(info["format"])
+            storage.upload_fileobj(
+                io.BytesIO(data), key, size=len(data), content_type=content_type,
+                metadata={name: str(value) for name, value in info.items()},
+            )
+        except Exception as e:
+            logger.warning("Could not render the %s variant of %s: %s", pid, digest, e)
+            continue
+        variants[pid] = {"url": storage.public_url(key), **info}
+
+    return {
+        name: variants[pid]
+        for pid, (_, names) in profiles.items() if pid in variants
+        for name in names
+    }
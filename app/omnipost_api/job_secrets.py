@@ -0,0 +1,84 @@
+"""
+Short-lived secrets handed to RQ jobs by reference.
+
+Publish jobs only carry ids and a secret handle. The password needed to decrypt
+the platform credentials is encrypted with a key derived from `SECRET_KEY` and
+stored in Redis under a random handle that expires after `JOB_SECRETS["TTL"]`
+seconds. Scheduled publishes keep the encrypted password in their `PublishIntent`
+and only stash it when they come due, see `omnipost_api.dispatcher`.
+"""
+import base64
+import hashlib
+import secrets
+
+import django_rq
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+
+
+DEFAULTS = {
+    "TTL": 3600,
+    "KEY_PREFIX": "omnipost:secret:",
+    "REDIS_QUEUE": "default",
+}
+
+
+class SecretExpired(ValueError):
+    pass
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "JOB_SECRETS", {})}
+
+
+def _fernet() -> Fernet:
+    key = hashlib.sha256(f"omnipost-job-secrets:{settings.SECRET_KEY}".encode()).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def encrypt_secret(secret: str) -> str:
+    """
+    The secret encrypted as it is stored in Redis, for `stash_encrypted` to store later.
+    """
+    return _fernet().encrypt(secret.encode()).decode()
+
+
+def stash_encrypted(token: str, ttl: int = None, pipeline=None) -> str:
+    """
+    Store a secret encrypted with `encrypt_secret` for jobs to pick up and return its handle.
+    """
+    config = get_config()
+    handle = secrets.token_urlsafe(16)
+    connection = pipeline if pipeline is not None else django_rq.get_connection(config["REDIS_QUEUE"])
+    connection.set(config["KEY_PREFIX"] + handle, token, ex=int(ttl or config["TTL"]))
+    return handle
+
+
+def stash_secret(secret: str, ttl: int = None, pipeline=None) -> str:
+    """
+    Store a secret for jobs to pick up and return its handle.
+
+    Args:
+        secret (str): The secret, eg. the password that decrypts the credentials
+        ttl (int): Seconds the secret is kept for, defaults to `JOB_SECRETS["TTL"]`
+        pipeline: Redis pipeline to write with, eg. the one the jobs are enqueued in
+    Returns:
+        str: The handle to pass to the job
+    """
+    return stash_encrypted(encrypt_secret(secret), ttl=ttl, pipeline=pipeline)
+
+
+def resolve_secret(handle: str) -> str:
+    """
+    Raises:
+        SecretExpired: If the handle is unknown or has expired
+    """
+    config = get_config()
+    token = django_rq.get_connection(config["REDIS_QUEUE"]).get(config["KEY_PREFIX"] + handle)
+    if token is None:
+        raise SecretExpired("The password for this job has expired, publish the post again.")
+    try:
+        return _fernet().decrypt(token).decode()
+    except InvalidToken:
+        raise SecretExpired("The password for this job could not be decrypted, publish the post again.")
+
@@ -0,0 +1,131 @@
+import json
+import pickle
+import time
+import uuid
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django_rq import get_connection
+from rq import Queue
+from rq.job import Job
+
+from omnipost_api.fernet import FernetEncryptor
+from omnipost_api.models import Platform, PlatformInstance, PostImage, User, run_action_chains
+
+
+class Command(BaseCommand):
+    """
+    Usage: python manage.py bench_job_payloads [--jobs 1000] [--instances 10]
+
+    Needs Redis and a migrated database: RQ builds each job's description from the repr of
+    its arguments, which for a post runs a query for its platform instances. That query is
+    part of the enqueue cost of the model instance payload.
+    """
+    help = (
+        "Compare the size in Redis and the enqueue/dequeue time of publish jobs that pickle "
+        "model instances and the password with jobs that only carry ids and a secret handle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=1000, help="Number of jobs to enqueue per payload type")
+        parser.add_argument('--instances', type=int, default=10, help="Platform instances per job")
+        parser.add_argument('--queue', default='default', help="RQ queue whose Redis connection is used")
+
+    def handle(self, *args, **options):
+        jobs, instances = options['jobs'], options['instances']
+        connection = get_connection(options['queue'])
+        # A throwaway queue, so that no worker picks the jobs up
+        queue = Queue(f"bench-{uuid.uuid4().hex[:8]}", connection=connection)
+
+        post, platform_instances = self.sample_objects(instances)
+        payloads = {
+            "model instances": dict(
+                post_object=post,
+                platform_instances=platform_instances,
+                action="POST_IMAGE",
+                password="Correct-Horse-Battery-9912!",
+            ),
+            "ids + secret handle": dict(
+                post_type=post.post_type,
+                post_id=post.pk,
+                platform_instance_ids=[platform_instance.pk for platform_instance in platform_instances],
+                action="POST_IMAGE",
+                secret="x" * 22,
+            ),
+        }
+
+        self.stdout.write(f"{jobs} jobs, {instances} platform instances per job\n")
+        self.stdout.write(f"{'payload':<22}{'pickled':>10}{'redis/job':>12}{'enqueue':>12}{'dequeue':>12}")
+        try:
+            for name, kwargs in payloads.items():
+                result = self.measure(queue, connection, kwargs, jobs)
+                self.stdout.write(
+                    f"{name:<22}{result['pickled']:>9}B{result['memory']:>11}B"
+                    f"{result['enqueue'] * 1000:>10.1f}ms{result['dequeue'] * 1000:>10.1f}ms"
+                )
+        finally:
+            queue.empty()
+            queue.delete(delete_jobs=True)
+
+    def sample_objects(self, instances):
+        """
+        Unsaved but realistic objects: an image post seeded for every sample platform,
+        and platform instances with encrypted credentials and a full platform config.
+        """
+        configs_dir = Path(__file__).resolve().parents[2] / 'platform_configs'
+        config = json.loads((configs_dir / 'instagram.json').read_text())
+        platform = Platform(id=1, name="Instagram", config=config)
+        user = User(id=1, username="bench")
+
+        encryptor = FernetEncryptor(password="Correct-Horse-Battery-9912!")
+        platform_instances = [
+            PlatformInstance(
+                id=i + 1,
+                platform=platform,
+                user=user,
+                credentials=encryptor.encrypt_dict({"ACCESS_TOKEN": "EAAB" + "x" * 180, "IG_ID": "17841400000000000"}),
+                salt=encryptor.salt,
+                instance_name=f"Instagram_bench_{i}",
+            )
+            for i in range(instances)
+        ]
+
+        post = PostImage(
+            id=1,
+            user=user,
+            caption="A caption of a typical length for a post, with a few #hashtags and a link. " * 3,
+            image="media/sample.jpg",
+            image_url="https://omnipost-images.s3.ap-south-1.amazonaws.com/media/sample.jpg",
+            created_at=timezone.now(),
+        )
+        post.post_configs = {
+            name: {"CAPTION": post.caption, "IMAGE_URL": post.image_url, "CONTAINER_ID": "1" * 17, "POST_ID": "2" * 17}
+            for name in ("Instagram", "Facebook", "LinkedIn", "X", "YouTube")
+        }
+        return post, platform_instances
+
+    def measure(self, queue, connection, kwargs, jobs):
+        start = time.perf_counter()
+        with connection.pipeline() as pipe:
+            enqueued = queue.enqueue_many(
+                [Queue.prepare_data(run_action_chains, kwargs=kwargs) for _ in range(jobs)],
+                pipeline=pipe,
+            )
+            pipe.execute()
+        enqueue = time.perf_counter() - start
+
+        memory = sum(connection.memory_usage(job.key) or 0 for job in enqueued) // jobs
+
+        start = time.perf_counter()
+        for job in enqueued:
+            # Accessing kwargs unpickles the payload, as the worker does before running it
+            Job.fetch(job.id, connection=connection).kwargs
+        dequeue = time.perf_counter() - start
+
+        return {
+            "pickled": len(pickle.dumps(kwargs, protocol=pickle.HIGHEST_PROTOCOL)),
+            "memory": memory,
+            "enqueue": enqueue,
+            "dequeue": dequeue,
+        }
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from omnipost_api import dispatcher
+
+
+class Command(BaseCommand):
+    """
+    Usage: python manage.py dispatch_publish_intents [--once]
+
+    Runs alongside the RQ workers. Several dispatchers can run at once, see
+    `omnipost_api.dispatcher`.
+    """
+    help = "Enqueue the publishes of scheduled posts when they come due."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Dispatch what is due now and exit")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            dispatched = 0
+            while True:
+                batch = dispatcher.dispatch_due()
+                dispatched += batch
+                if batch < dispatcher.get_config()["BATCH_SIZE"]:
+                    break
+            self.stdout.write(f"Dispatched {dispatched} publish intents")
+            return
+        dispatcher.run()
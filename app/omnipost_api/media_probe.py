@@ -0,0 +1,285 @@
+"""
+Probing of post media: what the file is, its size, dimensions, duration and codecs.
+
+Media is probed once per upload, in the offload job, and the result is stored in
+the post's `media_info`. Only the headers are parsed: Pillow reads the image header
+without decoding pixels, and MP4/MOV files are read box by box, seeking over the
+media data to the `moov` box. Other video containers are identified by their MIME
+type only. Results are cached in Redis by the file's SHA-256, so re-uploads of the
+same file are not probed again.
+
+Platforms declare what they accept in `Platform.config["MEDIA_LIMITS"]`, per kind
+of media:
+```
+"MEDIA_LIMITS": {
+    "IMAGE": {"formats": ["JPEG", "PNG"], "max_size": 8388608, "min_aspect_ratio": 0.8, "max_aspect_ratio": 1.91},
+    "VIDEO": {"containers": ["mp4", "mov"], "codecs": ["avc1", "hvc1"], "max_duration": 900, "max_width": 1920}
+}
+```
+Supported limits: `formats`, `containers`, `codecs`, `max_size`, `min_width`,
+`max_width`, `min_height`, `max_height`, `min_aspect_ratio`, `max_aspect_ratio`,
+`min_duration` and `max_duration`. A limit on a property the probe could not read
+is not enforced.
+"""
+import hashlib
+import json
+import logging
+import struct
+
+import django_rq
+import magic
+from django.conf import settings
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "KEY_PREFIX": "omnipost:probe:",
+    "REDIS_QUEUE": "default",
+    "CACHE_TTL": 30 * 24 * 3600,
+}
+
+READ_SIZE = 1024 * 1024
+
+MP4_BRANDS = {b"qt  ": "mov"}
+MP4_CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+class ProbeError(ValueError):
+    pass
+
+
+class IncompatibleMedia(ValueError):
+    pass
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "MEDIA_PROBE", {})}
+
+
+def file_digest(f) -> str:
+    """
+    SHA-256 of a file object, read from the start in blocks.
+    """
+    f.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: f.read(READ_SIZE), b""):
+        digest.update(block)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def probe_image(f) -> dict:
+    f.seek(0)
+    try:
+        # Only reads the header; pixels are decoded on first access, which never happens here
+        with Image.open(f) as image:
+            return {
+                "format": image.format,
+                "width": image.width,
+                "height": image.height,
+                "mode": image.mode,
+            }
+    except Exception as e:
+        raise ProbeError(f"Not a valid image: {e}")
+
+
+def _boxes(f, start: int, end: int):
+    """
+    Yield (type, payload start, box end) of the ISO base media boxes between two offsets.
+    """
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            raise ProbeError(f"Corrupt {kind!r} box at offset {position}.")
+        yield kind, position + header_size, min(position + size, end)
+        position += size
+
+
+def _read_at(f, offset: int, fmt: str) -> tuple:
+    f.seek(offset)
+    data = f.read(struct.calcsize(fmt))
+    if len(data) < struct.calcsize(fmt):
+        raise ProbeError("Truncated box.")
+    return struct.unpack(fmt, data)
+
+
+def _probe_mp4_boxes(f, start: int, end: int, info: dict, track: dict) -> None:
+    for kind, payload, box_end in _boxes(f, start, end):
+        if kind in MP4_CONTAINER_BOXES:
+            if kind == b"trak":
+                track = {}
+                _probe_mp4_boxes(f, payload, box_end, info, track)
+                if track.get("handler") == b"vide":
+                    info.setdefault("video_codec", track.get("codec"))
+                    if track.get("width"):
+                        info.setdefault("width", track["width"])
+                        info.setdefault("height", track["height"])
+                elif track.get("handler") == b"soun":
+                    info.setdefault("audio_codec", track.get("codec"))
+            else:
+                _probe_mp4_boxes(f, payload, box_end, info, track)
+        elif kind == b"mvhd":
+            (version,) = _read_at(f, payload, ">B")
+            if version == 1:
+                timescale, duration = _read_at(f, payload + 20, ">IQ")
+            else:
+                timescale, duration = _read_at(f, payload + 12, ">II")
+            if timescale:
+                info["duration"] = round(duration / timescale, 3)
+        elif kind == b"tkhd":
+            (version,) = _read_at(f, payload, ">B")
+            width, height = _read_at(f, payload + (88 if version == 1 else 76), ">II")
+            # 16.16 fixed point
+            track["width"], track["height"] = width >> 16, height >> 16
+        elif kind == b"hdlr":
+            (track["handler"],) = _read_at(f, payload + 8, ">4s")
+        elif kind == b"stsd":
+            (codec,) = _read_at(f, payload + 12, ">4s")
+            track["codec"] = codec.decode("latin-1").strip()
+
+
+def probe_mp4(f, size: int) -> dict:
+    """
+    Read the duration, dimensions and codecs of an MP4/MOV file from its `moov` box.
+    """
+    info = {"container": "mp4"}
+    for kind, payload, box_end in _boxes(f, 0, size):
+        if kind == b"ftyp":
+            (brand,) = _read_at(f, payload, ">4s")
+            info["container"] = MP4_BRANDS.get(brand, "mp4")
+        elif kind == b"moov":
+            _probe_mp4_boxes(f, payload, box_end, info, {})
+            break
+    return info
+
+
+def probe_video(f, size: int, mime: str) -> dict:
+    f.seek(4)
+    if f.read(4) in (b"ftyp", b"moov", b"mdat", b"wide", b"free"):
+        return probe_mp4(f, size)
+    if not mime.startswith("video/"):
+        raise ProbeError(f"Not a valid video ({mime}).")
+    # Other containers (WebM, MKV, AVI, ...) are only identified
+    return {"container": mime.split("/", 1)[1]}
+
+
+def _cache_get(digest: str):
+    config = get_config()
+    try:
+        cached = django_rq.get_connection(config["REDIS_QUEUE"]).get(config["KEY_PREFIX"] + digest)
+    except Exception as e:
+        logger.warning("Media probe cache unavailable: %s", e)
+        return None
+    return json.loads(cached) if cached else None
+
+
+def _cache_set(digest: str, info: dict) -> None:
+    config = get_config()
+    try:
+        django_rq.get_connection(config["REDIS_QUEUE"]).set(
+            config["KEY_PREFIX"] + digest, json.dumps(info), ex=config["CACHE_TTL"]
+        )
+    except Exception as e:
+        logger.warning("Media probe cache unavailable: %s", e)
+
+
+def probe(field_file, kind: str, digest: str = None) -> dict:
+    """
+    Probe the file of a `FileField`/`ImageField`.
+
+    Args:
+        field_file: The file to probe
+        kind (str): "IMAGE" or "VIDEO"
+        digest (str): SHA-256 of the file if already known
+    Returns:
+        dict: `digest`, `size`, `mime`, `kind` and what the probe could read, eg.
+            `format`, `width`, `height` for images or `container`, `duration`, `width`,
+            `height`, `video_codec`, `audio_codec` for videos
+    Raises:
+        ProbeError: If the file is not a valid image or video
+    """
+    with field_file.open("rb") as f:
+        if digest is None:
+            digest = file_digest(f)
+        cached = _cache_get(digest)
+        if cached is not None and cached.get("kind") == kind:
+            return cached
+
+        size = field_file.size
+        if not size:
+            raise ProbeError("The media file is empty.")
+        f.seek(0)
+        mime = magic.from_buffer(f.read(2048), mime=True)
+        if kind == "IMAGE":
+            details = probe_image(f)
+        else:
+            details = probe_video(f, size, mime)
+
+    info = {"digest": digest, "size": size, "mime": mime, "kind": kind, **details}
+    _cache_set(digest, info)
+    return info
+
+
+def check_limits(info: dict, limits: dict) -> list:
+    """
+    Return the reasons the probed media does not meet a platform's `MEDIA_LIMITS`, if any.
+    """
+    if not info or not limits:
+        return []
+    limits = limits.get(info.get("kind")) or {}
+    problems = []
+
+    def check_range(name: str, value, unit: str = ""):
+        if value is None:
+            return
+        low, high = limits.get(f"min_{name}"), limits.get(f"max_{name}")
+        if low is not None and value < low:
+            problems.append(f"{name.replace('_', ' ')} {value}{unit} is below the minimum of {low}{unit}")
+        if high is not None and value > high:
+            problems.append(f"{name.replace('_', ' ')} {value}{unit} is above the maximum of {high}{unit}")
+
+    for name, key in (("formats", "format"), ("containers", "container"), ("codecs", "video_codec")):
+        value = info.get(key)
+        if limits.get(name) and value is not None and value not in limits[name]:
+            problems.append(f"{key.replace('_', ' ')} {value} is not one of {', '.join(limits[name])}")
+    check_range("size", info.get("size"), " bytes")
+    check_range("width", info.get("width"), "px")
+    check_range("height", info.get("height"), "px")
+    check_range("duration", info.get("duration"), "s")
+    if info.get("width") and info.get("height"):
+        check_range("aspect_ratio", round(info["width"] / info["height"], 3))
+    return problems
+
+
+def for_platform(info: dict, platform_name: str) -> dict:
+    """
+    The media a platform gets: its image variant if it has one (see omnipost_api.image_derivatives).
+    """
+    if not info:
+        return info
+    return {**info, **(info.get("derivatives") or {}).get(platform_name, {})}
+
+
+def incompatible_platforms(info: dict, platforms) -> dict:
+    """
+    The reasons the probed media can not be published on each of the platforms that reject it.
+    """
+    incompatible = {}
+    for platform in platforms:
+        problems = check_limits(for_platform(info, platform.name), (platform.config or {}).get("MEDIA_LIMITS"))
+        if problems:
+            incompatible[platform.name] = problems
+    return incompatible
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('omnipost_api', '0003_notification_content_type_notification_object_id_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='platform',
+            name='config_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('omnipost_api', '0004_platform_config_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='postimage',
+            index=models.Index(fields=['user', 'published', 'created_at', 'id'], name='postimage_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='posttext',
+            index=models.Index(fields=['user', 'published', 'created_at', 'id'], name='posttext_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postvideo',
+            index=models.Index(fields=['user', 'published', 'created_at', 'id'], name='postvideo_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shortformvideo',
+            index=models.Index(fields=['user', 'published', 'created_at', 'id'], name='shortformvideo_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storyimage',
+            index=models.Index(fields=['user', 'published', 'created_at', 'id'], name='storyimage_timeline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storyvideo',
+            index=models.Index(fields=['user', 'published', 'created_at', 'id'], name='storyvideo_timeline_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('omnipost_api', '0005_post_timeline_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'content_type', 'object_id', 'created_at', 'id'], name='notification_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='notification_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('error', True)), fields=['user', 'created_at', 'id'], name='notification_error_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('omnipost_api', '0006_notification_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postimage',
+            name='media_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('UPLOADING', 'Uploading'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='READY', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='posttext',
+            name='media_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('UPLOADING', 'Uploading'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='READY', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='postvideo',
+            name='media_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('UPLOADING', 'Uploading'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='READY', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='shortformvideo',
+            name='media_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('UPLOADING', 'Uploading'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='READY', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='storyimage',
+            name='media_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('UPLOADING', 'Uploading'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='READY', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='storyvideo',
+            name='media_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('UPLOADING', 'Uploading'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='READY', max_length=10),
+        ),
+    ]
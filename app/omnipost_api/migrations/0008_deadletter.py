@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('omnipost_api', '0007_post_media_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('post_type', models.CharField(max_length=20)),
+                ('action', models.CharField(max_length=50)),
+                ('step', models.PositiveIntegerField()),
+                ('attempts', models.PositiveIntegerField(default=1)),
+                ('status_code', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('replayed_at', models.DateTimeField(blank=True, null=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('platform_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='omnipost_api.platforminstance')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at', 'id'], name='deadletter_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('omnipost_api', '0008_deadletter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postimage',
+            name='media_info',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='posttext',
+            name='media_info',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='postvideo',
+            name='media_info',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shortformvideo',
+            name='media_info',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storyimage',
+            name='media_info',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storyvideo',
+            name='media_info',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('omnipost_api', '0009_post_media_info'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('key', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('uploaded', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='postimage',
+            name='media_object',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='omnipost_api.mediaobject'),
+        ),
+        migrations.AddField(
+            model_name='posttext',
+            name='media_object',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='omnipost_api.mediaobject'),
+        ),
+        migrations.AddField(
+            model_name='postvideo',
+            name='media_object',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='omnipost_api.mediaobject'),
+        ),
+        migrations.AddField(
+            model_name='shortformvideo',
+            name='media_object',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='omnipost_api.mediaobject'),
+        ),
+        migrations.AddField(
+            model_name='storyimage',
+            name='media_object',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='omnipost_api.mediaobject'),
+        ),
+        migrations.AddField(
+            model_name='storyvideo',
+            name='media_object',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='omnipost_api.mediaobject'),
+        ),
+    ]
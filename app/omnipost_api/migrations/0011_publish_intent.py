@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('omnipost_api', '0010_media_object'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishIntent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('post_type', models.CharField(max_length=20)),
+                ('action', models.CharField(max_length=50)),
+                ('platform_instance_ids', models.JSONField()),
+                ('step', models.PositiveIntegerField(default=0)),
+                ('secret', models.TextField(blank=True)),
+                ('due_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True)),
+                ('cancelled_at', models.DateTimeField(blank=True, null=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('cancelled_at', None), ('dispatched_at', None)), fields=['due_at', 'id'], name='publishintent_due_idx'), models.Index(fields=['post_type', 'object_id'], name='publishintent_post_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('omnipost_api', '0011_publish_intent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deadletter',
+            name='variables',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='publishintent',
+            name='variables',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -4,13 +4,27 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-import boto3, requests, os, json
+import requests
 from zxcvbn import zxcvbn
 from django_rq import get_queue
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from rq import Queue, get_current_job
+from concurrent.futures import ThreadPoolExecutor
 from omnipost_api.fernet import FernetEncryptor
+from omnipost_api.request_templates import get_compiled_action
+from omnipost_api.media_probe import IncompatibleMedia
+from omnipost_api.retry import StepFailed
+from omnipost_api import chunked_upload, events, http_pool, image_derivatives, job_secrets, media_probe, notification_sink, platform_registry, post_variables, rate_limit, storage
 import os
+import math
+import time
+import logging
 import magic
 
+logger = logging.getLogger(__name__)
+
 
 def validate_video_file(file):
     """
@@ -77,6 +91,40 @@ class Platform(models.Model):
     }
     ```
     
+    - A `variable_mapping` maps path expressions into the response to the names of the
+    variables they are stored under, eg. `{"data.id": "POST_ID", "headers.Location": "UPLOAD_URL"}`.
+    Nested keys, array indices (`media[0].id`) and defaults (`data.cursor ?? null`) are
+    supported, see `omnipost_api.extraction`.
+    
+    - A step may carry an optional fourth element with step options:
+    ```
+    [request, expected_response_code, variable_mapping, {"min_gap": 30}]
+    ```
+    `min_gap` is the minimum number of seconds to wait after the previous step finished
+    before this step is sent, eg. to give the platform time to process an uploaded video.
+    `upload` sends the step once per chunk of the post's media file, for chunked upload
+    APIs (INIT, APPEND, FINALIZE), see `omnipost_api.chunked_upload`.
+    `retry` overrides `settings.STEP_RETRY` for the step, eg.
+    `{"retry": {"max_attempts": 5, "backoff": 2, "max_backoff": 120, "retry_on": [429, 503]}}`,
+    see `omnipost_api.retry`.
+    
+    - Optional `"MEDIA_LIMITS"` the post's media has to meet before it is published, eg.
+    `{"VIDEO": {"codecs": ["avc1"], "max_duration": 90}}`, see `omnipost_api.media_probe`.
+    
+    - Optional `"IMAGE_PROFILE"` the post's image is cropped, scaled and re-encoded to
+    for the platform, eg. `{"max_width": 1440, "max_aspect_ratio": 1.91, "format": "JPEG"}`,
+    see `omnipost_api.image_derivatives`.
+    
+    - Optional `"RATE_LIMITS"` for the platform's API, shared by all workers:
+    ```
+    "RATE_LIMITS": {
+        "PLATFORM": {"requests": 4800, "per": 86400, "burst": 50},
+        "INSTANCE": {"requests": 200, "per": 3600, "burst": 20}
+    }
+    ```
+    `PLATFORM` limits the requests of all instances together, `INSTANCE` those of each
+    instance. See `omnipost_api.rate_limit`.
+    
     - A `request` must be of the following format:
     ```
     {
@@ -104,7 +152,13 @@ class Platform(models.Model):
     name = models.CharField(max_length=100, blank=False)
     config = models.JSONField(default=dict, blank=True, null=True)
     # The configs field would contain the configuration details needed to connect to the platform's API
+    config_version = models.PositiveIntegerField(default=1, editable=False)
+    # Bumped on every save so that cached request templates compiled from an older config are dropped
     
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            self.config_version += 1
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return self.name
@@ -149,7 +203,7 @@ class PlatformInstance(models.Model):
         if password is None:
             raise ValueError("Password is required to decrypt credentials.")
         else:
-            encryptor = FernetEncryptor(salt=bytes(self.salt), password=password)
+            encryptor = FernetEncryptor(salt=bytes(self.salt), password=password, cache_scope=("platform_instance", self.pk))
             decrypted_credentials = encryptor.decrypt_dict_keys(self.credentials)
             return decrypted_credentials
     def __str__(self):
@@ -157,6 +211,80 @@ class PlatformInstance(models.Model):
         
         
         
+MEDIA_PENDING = 'PENDING'
+MEDIA_UPLOADING = 'UPLOADING'
+MEDIA_READY = 'READY'
+MEDIA_FAILED = 'FAILED'
+
+
+class MediaNotReady(ValueError):
+    """
+    Raised when publishing a post whose media has not reached the cloud yet.
+    """
+    pass
+
+
+class MediaObject(models.Model):
+    """
+    A media file in the bucket, stored once per content under its SHA-256.
+    
+    Posts with the same media share one object and its URL. `ref_count` counts the posts
+    using it; the object and its image variants (see omnipost_api.image_derivatives) are
+    deleted from the bucket when the last of them is deleted.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    key = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    uploaded = models.BooleanField(default=False)
+    # False until the file is in the bucket; posts can reference the object before that
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.key
+    
+    @property
+    def url(self) -> str:
+        return storage.public_url(self.key)
+    
+    @classmethod
+    def acquire(cls, digest: str, extension: str = "", size: int = 0) -> "MediaObject":
+        """
+        Take a reference to the object with this digest, creating it if it is new.
+        
+        The file still has to be uploaded to `key` if the returned object is not `uploaded`.
+        """
+        with transaction.atomic():
+            media_object, _ = cls.objects.select_for_update().get_or_create(
+                digest=digest,
+                defaults={"key": storage.content_key(digest, extension), "size": size},
+            )
+            media_object.ref_count += 1
+            media_object.save(update_fields=["ref_count"])
+        return media_object
+    
+    @classmethod
+    def release(cls, media_object_id: int) -> None:
+        """
+        Drop a reference, deleting the object from the bucket and the database with the last one.
+        """
+        with transaction.atomic():
+            media_object = cls.objects.select_for_update().filter(pk=media_object_id).first()
+            if media_object is None:
+                return
+            if media_object.ref_count > 1:
+                cls.objects.filter(pk=media_object_id).update(ref_count=F("ref_count") - 1)
+                return
+            if media_object.uploaded:
+                # Inside the lock, so that a concurrent acquire re-uploads after the delete and not before
+                try:
+                    storage.delete_object(media_object.key)
+                    storage.delete_prefix(image_derivatives.derived_prefix(media_object.digest))
+                except Exception as e:
+                    logger.warning("Could not delete %s from the bucket: %s", media_object.key, e)
+            media_object.delete()
+
+
 class PostBase(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     platform_instances = models.ManyToManyField(PlatformInstance)
@@ -164,16 +292,41 @@ class PostBase(models.Model):
     post_configs = models.JSONField(default=dict, blank=True, null=True)
     schedule = models.DateTimeField(blank=True, null=True)
     published = models.BooleanField(default=False)
+    media_status = models.CharField(max_length=10, default=MEDIA_READY,
+                                    choices=[
+                                        (MEDIA_PENDING, 'Pending'),
+                                        (MEDIA_UPLOADING, 'Uploading'),
+                                        (MEDIA_READY, 'Ready'),
+                                        (MEDIA_FAILED, 'Failed'),
+                                    ])
+    # Posts without media are always READY
+    media_info = models.JSONField(blank=True, null=True)
+    # What the media probe read from the file's headers, see omnipost_api.media_probe
+    media_object = models.ForeignKey(MediaObject, on_delete=models.PROTECT, blank=True, null=True, related_name='+')
+    # The deduplicated copy of the media in the bucket
+    
+    # Name of the post type in the API, eg. "IMAGE"
+    post_type = None
+    # Set by the post types with media: the file field, the field holding its public URL
+    # and the post config key the URL is published under
+    media_field = None
+    media_url_field = None
+    media_url_key = None
+    # "IMAGE" or "VIDEO", the kind of media the probe expects
+    media_kind = None
 
     class Meta:
         abstract = True
+        indexes = [
+            # Serves the keyset paginated timelines, see omnipost_api.pagination
+            models.Index(fields=['user', 'published', 'created_at', 'id'], name='%(class)s_timeline_idx'),
+        ]
     
     def run_action(
         self,
         action: str,
         platform_instance: PlatformInstance, 
         password: str = None,
-        delay: int = 5,
     ) -> None:
         """
         Execute an action on a platform instance
@@ -182,51 +335,15 @@ class PostBase(models.Model):
             action (str): The action to execute
             platform_instance (PlatformInstance): The platform instance to execute the action on
             password (str): The password to decrypt the credentials
-            delay (int): The delay between each request (in seconds)
-            max_retries (int): The maximum number of retries
-        Returns:
-            bool: True if the action was executed successfully, False otherwise
         Raises:
             ValueError: If the action is not defined in the platform instance
         """
-        if password is None:
-            raise ValueError("Password is required to decrypt credentials.")
-        if action not in platform_instance.platform.config["ACTIONS"]:
-            raise ValueError(f"Action '{action}' not defined in platform {platform_instance.platform.name}.")
-            
-        a = platform_instance.platform.config["ACTIONS"][action]
-        iteration = 1
-        if self.schedule:
-            q_time = self.schedule
-        else:
-            q_time = timezone.now()
-        for request, expected_response_code, variable_mapping in a:            
-            q = get_queue('default')
-            q.enqueue_at(
-                q_time+timezone.timedelta(seconds=delay*iteration), 
-                send_request,
-                post_object=self,
-                platform_instance=platform_instance,
-                request=request,
-                expected_response_code=expected_response_code,
-                variable_mapping=variable_mapping,
-                password=password,
-            )
-            iteration += 1
-            # send_request(
-            #     post_object=self,
-            #     platform_instance=platform_instance,
-            #     request=request,
-            #     expected_response_code=expected_response_code,
-            #     variable_mapping=variable_mapping,
-            #     password=password,
-            # )
+        self.publish(action=action, platform_instances=[platform_instance], password=password)
             
     def run_action_on_all_platforms(
         self, 
         action: str, 
         password: str = None,
-        delay: int = 5,
         ) -> None:
         """
         Execute an action on all platform instances
@@ -234,24 +351,163 @@ class PostBase(models.Model):
         Args:
             action (str): The action to execute
             password (str): The password to decrypt the credentials
-            delay (int): The delay between each request (in seconds)
         """
-        for platform_instance in self.platform_instances.all():
-            self.run_action(action=action, platform_instance=platform_instance, password=password, delay=delay)
+        platform_instances = list(self.platform_instances.select_related('platform'))
+        self.publish(action=action, platform_instances=platform_instances, password=password)
     
-    def save_to_aws_s3(self, file_path, file_name):
+    def check_publishable(self, action: str, platform_instances: list, password: str = None) -> None:
         """
-        Save a file to the AWS cloud for public access
+        Validate a publish request before anything is enqueued
+        
+        Raises:
+            ValueError: If there is no password or the action is not defined in one of the platform instances
+            MediaNotReady: If the post's media has not been uploaded to the cloud yet
+            IncompatibleMedia: If the media does not meet the `MEDIA_LIMITS` of one of the platforms
         """
-        try:
-            client = boto3.client(
-                's3',
-                aws_access_key_id=os.environ.get("AWS_ACCESS_KEY"),
-                aws_secret_access_key=os.environ.get("AWS_SECRET_KEY")
+        if password is None:
+            raise ValueError("Password is required to decrypt credentials.")
+        if self.media_status != MEDIA_READY:
+            raise MediaNotReady(f"Media of the post is not ready to be published ({self.media_status.lower()}).")
+        for platform_instance in platform_instances:
+            # Compiling here also validates the action before anything is enqueued
+            get_compiled_action(platform_instance.platform, action)
+            problems = media_probe.check_limits(
+                media_probe.for_platform(self.media_info, platform_instance.platform.name),
+                platform_instance.platform.config.get("MEDIA_LIMITS"),
             )
-
-            client.upload_file(file_path, 'omnipost-images', file_name)
+            if problems:
+                raise IncompatibleMedia(f"Media can not be published on {platform_instance.platform}: {'; '.join(problems)}.")
+    
+    def publish(
+        self,
+        action: str,
+        platform_instances: list,
+        password: str = None,
+    ) -> list:
+        """
+        Fan an action out over many platform instances
+        
+        The instances are split into batches of `PUBLISH_FANOUT["BATCH_SIZE"]` and every batch
+        becomes one `run_action_chains` job carrying only ids. The jobs and the password's
+        secret handle are written to Redis in a single pipeline, or kept as `PublishIntent`s
+        until the post's schedule. Load the instances with
+        `select_related('platform')` to avoid a query per instance.
+        
+        Args:
+            action (str): The action to execute
+            platform_instances (list): The platform instances to execute the action on
+            password (str): The password to decrypt the credentials
+        Returns:
+            list: The enqueued jobs, or the `PublishIntent`s if the post is scheduled
+        Raises:
+            ValueError: If the action is not defined in one of the platform instances
+            MediaNotReady: If the post's media has not been uploaded to the cloud yet
+        """
+        self.check_publishable(action, platform_instances, password)
+        return publish_many([(self, action, platform_instances)], password)[0]
+    
+    def reschedule(self, schedule) -> int:
+        """
+        Move the publishes that are still scheduled for this post to another time.
+        
+        Args:
+            schedule (datetime): The new time to publish at
+        Returns:
+            int: The number of `PublishIntent`s moved
+        """
+        with transaction.atomic():
+            type(self).objects.filter(pk=self.pk).update(schedule=schedule)
+            self.schedule = schedule
+            return PublishIntent.objects.filter(
+                post_type=self.post_type, object_id=self.pk, dispatched_at=None, cancelled_at=None
+            ).update(due_at=schedule)
+    
+    def cancel_schedule(self) -> int:
+        """
+        Cancel the publishes that are still scheduled for this post.
+        
+        Returns:
+            int: The number of `PublishIntent`s cancelled
+        """
+        with transaction.atomic():
+            type(self).objects.filter(pk=self.pk).update(schedule=None)
+            self.schedule = None
+            return PublishIntent.objects.filter(
+                post_type=self.post_type, object_id=self.pk, dispatched_at=None, cancelled_at=None
+            ).update(cancelled_at=timezone.now(), secret="")
+    
+    def base_post_config(self) -> dict:
+        """
+        The config every platform starts with for this post, eg. {"CAPTION": ..., "IMAGE_URL": ...}
+        """
+        return {}
+    
+    def prepare_for_save(self, platform_names=None) -> bool:
+        """
+        Fill in everything the post needs before it is written, so that it is saved in one statement.
+        
+        Seeds `post_configs` for every platform (from `platform_names`, or the platform
+        registry) and marks new media as PENDING.
+        
+        Returns:
+            bool: True if the media has to be offloaded to the cloud once the post is saved
+        """
+        if not self.post_configs:
+            if platform_names is None:
+                platform_names = platform_registry.get_platform_names()
+            self.post_configs = {f"{name}": self.base_post_config() for name in platform_names}
+        
+        offload = self.needs_media_offload()
+        if offload:
+            self.media_status = MEDIA_PENDING
+        return offload
+    
+    def save(self, *args, **kwargs):
+        offload = self.prepare_for_save()
+        super().save(*args, **kwargs)
+        if offload:
+            queue_media_offloads([self])
+    
+    @classmethod
+    def bulk_create_posts(cls, posts: list, batch_size: int = None) -> list:
+        """
+        Create many posts of this type with `bulk_create`, with the same result as saving them one by one
+        
+        Platform names are read once for all the posts, media files are written to storage and
+        the media offload jobs are enqueued in one Redis pipeline after the commit.
+        Many-to-many fields (`platform_instances`) have to be set afterwards, as with `bulk_create`.
+        
+        Args:
+            posts (list): Unsaved posts of this type
+            batch_size (int): Passed on to `bulk_create`
+        Returns:
+            list: The created posts
+        """
+        platform_names = platform_registry.get_platform_names()
+        offloads = [post for post in posts if post.prepare_for_save(platform_names)]
+        with transaction.atomic():
+            created = cls.objects.bulk_create(posts, batch_size=batch_size)
+            if offloads:
+                queue_media_offloads(offloads)
+        return created
+    
+    def needs_media_offload(self) -> bool:
+        if self.media_field is None:
+            return False
+        return (
+            bool(getattr(self, self.media_field))
+            and getattr(self, self.media_url_field) is None
+            and self.media_status not in (MEDIA_PENDING, MEDIA_UPLOADING)
+        )
+    
+    def save_to_aws_s3(self, field_file, file_name=None, on_progress=None):
+        """
+        Save a file to the AWS cloud for public access
         
+        The file is streamed from storage with a multipart upload, see `omnipost_api.storage`.
+        """
+        try:
+            storage.upload_field_file(field_file, key=file_name, on_progress=on_progress)
         except Exception as e:
             raise ValueError(f"Failed to upload file to cloud: {e}")
 
@@ -263,17 +519,14 @@ class PostText(PostBase):
     """
     A text post
     """
+    post_type = "TEXT"
+    
     text = models.TextField(blank=False)
     
-    def save(self, *args, **kwargs):
-        super().save()
-        
-        if self.post_configs == {}: 
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"] = {
-                    "TEXT": self.text,
-                }
-            super().save()
+    def base_post_config(self) -> dict:
+        return {
+            "TEXT": self.text,
+        }
     
     def __str__(self):
         platform_instances = ', '.join([str(instance) for instance in self.platform_instances.all()])
@@ -285,56 +538,42 @@ class PostImage(PostBase):
     """
     A normal post. text and image
     """
+    post_type = "IMAGE"
+    media_field = "image"
+    media_url_field = "image_url"
+    media_url_key = "IMAGE_URL"
+    media_kind = "IMAGE"
+
     caption = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='media/', blank=True, null=True)
     image_url = models.URLField(blank=True, null=True)
     
-    def save(self, *args, **kwargs):
-        super().save()
-        
-        if self.post_configs == {}: 
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"] = {
-                    "CAPTION": self.caption,
-                    "IMAGE_URL": self.image_url
-                }
-            super().save()
-        
-        if self.image and self.image_url is None:
-            self.save_to_aws_s3(self.image.path, self.image.name)
-            cloud_url = os.environ.get('BUCKET_URL')
-            self.image_url = f"{cloud_url}/{self.image.name}"
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"]["IMAGE_URL"] = self.image_url
-            super().save()
+    def base_post_config(self) -> dict:
+        return {
+            "CAPTION": self.caption,
+            "IMAGE_URL": self.image_url
+        }
     
     def __str__(self):
         platform_instances = ', '.join([str(instance) for instance in self.platform_instances.all()])
         return f"Image Post on {platform_instances} - {self.caption}"
             
 class PostVideo(PostBase):
+    post_type = "VIDEO"
+    media_field = "video"
+    media_url_field = "video_url"
+    media_url_key = "VIDEO_URL"
+    media_kind = "VIDEO"
+
     caption = models.TextField(blank=True, null=True)
     video = models.FileField(upload_to='media/', blank=True, null=True)
     video_url = models.URLField(blank=True, null=True)
     
-    def save(self, *args, **kwargs):
-        super().save()
-        
-        if self.post_configs == {}: 
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"] = {
-                    "CAPTION": self.caption,
-                    "VIDEO_URL": self.video_url
-                }
-            super().save()
-        
-        if self.video and self.video_url is None:
-            self.save_to_aws_s3(self.video.path, self.video.name)
-            cloud_url = os.environ.get('BUCKET_URL')
-            self.video_url = f"{cloud_url}/{self.video.name}"
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"]["VIDEO_URL"] = self.video_url
-            super().save()
+    def base_post_config(self) -> dict:
+        return {
+            "CAPTION": self.caption,
+            "VIDEO_URL": self.video_url
+        }
         
     def __str__(self):
         platform_instances = ', '.join([str(instance) for instance in self.platform_instances.all()])
@@ -344,28 +583,21 @@ class ShortFormVideo(PostBase):
     """
     A short video, like reels, for any platform in general
     """
+    post_type = "SHORT_FORM_VIDEO"
+    media_field = "video"
+    media_url_field = "video_url"
+    media_url_key = "VIDEO_URL"
+    media_kind = "VIDEO"
+
     caption = models.TextField(blank=True, null=True)
     video = models.FileField(upload_to='media/', blank=True, null=True)
     video_url = models.URLField(blank=True, null=True)
     
-    def save(self, *args, **kwargs):
-        super().save()
-        
-        if self.post_configs == {}: 
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"] = {
-                    "CAPTION": self.caption,
-                    "VIDEO_URL": self.video_url
-                }
-            super().save()
-        
-        if self.video and self.video_url is None:
-            self.save_to_aws_s3(self.video.path, self.video.name)
-            cloud_url = os.environ.get('BUCKET_URL')
-            self.video_url = f"{cloud_url}/{self.video.name}"
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"]["VIDEO_URL"] = self.video_url
-            super().save()
+    def base_post_config(self) -> dict:
+        return {
+            "CAPTION": self.caption,
+            "VIDEO_URL": self.video_url
+        }
         
     def __str__(self):
         platform_instances = ', '.join([str(instance) for instance in self.platform_instances.all()])
@@ -377,30 +609,23 @@ class StoryImage(PostBase):
     """
     Image story/status for any platform in general
     """
+    post_type = "STORY_IMAGE"
+    media_field = "image"
+    media_url_field = "image_url"
+    media_url_key = "IMAGE_URL"
+    media_kind = "IMAGE"
+
     image = models.ImageField(upload_to='media/', blank=True, null=True)
     image_url = models.URLField(blank=True, null=True)
     
-    class Meta:
+    class Meta(PostBase.Meta):
         verbose_name = "Story Image"
         verbose_name_plural = "Story Images"
     
-    def save(self, *args, **kwargs):
-        super().save()
-        
-        if self.post_configs == {}: 
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"] = {
-                    "IMAGE_URL": self.image_url
-                }
-            super().save()
-        
-        if self.image and self.image_url is None:
-            self.save_to_aws_s3(self.image.path, self.image.name)
-            cloud_url = os.environ.get('BUCKET_URL')
-            self.image_url = f"{cloud_url}/{self.image.name}"
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"]["IMAGE_URL"] = self.image_url
-            super().save()
+    def base_post_config(self) -> dict:
+        return {
+            "IMAGE_URL": self.image_url
+        }
     
     def __str__(self):
         platform_instances = ', '.join([str(instance) for instance in self.platform_instances.all()])
@@ -411,35 +636,38 @@ class StoryVideo(PostBase):
     """
     Video story/status for any platform in general
     """
+    post_type = "STORY_VIDEO"
+    media_field = "video"
+    media_url_field = "video_url"
+    media_url_key = "VIDEO_URL"
+    media_kind = "VIDEO"
+
     video = models.FileField(upload_to='media/', blank=True, null=True, validators=[validate_video_file])
     video_url = models.URLField(blank=True, null=True)
     
-    class Meta:
+    class Meta(PostBase.Meta):
         verbose_name = "Story Video"
         verbose_name_plural = "Story Videos"
     
-    def save(self, *args, **kwargs):
-        super().save()
-        
-        if self.post_configs == {}: 
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"] = {
-                    "VIDEO_URL": self.video_url
-                }
-            super().save()
-        
-        if self.video and self.video_url is None:
-            self.save_to_aws_s3(self.video.path, self.video.name)
-            cloud_url = os.environ.get('BUCKET_URL')
-            self.video_url = f"{cloud_url}/{self.video.name}"
-            for platform in Platform.objects.all():
-                self.post_configs[f"{platform.name}"]["VIDEO_URL"] = self.video_url
-            super().save()
+    def base_post_config(self) -> dict:
+        return {
+            "VIDEO_URL": self.video_url
+        }
 
     def __str__(self):
         platform_instances = ', '.join([str(instance) for instance in self.platform_instances.all()])
         return f"Video Story on {platform_instances}"
 
+# Post type names used by the API, in the order used to break ties between post tables
+POST_MODELS = {
+    'TEXT': PostText,
+    'IMAGE': PostImage,
+    'VIDEO': PostVideo,
+    'SHORT_FORM_VIDEO': ShortFormVideo,
+    'STORY_IMAGE': StoryImage,
+    'STORY_VIDEO': StoryVideo,
+}
+
 class Doc(models.Model):
     """
     Documents for any platform in general
@@ -476,71 +704,676 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     error = models.BooleanField(default=False)
     
+    class Meta:
+        indexes = [
+            # Notifications of one post
+            models.Index(fields=['user', 'content_type', 'object_id', 'created_at', 'id'], name='notification_post_idx'),
+            # The user-wide feed
+            models.Index(fields=['user', 'created_at', 'id'], name='notification_user_idx'),
+            # The user-wide feed filtered to errors, which are a small share of all rows
+            models.Index(fields=['user', 'created_at', 'id'], condition=models.Q(error=True), name='notification_error_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.platform_instance.platform.name} - {self.notification}"
 
 
 
-def replace_keys(request: dict, keys: dict) -> dict:
+class DeadLetter(models.Model):
     """
-    Replace keys in the request dictionary with values from the keys dictionary.
+    An action step that still failed after its retries, kept to be inspected and replayed.
+    
+    Replaying publishes the post again on the platform instance starting at the failed
+    step, so the steps that already succeeded are not repeated. The variables the chain
+    had extracted until then are kept with it: the post's config only holds the values
+    of the last instance of each platform that wrote them.
     """
-    request_string = json.dumps(request)
-    for key, value in keys.items():
-        request_string = request_string.replace(f"{key}",f"{value}")
-    request = json.loads(request_string)
-    return request
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    platform_instance = models.ForeignKey(PlatformInstance, on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    post_type = models.CharField(max_length=20)
+    action = models.CharField(max_length=50)
+    step = models.PositiveIntegerField()
+    variables = models.JSONField(default=dict, blank=True)
+    attempts = models.PositiveIntegerField(default=1)
+    status_code = models.PositiveIntegerField(blank=True, null=True)
+    # None when the platform could not be reached or the step failed before sending
+    error = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    replayed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='deadletter_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.post_type} {self.object_id} on {self.platform_instance_id}: {self.action} step {self.step}"
+    
+    @classmethod
+    def record(
+        cls,
+        post_object: PostBase,
+        platform_instance: PlatformInstance,
+        action: str,
+        step: int,
+        error: Exception,
+        variables: dict = None,
+    ):
+        return cls.objects.create(
+            user_id=post_object.user_id,
+            platform_instance=platform_instance,
+            content_object=post_object,
+            post_type=post_object.post_type,
+            action=action,
+            step=step,
+            variables=variables or {},
+            attempts=getattr(error, "attempts", 1),
+            status_code=getattr(error, "status_code", None),
+            error=f"{error}",
+        )
 
-def send_request(
+
+class PublishIntent(models.Model):
+    """
+    A publish of a scheduled post, enqueued by `omnipost_api.dispatcher` when it comes due.
+    
+    Scheduled posts used to be RQ jobs in Redis' scheduled job registry until their time
+    came, possibly weeks later. They are rows here instead, one per `run_action_chains`
+    job, and only reach Redis once they are due. Rescheduling or cancelling a post
+    updates its pending rows, see `PostBase.reschedule` and `PostBase.cancel_schedule`.
+    
+    `secret` is the password encrypted by `job_secrets.encrypt_secret`; it is stashed in
+    Redis when the intent is dispatched and cleared from the row.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    post_type = models.CharField(max_length=20)
+    action = models.CharField(max_length=50)
+    platform_instance_ids = models.JSONField()
+    step = models.PositiveIntegerField(default=0)
+    # Variables to resume the chains with, see `run_action_chains`
+    variables = models.JSONField(default=dict, blank=True)
+    secret = models.TextField(blank=True)
+    due_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(blank=True, null=True)
+    cancelled_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            # The dispatcher's poll only reads the pending rows, oldest due first
+            models.Index(
+                fields=['due_at', 'id'],
+                condition=models.Q(dispatched_at=None, cancelled_at=None),
+                name='publishintent_due_idx',
+            ),
+            models.Index(fields=['post_type', 'object_id'], name='publishintent_post_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.post_type} {self.object_id}: {self.action} at {self.due_at}"
+
+
+def queue_media_offloads(posts: list) -> None:
+    """
+    Enqueue an `offload_media` job for every post, in one Redis pipeline, once the
+    current transaction has been committed.
+    """
+    targets = [(post.post_type, post.pk) for post in posts]
+    
+    def enqueue():
+        q = get_queue('default')
+        with q.connection.pipeline() as pipe:
+            q.enqueue_many(
+                [
+                    Queue.prepare_data(offload_media, kwargs=dict(post_type=post_type, post_id=post_id))
+                    for post_type, post_id in targets
+                ],
+                pipeline=pipe,
+            )
+            pipe.execute()
+    transaction.on_commit(enqueue)
+
+@notification_sink.flushing
+def offload_media(post_type: str, post_id: int) -> bool:
+    """
+    Upload the media of a post to the cloud and publish its URL in the post configs.
+    
+    The media is probed first and the result stored in `media_info`. It is stored in
+    the bucket once per content (see `MediaObject`): if another post already uploaded
+    the same file, its object and URL are reused and nothing is uploaded. Images are then
+    rendered for the platforms with an `IMAGE_PROFILE` (see omnipost_api.image_derivatives),
+    which get the URL of their variant instead of the original. The post's `media_status` moves from PENDING to UPLOADING to READY, or to FAILED with an
+    error notification for the user.
+    """
+    model = POST_MODELS[post_type]
+    post = model.objects.get(pk=post_id)
+    field_file = getattr(post, post.media_field)
+    model.objects.filter(pk=post_id).update(media_status=MEDIA_UPLOADING)
+    media_object = None
+    try:
+        # Probed before the upload, so that files that are not valid media are never uploaded.
+        # The digest is usually known already, from HashingUploadHandler.
+        media_info = media_probe.probe(field_file, post.media_kind, digest=(post.media_info or {}).get("digest"))
+        extension = os.path.splitext(field_file.name)[1]
+        media_object = MediaObject.acquire(media_info["digest"], extension, media_info["size"])
+        if not media_object.uploaded:
+            post.save_to_aws_s3(field_file, file_name=media_object.key)
+            MediaObject.objects.filter(pk=media_object.pk).update(uploaded=True)
+        
+        derivatives = {}
+        if post.media_kind == "IMAGE":
+            derivatives = image_derivatives.derive_for_platforms(
+                field_file, media_object.key, media_info["digest"], platform_registry.get_platforms().values()
+            )
+            if derivatives:
+                # Checked against MEDIA_LIMITS instead of the original, see media_probe.for_platform
+                media_info = {**media_info, "derivatives": {
+                    name: {key: value for key, value in variant.items() if key != "url"}
+                    for name, variant in derivatives.items()
+                }}
+    except Exception as e:
+        # Any failure, not only invalid media (eg. the file is gone, the bucket or the database
+        # failed): a post left UPLOADING could never be published
+        if media_object is not None:
+            try:
+                MediaObject.release(media_object.pk)
+            except Exception as release_error:
+                logger.warning("Could not release media object %s: %s", media_object.pk, release_error)
+        model.objects.filter(pk=post_id).update(media_status=MEDIA_FAILED)
+        events.publish(post.user_id, "media_status", post_type=post_type, post_id=post_id, media_status=MEDIA_FAILED)
+        notification_sink.add(
+            user=post.user,
+            notification=f"Failed to upload the media of {post}. {e}",
+            error=True,
+            content_object=post,
+        )
+        raise
+    
+    url = media_object.url
+    with transaction.atomic():
+        post_configs = model.objects.select_for_update().values_list('post_configs', flat=True).get(pk=post_id)
+        for platform_name, platform_config in post_configs.items():
+            platform_config[post.media_url_key] = derivatives.get(platform_name, {}).get("url", url)
+        model.objects.filter(pk=post_id).update(**{
+            post.media_url_field: url,
+            "post_configs": post_configs,
+            "media_status": MEDIA_READY,
+            "media_info": media_info,
+            "media_object": media_object,
+        })
+    events.publish(post.user_id, "media_status", post_type=post_type, post_id=post_id, media_status=MEDIA_READY)
+    return True
+
+def release_post_media(sender, instance, **kwargs):
+    """
+    `post_delete` receiver for the post types, connected in `OmnipostApiConfig.ready`.
+    """
+    if instance.media_object_id is not None:
+        MediaObject.release(instance.media_object_id)
+
+def get_fanout_config() -> dict:
+    return {"BATCH_SIZE": 10, "CONCURRENCY": 8, "BULK_MAX_ENTRIES": 500, **getattr(settings, "PUBLISH_FANOUT", {})}
+
+def attempt_budget() -> float:
+    """
+    Longest a single request attempt can take: waiting for a rate limit token, then connecting and reading.
+    """
+    http_config = http_pool.get_config()
+    return rate_limit.get_config()["MAX_WAIT"] + http_config["CONNECT_TIMEOUT"] + http_config["READ_TIMEOUT"]
+
+def chain_budget(platform: Platform, action: str, media_size: int = None) -> float:
+    """
+    Longest an action chain can take on a platform, every request using all its attempts and backoffs.
+    
+    Args:
+        platform (Platform): The platform the chain runs on
+        action (str): The action
+        media_size (int): Size of the post's media in bytes, for the number of chunks of upload steps
+    """
+    per_attempt = attempt_budget()
+    budget = 0.0
+    for compiled_step in get_compiled_action(platform, action):
+        requests_sent = 1
+        if compiled_step.upload is not None and media_size:
+            requests_sent = max(math.ceil(media_size / compiled_step.upload.chunk_size), 1)
+        attempts = compiled_step.retry.max_attempts
+        per_request = attempts * per_attempt + (attempts - 1) * compiled_step.retry.max_backoff
+        budget += compiled_step.min_gap + requests_sent * per_request
+    return budget
+
+def publish_job_timeout(platforms: list, action: str, media_size: int = None) -> int:
+    """
+    The RQ `job_timeout` of a `run_action_chains` job over instances of `platforms` (one per instance).
+    
+    The chains run `PUBLISH_FANOUT["CONCURRENCY"]` at a time, so the job takes at most one
+    of the longest chain per round. One more attempt is added on top: chains stop starting
+    attempts that long before the timeout (see `run_action_chains`), so that RQ never kills
+    the job while its threads are still sending requests.
+    """
+    budgets = {platform.id: chain_budget(platform, action, media_size) for platform in platforms}
+    rounds = math.ceil(len(platforms) / get_fanout_config()["CONCURRENCY"])
+    return math.ceil(rounds * max(budgets.values(), default=0) + attempt_budget())
+
+def publish_many(entries: list, password: str) -> list:
+    """
+    Enqueue the publish jobs of many posts at once.
+    
+    Every entry is split into `run_action_chains` jobs as in `PostBase.publish`. The jobs
+    of posts to publish now share one secret handle to the password and are written to
+    Redis in a single pipeline. Posts scheduled for later get a `PublishIntent` per job
+    instead, written in one INSERT, which `omnipost_api.dispatcher` enqueues when it
+    comes due.
+    
+    Args:
+        entries (list): (post, action, platform_instances) tuples, validated with `check_publishable`.
+            A fourth element is the step to start at and a fifth the variables to resume each
+            chain with, by platform instance id, eg. when replaying `DeadLetter`s.
+        password (str): The password to decrypt the credentials
+    Returns:
+        list: The enqueued jobs, or the `PublishIntent`s of a scheduled post, of every entry
+            in the order of the entries
+    """
+    now = timezone.now()
+    batch_size = get_fanout_config()["BATCH_SIZE"]
+    
+    entry_jobs = [[] for _ in entries]
+    immediate = []
+    intents = []
+    for index, (post, action, platform_instances, *resume) in enumerate(entries):
+        step, variables = (resume + [0, None])[:2]
+        for i in range(0, len(platform_instances), batch_size):
+            kwargs = dict(
+                post_type=post.post_type,
+                post_id=post.pk,
+                platform_instance_ids=[platform_instance.id for platform_instance in platform_instances[i:i+batch_size]],
+                action=action,
+            )
+            if step:
+                kwargs["step"] = step
+            if variables:
+                kwargs["variables"] = {
+                    platform_instance_id: variables[platform_instance_id]
+                    for platform_instance_id in map(str, kwargs["platform_instance_ids"]) if platform_instance_id in variables
+                }
+            if post.schedule and post.schedule > now:
+                intents.append((index, PublishIntent(
+                    user_id=post.user_id,
+                    content_type=ContentType.objects.get_for_model(post),
+                    object_id=post.pk,
+                    post_type=post.post_type,
+                    action=action,
+                    platform_instance_ids=kwargs["platform_instance_ids"],
+                    step=kwargs.get("step", 0),
+                    variables=kwargs.get("variables", {}),
+                    due_at=post.schedule,
+                )))
+            else:
+                job_timeout = publish_job_timeout(
+                    [platform_instance.platform for platform_instance in platform_instances[i:i+batch_size]],
+                    action, (post.media_info or {}).get("size"),
+                )
+                immediate.append((index, kwargs, job_timeout))
+    
+    if intents:
+        # Encrypted once, like the single secret handle of the immediate jobs
+        secret = job_secrets.encrypt_secret(password)
+        for _, intent in intents:
+            intent.secret = secret
+        PublishIntent.objects.bulk_create([intent for _, intent in intents])
+        for index, intent in intents:
+            entry_jobs[index].append(intent)
+    
+    if immediate:
+        q = get_queue('default')
+        with q.connection.pipeline() as pipe:
+            # Jobs only carry ids and a handle to the password, see omnipost_api.job_secrets
+            secret = job_secrets.stash_secret(password, pipeline=pipe)
+            jobs = q.enqueue_many(
+                [
+                    Queue.prepare_data(run_action_chains, kwargs={**kwargs, "secret": secret}, timeout=job_timeout)
+                    for _, kwargs, job_timeout in immediate
+                ],
+                pipeline=pipe,
+            )
+            pipe.execute()
+        for (index, _, _), job in zip(immediate, jobs):
+            entry_jobs[index].append(job)
+    return entry_jobs
+
+def replay_dead_letters(dead_letters: list, password: str) -> list:
+    """
+    Publish the posts of dead letters again, resuming every chain at the step that failed.
+    
+    Dead letters of the same post, action and step are replayed together, every chain
+    with the variables its own earlier steps had extracted. Load them with
+    `select_related('platform_instance__platform')` to avoid a query per dead letter.
+    
+    Returns:
+        list: The enqueued jobs
+    Raises:
+        ValueError: If a post no longer exists or can not be published
+        MediaNotReady: If the media of a post is not ready
+    """
+    groups = {}
+    variables = {}
+    for dead_letter in dead_letters:
+        key = (dead_letter.post_type, dead_letter.object_id, dead_letter.action, dead_letter.step)
+        groups.setdefault(key, []).append(dead_letter.platform_instance)
+        variables.setdefault(key, {})[str(dead_letter.platform_instance_id)] = dead_letter.variables
+    
+    post_ids = {}
+    for post_type, post_id, _, _ in groups:
+        post_ids.setdefault(post_type, set()).add(post_id)
+    posts = {
+        (post_type, post.id): post
+        for post_type, ids in post_ids.items()
+        for post in POST_MODELS[post_type].objects.filter(id__in=ids)
+    }
+    
+    entries = []
+    for key, platform_instances in groups.items():
+        post_type, post_id, action, step = key
+        post = posts.get((post_type, post_id))
+        if post is None:
+            raise ValueError(f"Post {post_type} {post_id} no longer exists.")
+        platform_instances = list({platform_instance.id: platform_instance for platform_instance in platform_instances}.values())
+        post.check_publishable(action, platform_instances, password)
+        entries.append((post, action, platform_instances, step, variables[key]))
+    
+    jobs = [job for entry_jobs in publish_many(entries, password) for job in entry_jobs]
+    DeadLetter.objects.filter(id__in=[dead_letter.id for dead_letter in dead_letters]).update(replayed_at=timezone.now())
+    return jobs
+
+def _run_chain_in_thread(
     post_object: PostBase,
     platform_instance: PlatformInstance,
-    request: dict,
-    expected_response_code: int,
-    variable_mapping: dict,
+    action: str,
     password: str,
+    step: int = 0,
+    variables: dict = None,
+    deadline: float = None,
     ) -> bool:
+    try:
+        return run_action_steps(
+            post_object, platform_instance, action, password, step=step, variables=variables, deadline=deadline,
+        )
+    finally:
+        # Threads get their own DB connection, which would otherwise be left open
+        connection.close()
 
-    post_object.refresh_from_db()
-    request = replace_keys(request, platform_instance.get_credentials(password=password))
-    request = replace_keys(request, post_object.post_configs[platform_instance.platform.name])
-    
-    response = requests.request(
-        request["method"],
-        request["base_url"] + request["endpoint"],
-        headers=request["headers"],
-        params=request["params"],
-        json=request["payload"]
-    )
-
-    # with open("request.txt", "a") as f:
-    #     f.write(f"Request: {request}\n")
-    #     f.write(f"Response: {response.text}\n")
-    #     f.write(f"Status Code: {response.status_code}\n")
-    #     f.write("\n\n")
-    # print(request)
-    
-    if response.status_code != expected_response_code:
-        Notification(
-            platform_instance=platform_instance,
-            user=post_object.user,
-            notification=f"Something went wrong while posting {post_object} on {platform_instance}. {response.text}",
-            error=True,
-            content_object=post_object,
-        ).save()
-        raise ValueError(f"Unexpected response code: {response.status_code}. Failed to create post. {response.text}")
+@notification_sink.flushing
+def run_action_chains(
+    post_type: str,
+    post_id: int,
+    platform_instance_ids: list,
+    action: str,
+    secret: str,
+    step: int = 0,
+    variables: dict = None,
+    ) -> bool:
+    """
+    Run the action chains of several platform instances concurrently, inside one job.
+    
+    The job only carries references: the post's type and id, the platform instance ids,
+    the action and a `job_secrets` handle to the password. At most
+    `PUBLISH_FANOUT["CONCURRENCY"]` chains run at a time. Every chain still runs its own
+    steps in order, starting at `step` with the `variables` of its platform instance (by
+    id as a string, when resuming a chain); a failing chain does not stop the others, but the
+    job fails once they have all finished. Their notifications are written together when
+    the job ends, see `omnipost_api.notification_sink`.
+    
+    The job is enqueued with a timeout of its worst case, see `publish_job_timeout`. Chains
+    do not start another attempt later than one attempt before that timeout, so their
+    threads are done when RQ would stop the job; the step then fails as a `DeadLetter`.
+    """
+    job = get_current_job()
+    deadline = None
+    if job is not None and job.timeout and job.timeout > 0:
+        deadline = time.monotonic() + job.timeout - attempt_budget()
+    post_object = POST_MODELS[post_type].objects.get(pk=post_id)
+    password = job_secrets.resolve_secret(secret)
+    platform_instances = list(PlatformInstance.objects.filter(id__in=platform_instance_ids).order_by('id'))
+    
+    if not platform_instances:
+        # Deleted between the enqueue and now; an empty pool would fail the job with a ValueError
+        logger.warning("No platform instances left to run %s on %s post %s", action, post_type, post_id)
+        return True
+    
+    variables = variables or {}
+    if len(platform_instances) == 1:
+        return run_action_steps(
+            post_object, platform_instances[0], action, password, step=step,
+            variables=variables.get(str(platform_instances[0].id)), deadline=deadline,
+        )
+    
+    concurrency = min(get_fanout_config()["CONCURRENCY"], len(platform_instances))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            (platform_instance, executor.submit(
+                _run_chain_in_thread, post_object, platform_instance, action, password, step,
+                variables.get(str(platform_instance.id)), deadline,
+            ))
+            for platform_instance in platform_instances
+        ]
+    
+    failures = []
+    for platform_instance, future in futures:
+        error = future.exception()
+        if error is not None:
+            failures.append(f"{platform_instance}: {error}")
+    if failures:
+        raise ValueError(f"Failed to run {action} on {len(failures)} of {len(futures)} platform instances. {' | '.join(failures)}")
+    return True
 
-    for key, value in variable_mapping.items():
-        if key == 'terminal_request':
-            Notification(
+def run_action_steps(
+    post_object: PostBase,
+    platform_instance: PlatformInstance,
+    action: str,
+    password: str,
+    step: int = 0,
+    variables: dict = None,
+    deadline: float = None,
+    ) -> bool:
+    """
+    Run the steps of an action in order, from `step` onwards.
+    
+    Each step starts once the previous one has stored its variables. If a step has a
+    `min_gap`, the runner waits until that many seconds have passed since the previous
+    step finished. A step that still fails after its retries is recorded as a `DeadLetter`
+    and notified to the user, then raises and stops the chain.
+    
+    Variables extracted by earlier steps are kept for the rest of the chain, so chains
+    running side by side never read each other's values. A chain resumed at a later step
+    starts with the `variables` its earlier steps had extracted, see `DeadLetter`.
+    
+    No attempt is started after `deadline` (a `time.monotonic()` value); the step fails instead.
+    """
+    steps = get_compiled_action(platform_registry.get_platform(platform_instance.platform_id), action)
+    variables = dict(variables or {})
+    last_finished = None
+    for step, compiled_step in enumerate(steps[step:], start=step):
+        if compiled_step.min_gap and last_finished is not None:
+            wait = compiled_step.min_gap - (time.monotonic() - last_finished)
+            if wait > 0:
+                time.sleep(wait)
+        try:
+            send_request(
+                post_object=post_object,
+                platform_instance=platform_instance,
+                action=action,
+                step=step,
+                password=password,
+                variables=variables,
+                deadline=deadline,
+            )
+        except Exception as e:
+            # Kept so that the chain can be replayed from this step, see DeadLetter
+            DeadLetter.record(post_object, platform_instance, action, step, e, variables=variables)
+            notification_sink.add(
                 platform_instance=platform_instance,
                 user=post_object.user,
-                notification=f"Post created successfully",
+                notification=f"Something went wrong while posting {post_object} on {platform_instance}. {e}",
+                error=True,
                 content_object=post_object,
-            ).save()
-            post_object.published = True
-            continue
-        post_object.post_configs[platform_instance.platform.name][value] = response.json()[key]
-    post_object.save()
+            )
+            raise
+        last_finished = time.monotonic()
+    return True
+
+def _send_with_retries(
+    post_object: PostBase,
+    platform_instance: PlatformInstance,
+    platform: Platform,
+    compiled_step,
+    request: dict,
+    accepted_codes: set,
+    deadline: float = None,
+    **body,
+    ) -> requests.Response:
+    """
+    Send a rendered request, retrying it with the step's retry policy until the platform
+    answers with one of `accepted_codes`.
+    
+    Raises:
+        StepFailed: If the request still fails after its retries, or `deadline` has passed
+    """
+    attempt = 0
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise StepFailed(
+                f"The job ran out of time after {attempt} attempt(s) to post {post_object} on {platform_instance}.",
+                attempts=max(attempt, 1),
+            )
+        attempt += 1
+        # Waits for a token of the platform's and the instance's rate limits, shared by all workers
+        rate_limit.acquire(platform, platform_instance.id)
+        try:
+            response = http_pool.request(
+                request["method"],
+                request["base_url"] + request["endpoint"],
+                headers=request["headers"],
+                params=request["params"],
+                **body
+            )
+        except requests.RequestException as e:
+            # Connection errors and the timeouts of http_pool, retried like a connection error
+            status_code, retry_after = None, None
+            detail = f"Could not reach {platform}: {e}"
+        else:
+            if response.status_code in accepted_codes:
+                return response
+            status_code, retry_after = response.status_code, http_pool.retry_after(response)
+            detail = response.text
+            if status_code == 429:
+                # Make the other workers back off from this instance too
+                rate_limit.pause(platform, platform_instance.id, retry_after)
+        
+        delay = compiled_step.retry.delay(attempt, retry_after) if compiled_step.retry.retries(status_code) else None
+        if delay is None:
+            raise StepFailed(
+                f"Unexpected response code: {status_code}. Failed to create post after {attempt} attempt(s). {detail}",
+                status_code=status_code,
+                attempts=attempt,
+            )
+        time.sleep(delay)
 
+def _send_chunks(
+    post_object: PostBase,
+    platform_instance: PlatformInstance,
+    platform: Platform,
+    compiled_step,
+    values: tuple,
+    deadline: float = None,
+    ) -> requests.Response:
+    """
+    Stream the post's media file to the platform with one request per chunk.
+    
+    Returns:
+        requests.Response: The response to the last chunk
+    """
+    upload = compiled_step.upload
+    if post_object.media_field is None:
+        raise ValueError(f"{post_object.post_type} posts have no media to upload.")
+    field_file = getattr(post_object, post_object.media_field)
+    if not field_file:
+        raise ValueError(f"{post_object} has no media file to upload.")
+    
+    file_name = os.path.basename(field_file.name)
+    accepted_codes = {compiled_step.expected_response_code, *upload.chunk_codes}
+    # Offloaded media is in the bucket under its content key, not the file's name
+    key = post_object.media_object.key if post_object.media_object_id else None
+    with chunked_upload.open_media(field_file, key=key) as media:
+        for placeholders, chunk in chunked_upload.iter_chunks(media, upload.chunk_size):
+            request = compiled_step.render(placeholders, *values)
+            response = _send_with_retries(
+                post_object, platform_instance, platform, compiled_step, request,
+                accepted_codes, deadline=deadline, **upload.request_body(request, chunk, file_name),
+            )
+    return response
+
+def send_request(
+    post_object: PostBase,
+    platform_instance: PlatformInstance,
+    action: str,
+    step: int,
+    password: str,
+    variables: dict = None,
+    deadline: float = None,
+    ) -> bool:
+    """
+    Send one step of an action to the platform and store the variables it returns.
+    
+    Args:
+        post_object (PostBase): The post being published
+        platform_instance (PlatformInstance): The platform instance to publish on
+        action (str): The action the step belongs to, eg. "POST_IMAGE"
+        step (int): Index of the step in the action
+        password (str): The password to decrypt the credentials
+        variables (dict): Variables of the running chain. They take precedence over the
+            stored post config and the extracted variables are added to them.
+        deadline (float): `time.monotonic()` after which no attempt is started
+    """
+    if variables is None:
+        variables = {}
+    # The registry has the current config even if the job was enqueued before it changed
+    platform = platform_registry.get_platform(platform_instance.platform_id)
+    compiled_step = get_compiled_action(platform, action)[step]
+    # Only this platform's slice of post_configs is read, not the whole row
+    post_config = post_variables.read(type(post_object), post_object.pk, platform.name)
+    values = (platform_instance.get_credentials(password=password), variables, post_config)
+    
+    if compiled_step.upload is not None:
+        response = _send_chunks(post_object, platform_instance, platform, compiled_step, values, deadline=deadline)
+    else:
+        request = compiled_step.render(*values)
+        response = _send_with_retries(
+            post_object, platform_instance, platform, compiled_step, request,
+            {compiled_step.expected_response_code}, deadline=deadline, json=request["payload"],
+        )
+
+    # The body is parsed once for all the mapped paths
+    outputs = compiled_step.extractor.extract(response)
+    terminal = compiled_step.extractor.terminal
+    variables.update(outputs)
+    post_variables.merge(type(post_object), post_object.pk, platform.name, outputs, published=terminal)
+    if terminal:
+        post_object.published = True
+        events.publish(
+            post_object.user_id, "published",
+            post_type=post_object.post_type, post_id=post_object.pk,
+            platform_instance_id=platform_instance.id, platform=platform.name,
+        )
+        notification_sink.add(
+            platform_instance=platform_instance,
+            user=post_object.user,
+            notification=f"Post created successfully",
+            content_object=post_object,
+        )
     
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,202 @@
+"""
+Buffered writes of `Notification`s from the workers.
+
+Jobs add notifications to a per-process buffer instead of saving them one by one.
+The buffer is written with a single `bulk_create` when it holds `MAX_BATCH`
+notifications, when its oldest notification has waited `MAX_DELAY` seconds (checked
+by a background thread), when a job decorated with `flushing` ends, and when the
+process exits. A publish job therefore writes its notifications in one INSERT.
+Written notifications are then pushed to the user's event streams, see
+`omnipost_api.events`.
+
+`created_at` is the time of the write, at most `MAX_DELAY` seconds after the event.
+Buffered notifications are not visible to queries until they are flushed.
+
+If the batch can not be inserted, its notifications are saved one by one, so that a
+bad row only loses itself. Those that fail because the database can not be reached go
+back to the buffer and are written by a later flush; the buffer keeps at most
+`MAX_BUFFER` of them, dropping the oldest.
+"""
+import atexit
+import functools
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import InterfaceError, OperationalError, connection, transaction
+
+from omnipost_api import events
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MAX_BATCH": 100,
+    "MAX_DELAY": 2.0,
+    # Notifications kept while the database can not be reached
+    "MAX_BUFFER": 10000,
+}
+
+_buffer = []
+# monotonic time the oldest buffered notification was added
+_oldest = None
+_lock = threading.Lock()
+# Serialises the writes, so that notifications are inserted in the order they were added
+_flush_lock = threading.Lock()
+_flusher = None
+# Depth of the `flushing` calls running in this thread
+_local = threading.local()
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "NOTIFICATION_SINK", {})}
+
+
+def add(user, notification: str, content_object=None, platform_instance=None, error: bool = False) -> None:
+    """
+    Buffer a notification. Takes the fields of `Notification`, the content object being a post.
+    """
+    global _oldest
+    Notification = apps.get_model("omnipost_api", "Notification")
+    fields = dict(user=user, notification=notification, platform_instance=platform_instance, error=error)
+    if content_object is not None:
+        # get_for_model is cached per process, unlike assigning content_object
+        fields.update(
+            content_type=ContentType.objects.get_for_model(content_object),
+            object_id=content_object.pk,
+            post_type=getattr(content_object, "post_type", None),
+        )
+    _ensure_flusher()
+    with _lock:
+        _buffer.append(Notification(**fields))
+        if _oldest is None:
+            _oldest = time.monotonic()
+        full = len(_buffer) >= get_config()["MAX_BATCH"]
+    if full:
+        flush()
+
+
+def flush() -> int:
+    """
+    Write the buffered notifications. Returns the number written.
+    """
+    global _oldest
+    with _flush_lock:
+        with _lock:
+            if not _buffer:
+                return 0
+            batch = _buffer[:]
+            _buffer.clear()
+            _oldest = None
+        Notification = apps.get_model("omnipost_api", "Notification")
+        try:
+            # A savepoint, so that a flush inside a transaction can go on after a failure
+            with transaction.atomic():
+                Notification.objects.bulk_create(batch)
+            written = batch
+        except Exception as e:
+            logger.warning("Could not write %s notifications at once, writing them one by one: %s", len(batch), e)
+            written = _save_one_by_one(batch)
+    events.publish_many([
+        (notification.user_id, "notification", {
+            "id": notification.id,
+            "notification": notification.notification,
+            "error": notification.error,
+            "post_type": notification.post_type,
+            "post_id": notification.object_id,
+            "platform_instance_id": notification.platform_instance_id,
+            "created_at": notification.created_at,
+        })
+        for notification in written if notification.user_id is not None
+    ])
+    return len(written)
+
+
+def _save_one_by_one(batch: list) -> list:
+    """
+    Save the notifications of a batch that failed one by one. Returns the ones written.
+    """
+    written = []
+    unreachable = []
+    for notification in batch:
+        if unreachable:
+            # The others would fail the same way
+            unreachable.append(notification)
+            continue
+        try:
+            with transaction.atomic():
+                notification.save()
+        except (OperationalError, InterfaceError):
+            unreachable.append(notification)
+        except Exception:
+            logger.exception("Dropping a notification that can not be written: %s", notification.notification)
+        else:
+            written.append(notification)
+    if unreachable:
+        _requeue(unreachable)
+    return written
+
+
+def _requeue(notifications: list) -> None:
+    """
+    Put notifications that could not be written back at the front of the buffer.
+    """
+    global _oldest
+    max_buffer = get_config()["MAX_BUFFER"]
+    with _lock:
+        _buffer[:0] = notifications
+        dropped = len(_buffer) - max_buffer
+        if dropped > 0:
+            del _buffer[:dropped]
+        # Retried by the flusher once MAX_DELAY has passed
+        _oldest = time.monotonic()
+    if dropped > 0:
+        logger.error("Dropped %s notifications, the buffer is full", dropped)
+    logger.warning("Could not reach the database, %s notifications kept for the next flush", len(notifications))
+
+
+def flushing(job):
+    """
+    Decorator for job functions: flushes the buffer when the job ends, even if it fails.
+
+    Only the outermost call flushes, so a job that calls another one still writes once.
+    """
+    @functools.wraps(job)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_local, "depth", 0)
+        _local.depth = depth + 1
+        try:
+            return job(*args, **kwargs)
+        finally:
+            _local.depth = depth
+            if not depth:
+                flush()
+    return wrapper
+
+
+def _flush_when_due() -> None:
+    while True:
+        max_delay = get_config()["MAX_DELAY"]
+        time.sleep(max_delay / 2)
+        oldest = _oldest
+        if oldest is None or time.monotonic() - oldest < max_delay:
+            continue
+        try:
+            flush()
+        finally:
+            # This thread's DB connection would otherwise stay open between flushes
+            connection.close()
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_when_due, name="notification-sink-flusher", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
@@ -0,0 +1,208 @@
+"""
+Keyset (cursor) pagination for the post timelines and the notification feed.
+
+Posts live in one table per post type. A page is built by asking every table for
+at most `page_size + 1` rows after the cursor, ordered by `(created_at, id)`, and
+merging the sorted results with a k-way heap merge. Each query is served by the
+`(user, published, created_at, id)` index of its table, so the cost of a page does
+not grow with the user's history.
+
+The `a`-prefixed functions are the same for async views, with Django's async ORM.
+"""
+import base64
+import datetime
+import heapq
+import json
+from itertools import islice
+
+from django.db.models import Q
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime.datetime, id: int, post_type: str = None) -> str:
+    data = {"c": created_at.isoformat(), "i": id}
+    if post_type is not None:
+        data["t"] = post_type
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    Decode a cursor made by `encode_cursor` into `created_at`, `id` and `post_type`.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {
+            "created_at": datetime.datetime.fromisoformat(data["c"]),
+            "id": int(data["i"]),
+            "post_type": data.get("t"),
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+
+def get_page_size(value, default: int = DEFAULT_PAGE_SIZE) -> int:
+    if value in (None, ""):
+        return default
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("page_size must be an integer")
+    if page_size < 1:
+        raise ValueError("page_size must be positive")
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def before_cursor(cursor: dict, tiebreak: bool = False) -> Q:
+    """
+    Filter for rows that come after the cursor in `(-created_at, -id)` order.
+
+    `tiebreak` includes the row with the cursor's own `created_at` and `id`; it is used
+    for the tables that sort after the cursor's table when both columns are equal.
+    """
+    created_at = cursor["created_at"]
+    condition = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=cursor["id"])
+    if tiebreak:
+        condition |= Q(created_at=created_at, id=cursor["id"])
+    return condition
+
+
+def _page_rows(queryset, cursor: str, page_size: int):
+    if cursor:
+        queryset = queryset.filter(before_cursor(decode_cursor(cursor)))
+    return queryset.order_by("-created_at", "-id").values()[:page_size + 1]
+
+
+def _queryset_page(rows: list, page_size: int) -> tuple:
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+def paginate_queryset(queryset, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE) -> tuple:
+    """
+    Return one page of a single table queryset, newest first by `(created_at, id)`.
+
+    Returns:
+        tuple: (list of row dicts, next cursor or None)
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    return _queryset_page(list(_page_rows(queryset, cursor, page_size)), page_size)
+
+
+async def apaginate_queryset(queryset, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE) -> tuple:
+    return _queryset_page([row async for row in _page_rows(queryset, cursor, page_size)], page_size)
+
+
+def _sort_keyed(rows, post_type: str, rank: int):
+    # Ties on (created_at, id) across tables are broken by the post type's rank
+    for row in rows:
+        yield (row["created_at"], row["id"], -rank), post_type, row
+
+
+def _post_querysets(
+    post_models: dict,
+    user,
+    published: bool,
+    cursor: str,
+    page_size: int,
+    created_after: datetime.datetime,
+    created_before: datetime.datetime,
+):
+    """
+    Yield (post type, rank, queryset of the rows the page may hold) for every post type.
+    """
+    decoded = decode_cursor(cursor) if cursor else None
+    ranks = {post_type: rank for rank, post_type in enumerate(post_models)}
+    for post_type, model in post_models.items():
+        queryset = model.objects.filter(user=user, published=published)
+        if created_after is not None:
+            queryset = queryset.filter(created_at__gte=created_after)
+        if created_before is not None:
+            queryset = queryset.filter(created_at__lt=created_before)
+        if decoded is not None:
+            cursor_rank = ranks.get(decoded["post_type"], -1)
+            queryset = queryset.filter(before_cursor(decoded, tiebreak=ranks[post_type] > cursor_rank))
+        yield post_type, ranks[post_type], queryset.order_by("-created_at", "-id").values()[:page_size + 1]
+
+
+def _merge_posts(streams: list, page_size: int) -> tuple:
+    merged = heapq.merge(*streams, key=lambda item: item[0], reverse=True)
+    page = list(islice(merged, page_size + 1))
+
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        _, post_type, row = page[-1]
+        next_cursor = encode_cursor(row["created_at"], row["id"], post_type)
+
+    posts = []
+    for _, post_type, row in page:
+        row["post_type"] = post_type
+        posts.append(row)
+    return posts, next_cursor
+
+
+def paginate_posts(
+    post_models: dict,
+    user,
+    published: bool,
+    cursor: str = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    created_after: datetime.datetime = None,
+    created_before: datetime.datetime = None,
+) -> tuple:
+    """
+    Return one page of a user's posts across post types, newest first.
+
+    Args:
+        post_models (dict): Post type name -> model, in the order used to break ties
+        user (User): Owner of the posts
+        published (bool): Published posts or drafts
+        cursor (str): `next_cursor` of the previous page
+        page_size (int): Number of posts on the page
+        created_after (datetime): Only posts created at or after this time
+        created_before (datetime): Only posts created before this time
+    Returns:
+        tuple: (list of post dicts with a `post_type` key, next cursor or None)
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    streams = [
+        _sort_keyed(rows, post_type, rank)
+        for post_type, rank, rows in _post_querysets(
+            post_models, user, published, cursor, page_size, created_after, created_before
+        )
+    ]
+    return _merge_posts(streams, page_size)
+
+
+async def apaginate_posts(
+    post_models: dict,
+    user,
+    published: bool,
+    cursor: str = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    created_after: datetime.datetime = None,
+    created_before: datetime.datetime = None,
+) -> tuple:
+    streams = [
+        _sort_keyed([row async for row in rows], post_type, rank)
+        for post_type, rank, rows in _post_querysets(
+            post_models, user, published, cursor, page_size, created_after, created_before
+        )
+    ]
+    return _merge_posts(streams, page_size)
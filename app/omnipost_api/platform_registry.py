@@ -0,0 +1,140 @@
+"""
+In-process registry of platforms and their configs.
+
+Platform configs change rarely but are read by every post save and every action
+step. The registry loads all platforms in one query and keeps them in memory,
+each stamped with its `config_version`. Saving or deleting a `Platform` drops the
+local copy and publishes the change on a Redis pub/sub channel; every web and RQ
+process listens on that channel and drops its own copy, so the next read loads the
+new config. Copies older than `MAX_AGE` seconds are reloaded even if a message was
+missed.
+
+The returned `Platform` instances are shared, treat them as read-only.
+"""
+import json
+import logging
+import threading
+import time
+
+import django_rq
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+
+from omnipost_api.request_templates import clear_compiled_actions
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "CHANNEL": "omnipost:platforms",
+    "MAX_AGE": 300,
+    "REDIS_QUEUE": "default",
+}
+
+# (loaded_at, {platform id: Platform}); replaced as a whole, never mutated
+_snapshot = None
+_lock = threading.Lock()
+_listener = None
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "PLATFORM_REGISTRY", {})}
+
+
+def _load() -> dict:
+    global _snapshot
+    with _lock:
+        if _snapshot is None or time.monotonic() - _snapshot[0] > get_config()["MAX_AGE"]:
+            Platform = apps.get_model("omnipost_api", "Platform")
+            platforms = {platform.id: platform for platform in Platform.objects.all()}
+            _snapshot = (time.monotonic(), platforms)
+        return _snapshot[1]
+
+
+def get_platforms() -> dict:
+    """
+    All platforms by id, loaded with a single query when the registry is empty or stale.
+    """
+    _ensure_listener()
+    snapshot = _snapshot
+    if snapshot is None or time.monotonic() - snapshot[0] > get_config()["MAX_AGE"]:
+        return _load()
+    return snapshot[1]
+
+
+def get_platform(platform_id: int):
+    """
+    Raises:
+        Platform.DoesNotExist: If there is no platform with this id
+    """
+    platform = get_platforms().get(platform_id)
+    if platform is None:
+        # Possibly created after the registry was loaded
+        invalidate()
+        platform = get_platforms().get(platform_id)
+        if platform is None:
+            Platform = apps.get_model("omnipost_api", "Platform")
+            raise Platform.DoesNotExist(f"Platform {platform_id} does not exist.")
+    return platform
+
+
+def get_platform_names() -> list:
+    return [platform.name for platform in get_platforms().values()]
+
+
+def invalidate(platform_id: int = None) -> None:
+    """
+    Drop this process' copy of the platforms and the request templates compiled from them.
+    """
+    global _snapshot
+    with _lock:
+        _snapshot = None
+    clear_compiled_actions(platform_id)
+
+
+def _publish(platform_id: int, version: int = None) -> None:
+    config = get_config()
+    try:
+        connection = django_rq.get_connection(config["REDIS_QUEUE"])
+        connection.publish(config["CHANNEL"], json.dumps({"id": platform_id, "version": version}))
+    except Exception as e:
+        # Other processes fall back to MAX_AGE
+        logger.warning("Could not publish platform change %s: %s", platform_id, e)
+
+
+def _listen() -> None:
+    config = get_config()
+    while True:
+        try:
+            pubsub = django_rq.get_connection(config["REDIS_QUEUE"]).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(config["CHANNEL"])
+            # Changes may have been missed while not subscribed
+            invalidate()
+            for message in pubsub.listen():
+                try:
+                    platform_id = json.loads(message["data"])["id"]
+                except (ValueError, KeyError, TypeError):
+                    platform_id = None
+                invalidate(platform_id)
+        except Exception as e:
+            logger.warning("Platform registry listener disconnected: %s", e)
+            time.sleep(5)
+
+
+def _ensure_listener() -> None:
+    global _listener
+    if _listener is not None:
+        return
+    with _lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name="platform-registry-listener", daemon=True)
+            _listener.start()
+
+
+def platform_changed(sender, instance, **kwargs):
+    """
+    `post_save`/`post_delete` receiver for `Platform`, connected in `OmnipostApiConfig.ready`.
+    """
+    invalidate(instance.id)
+    transaction.on_commit(lambda: _publish(instance.id, instance.config_version))
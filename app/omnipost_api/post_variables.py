@@ -0,0 +1,82 @@
+"""
+Per-platform variable store inside `PostBase.post_configs`.
+
+Action steps only touch the slice of `post_configs` that belongs to their
+platform: they read `post_configs -> platform` and merge the extracted variables
+into it with a single `jsonb_set` UPDATE, so the rest of the row is neither read
+nor rewritten and concurrent steps for other platforms cannot overwrite each
+other. Databases other than PostgreSQL (eg. SQLite during development) fall back
+to a locked read-modify-write of the whole column.
+"""
+import json
+
+from django.db import connections, models, router, transaction
+from django.db.models import F, Func
+from django.db.models.fields.json import KeyTransform
+
+
+class JSONBMergeKey(Func):
+    """
+    `column = jsonb_set(column, '{key}', (column -> key) || values)`, creating the key when missing.
+    """
+    output_field = models.JSONField()
+
+    def __init__(self, field_name: str, key: str, values: dict):
+        super().__init__(F(field_name))
+        self.key = key
+        self.values = values
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column_sql, column_params = compiler.compile(self.get_source_expressions()[0])
+        sql = (
+            f"jsonb_set(COALESCE({column_sql}, '{{}}'::jsonb), ARRAY[%s]::text[], "
+            f"COALESCE({column_sql} -> %s, '{{}}'::jsonb) || %s::jsonb, true)"
+        )
+        return sql, (*column_params, self.key, *column_params, self.key, json.dumps(self.values))
+
+
+def read(model, post_id: int, platform_name: str) -> dict:
+    """
+    Return only the platform's slice of the post's `post_configs`.
+    """
+    value = (
+        model.objects.filter(pk=post_id)
+        .annotate(platform_config=KeyTransform(platform_name, "post_configs"))
+        .values_list("platform_config", flat=True)
+        .get()
+    )
+    if isinstance(value, str):
+        # Backends without native JSON return the slice as text
+        value = json.loads(value)
+    return value or {}
+
+
+def merge(model, post_id: int, platform_name: str, values: dict, published: bool = False) -> None:
+    """
+    Merge `values` into the platform's slice of the post's `post_configs` atomically.
+
+    Args:
+        model: The post model
+        post_id (int): Id of the post
+        platform_name (str): Key of the platform in `post_configs`
+        values (dict): Variables to add or overwrite
+        published (bool): Also mark the post as published in the same statement
+    """
+    fields = {}
+    if published:
+        fields["published"] = True
+
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor == "postgresql":
+        if values:
+            fields["post_configs"] = JSONBMergeKey("post_configs", platform_name, values)
+        if fields:
+            model.objects.filter(pk=post_id).update(**fields)
+        return
+
+    with transaction.atomic(using=connection.alias):
+        post_configs = model.objects.select_for_update().values_list("post_configs", flat=True).get(pk=post_id)
+        post_configs = post_configs or {}
+        post_configs.setdefault(platform_name, {}).update(values)
+        fields["post_configs"] = post_configs
+        model.objects.filter(pk=post_id).update(**fields)
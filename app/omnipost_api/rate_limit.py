@@ -0,0 +1,196 @@
+"""
+Token bucket rate limits for calls to platform APIs, shared by every worker.
+
+Limits are declared per platform in `Platform.config["RATE_LIMITS"]`:
+```
+"RATE_LIMITS": {
+    "PLATFORM": {"requests": 4800, "per": 86400, "burst": 50},
+    "INSTANCE": {"requests": 200, "per": 3600, "burst": 20}
+}
+```
+`PLATFORM` is shared by all the instances of the platform (eg. an app-wide quota),
+`INSTANCE` applies to each platform instance (eg. a per-account quota). Tokens are
+refilled at `requests / per` per second up to `burst` (default `requests`).
+
+The buckets live in Redis and are updated by a Lua script using the Redis clock, so
+every web and RQ process draws from the same buckets. A request takes a token from
+all of its buckets at once or from none of them; when a bucket is empty the caller
+sleeps until the script says a token will be available.
+
+A 429 response pauses the instance's bucket for the response's `Retry-After` (or
+`RATE_LIMIT["DEFAULT_PAUSE"]` seconds), so that the other workers back off as well
+instead of running into the same limit.
+"""
+import logging
+import random
+import time
+
+import django_rq
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "KEY_PREFIX": "omnipost:ratelimit:",
+    "REDIS_QUEUE": "default",
+    # Longest a request waits for a token before giving up, well within the RQ job timeout
+    "MAX_WAIT": 120,
+    "DEFAULT_PAUSE": 30,
+}
+
+# KEYS: bucket keys. ARGV: rate and burst of every bucket.
+# Returns "0" once a token was taken from every bucket, or else the seconds to wait.
+ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local wait = 0
+local buckets = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    if now > ts then
+        tokens = math.min(burst, tokens + (now - ts) * rate)
+        ts = now
+    end
+    if tokens < 1 then
+        wait = math.max(wait, (ts - now) + (1 - tokens) / rate)
+    end
+    buckets[i] = {tokens, ts, rate, burst}
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local bucket = buckets[i]
+    redis.call('HSET', key, 'tokens', tostring(bucket[1] - 1), 'ts', tostring(bucket[2]))
+    redis.call('EXPIRE', key, math.ceil(bucket[2] - now + bucket[4] / bucket[3]) + 1)
+end
+return '0'
+"""
+
+# KEYS: bucket keys. ARGV: seconds to pause, seconds to keep the keys.
+PAUSE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local resume = now + tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+    local ts = tonumber(redis.call('HGET', key, 'ts')) or 0
+    if resume > ts then
+        redis.call('HSET', key, 'tokens', '0', 'ts', tostring(resume))
+        redis.call('EXPIRE', key, math.ceil(ARGV[2]))
+    end
+end
+return 1
+"""
+
+_scripts = {}
+
+
+class RateLimitTimeout(ValueError):
+    pass
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "RATE_LIMIT", {})}
+
+
+def _run_script(source: str, keys: list, args: list):
+    connection = django_rq.get_connection(get_config()["REDIS_QUEUE"])
+    script = _scripts.get(source)
+    if script is None:
+        # Only hashes the source, the script is loaded into Redis on first call
+        script = _scripts[source] = connection.register_script(source)
+    return script(keys=keys, args=args, client=connection)
+
+
+def _rate(limit: dict) -> tuple:
+    """
+    (tokens per second, burst) of a limit from the platform config.
+    """
+    requests = float(limit["requests"])
+    per = float(limit.get("per", 1))
+    if requests <= 0 or per <= 0:
+        raise ValueError(f"Invalid rate limit {limit}, requests and per must be positive.")
+    return requests / per, max(float(limit.get("burst", requests)), 1.0)
+
+
+def _bucket(platform, scope: str, id: int):
+    limit = ((platform.config or {}).get("RATE_LIMITS") or {}).get(scope)
+    if not limit:
+        return None
+    return (f"{get_config()['KEY_PREFIX']}{scope.lower()}:{id}", *_rate(limit))
+
+
+def get_buckets(platform, platform_instance_id: int) -> list:
+    """
+    The (key, rate, burst) buckets a request to the platform on behalf of the instance draws from.
+    """
+    buckets = [
+        _bucket(platform, "PLATFORM", platform.id),
+        _bucket(platform, "INSTANCE", platform_instance_id),
+    ]
+    return [bucket for bucket in buckets if bucket is not None]
+
+
+def acquire(platform, platform_instance_id: int, max_wait: float = None) -> float:
+    """
+    Take a token from the platform's and the instance's buckets, waiting for one if needed.
+
+    If Redis cannot be reached the request is let through, as the platform enforces its
+    own limits anyway.
+
+    Args:
+        platform (Platform): The platform the request is sent to
+        platform_instance_id (int): The platform instance the request is sent for
+        max_wait (float): Seconds to wait at most, defaults to `RATE_LIMIT["MAX_WAIT"]`
+    Returns:
+        float: Seconds spent waiting
+    Raises:
+        RateLimitTimeout: If no token is available within `max_wait` seconds
+    """
+    buckets = get_buckets(platform, platform_instance_id)
+    if not buckets:
+        return 0.0
+    config = get_config()
+    if max_wait is None:
+        max_wait = config["MAX_WAIT"]
+
+    keys = [key for key, _, _ in buckets]
+    args = [value for _, rate, burst in buckets for value in (rate, burst)]
+    waited = 0.0
+    while True:
+        try:
+            wait = float(_run_script(ACQUIRE_SCRIPT, keys, args))
+        except Exception as e:
+            logger.warning("Rate limiter unavailable, not limiting %s: %s", platform, e)
+            return waited
+        if wait <= 0:
+            return waited
+        if waited + wait > max_wait:
+            raise RateLimitTimeout(
+                f"Rate limit of {platform} reached, no request allowed within {max_wait} seconds."
+            )
+        # A little jitter, so that workers woken for the same token do not all retry at once
+        wait *= 1 + random.random() * 0.1
+        time.sleep(wait)
+        waited += wait
+
+
+def pause(platform, platform_instance_id: int, seconds: float = None) -> None:
+    """
+    Empty the instance's bucket for `seconds`, eg. after the platform answered 429.
+    """
+    if seconds is None:
+        seconds = get_config()["DEFAULT_PAUSE"]
+    bucket = _bucket(platform, "INSTANCE", platform_instance_id)
+    if bucket is None or seconds <= 0:
+        return
+    key, rate, burst = bucket
+    try:
+        _run_script(PAUSE_SCRIPT, [key], [seconds, seconds + burst / rate + 1])
+    except Exception as e:
+        logger.warning("Could not pause rate limit of %s: %s", platform, e)
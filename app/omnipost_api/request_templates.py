@@ -0,0 +1,150 @@
+"""
+Compiled request templates for platform actions.
+
+Every step in `Platform.config["ACTIONS"]` is a request dict whose strings carry
+placeholders such as `ACCESS_TOKEN`, `PAGE_ID` or `CAPTION`. Each step is parsed
+once into a substitution plan and cached per platform and config version, so a
+request is rendered in a single walk of the template without dumping it to JSON
+and parsing it back.
+
+A placeholder is a whole upper-case word (`[A-Z][A-Z0-9_]*`). A key only matches
+a complete word, so `ID` never rewrites part of `PAGE_ID`, and words with no
+value (eg. `POST`, `PUBLIC`) are left as they are.
+"""
+import re
+import threading
+from collections import ChainMap
+
+from omnipost_api.chunked_upload import ChunkedUpload
+from omnipost_api.extraction import Extractor
+from omnipost_api.retry import RetryPolicy
+
+
+PLACEHOLDER_PATTERN = re.compile(r"(?<![A-Za-z0-9_])([A-Z][A-Z0-9_]*)(?![A-Za-z0-9_])")
+
+
+def _compile_string(template: str):
+    # re.split with a capturing group alternates literal text and placeholder names
+    parts = PLACEHOLDER_PATTERN.split(template)
+    if len(parts) == 1:
+        return lambda values: template
+
+    literals = parts[0::2]
+    names = parts[1::2]
+
+    if len(names) == 1 and literals == ["", ""]:
+        # The whole string is one placeholder, eg. "CONTAINER_ID"
+        name = names[0]
+
+        def render_single(values):
+            if name in values:
+                return f"{values[name]}"
+            return name
+        return render_single
+
+    def render(values):
+        out = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            out.append(f"{values[name]}" if name in values else name)
+            out.append(literal)
+        return "".join(out)
+    return render
+
+
+def _compile_node(node):
+    if isinstance(node, str):
+        return _compile_string(node)
+
+    if isinstance(node, dict):
+        items = [(_compile_string(key), _compile_node(value)) for key, value in node.items()]
+        return lambda values: {key(values): value(values) for key, value in items}
+
+    if isinstance(node, list):
+        items = [_compile_node(value) for value in node]
+        return lambda values: [item(values) for item in items]
+
+    # Numbers, booleans and null are copied through untouched
+    return lambda values: node
+
+
+class CompiledStep:
+    """
+    A single action step, compiled from `[request, expected_response_code, variable_mapping, options]`.
+
+    `options` is optional; see `Platform` for the keys it supports.
+    """
+    __slots__ = ("request", "expected_response_code", "variable_mapping", "options", "min_gap", "retry", "extractor", "upload", "_render")
+
+    def __init__(self, request: dict, expected_response_code: int, variable_mapping: dict, options: dict = None):
+        self.request = request
+        self.expected_response_code = expected_response_code
+        self.variable_mapping = variable_mapping
+        self.options = options or {}
+        self.min_gap = float(self.options.get("min_gap", 0))
+        self.retry = RetryPolicy.from_options(self.options)
+        # See omnipost_api.extraction for the path expressions of variable_mapping
+        self.extractor = Extractor(variable_mapping)
+        # Steps with an upload option stream the post's media, see omnipost_api.chunked_upload
+        self.upload = ChunkedUpload(self.options["upload"]) if self.options.get("upload") else None
+        self._render = _compile_node(request)
+
+    def render(self, *values: dict) -> dict:
+        """
+        Render the request with one or more dicts of values, eg. the instance credentials
+        and the post's platform config.
+
+        When a key is in several dicts, the first one wins.
+        """
+        return self._render(ChainMap(*values))
+
+
+def compile_action(steps: list) -> list:
+    """
+    Compile the list of steps of an action into `CompiledStep`s.
+    """
+    return [CompiledStep(*step) for step in steps]
+
+
+# platform id -> (config_version, {action: [CompiledStep, ...]})
+_compiled_actions = {}
+_compiled_actions_lock = threading.Lock()
+
+
+def get_compiled_action(platform, action: str) -> list:
+    """
+    Return the compiled steps of `action` for `platform`, compiling them on first use.
+
+    Compiled plans are cached by platform id and `config_version`, so a saved
+    config is recompiled the next time it is used.
+
+    Raises:
+        ValueError: If the action is not defined for the platform
+    """
+    actions = platform.config.get("ACTIONS", {})
+    if action not in actions:
+        raise ValueError(f"Action '{action}' not defined in platform {platform.name}.")
+
+    entry = _compiled_actions.get(platform.id)
+    if entry is None or entry[0] != platform.config_version:
+        with _compiled_actions_lock:
+            entry = _compiled_actions.get(platform.id)
+            if entry is None or entry[0] != platform.config_version:
+                entry = (platform.config_version, {})
+                _compiled_actions[platform.id] = entry
+
+    compiled = entry[1].get(action)
+    if compiled is None:
+        compiled = compile_action(actions[action])
+        entry[1][action] = compiled
+    return compiled
+
+
+def clear_compiled_actions(platform_id: int = None) -> None:
+    """
+    Drop cached plans for one platform, or for all platforms if no id is given.
+    """
+    with _compiled_actions_lock:
+        if platform_id is None:
+            _compiled_actions.clear()
+        else:
+            _compiled_actions.pop(platform_id, None)
@@ -0,0 +1,77 @@
+"""
+Retry policies of action steps.
+
+A step is retried when the platform answers with one of the policy's `retry_on`
+status codes, or the connection fails or times out, up to `max_attempts` attempts in total.
+Attempt `n` waits a random time between 0 and `backoff * 2 ** (n - 1)` seconds,
+capped at `max_backoff` ("full jitter"), or the response's `Retry-After` if that
+is longer. A `Retry-After` longer than `max_backoff` is not waited for; the step
+fails and goes to the dead-letter queue (`DeadLetter`) to be replayed later.
+
+The policy of a step is `settings.STEP_RETRY`, overridden by the step's options:
+```
+[request, expected_response_code, variable_mapping, {"retry": {"max_attempts": 5, "retry_on": [429, 503]}}]
+```
+"""
+import random
+
+from django.conf import settings
+
+
+DEFAULTS = {
+    "MAX_ATTEMPTS": 3,
+    "BACKOFF": 1.0,
+    "MAX_BACKOFF": 60.0,
+    # Codes that mean the request was not processed; 500 is left out as the post may have been created
+    "RETRY_ON": [429, 502, 503, 504],
+}
+
+
+class StepFailed(ValueError):
+    """
+    Raised when an action step did not get its expected response, after all its attempts.
+    """
+    def __init__(self, message: str, status_code: int = None, attempts: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.attempts = attempts
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "STEP_RETRY", {})}
+
+
+class RetryPolicy:
+    __slots__ = ("max_attempts", "backoff", "max_backoff", "retry_on")
+
+    def __init__(self, max_attempts: int, backoff: float, max_backoff: float, retry_on: list):
+        self.max_attempts = max(int(max_attempts), 1)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.retry_on = frozenset(int(code) for code in retry_on)
+
+    @classmethod
+    def from_options(cls, options: dict) -> "RetryPolicy":
+        """
+        The policy of a step: `settings.STEP_RETRY` overridden by the step's `retry` option.
+        """
+        config = {key.lower(): value for key, value in get_config().items()}
+        config.update((options or {}).get("retry") or {})
+        return cls(config["max_attempts"], config["backoff"], config["max_backoff"], config["retry_on"])
+
+    def retries(self, status_code: int = None) -> bool:
+        """
+        Whether a failed attempt is worth another one; `None` stands for a connection error or timeout.
+        """
+        return status_code is None or status_code in self.retry_on
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """
+        Seconds to wait after failed attempt number `attempt` (from 1), or None to give up.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if retry_after is not None and retry_after > self.max_backoff:
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        return max(delay, retry_after or 0)
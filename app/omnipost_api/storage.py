@@ -0,0 +1,224 @@
+"""
+Uploads of post media to the public S3 bucket.
+
+A single boto3 client is kept per process and files are streamed to S3 with a
+multipart upload whose part size and number of parallel parts come from
+`settings.MEDIA_UPLOAD`. Setting `ENDPOINT_URL` points the client at a local S3
+stand-in (eg. MinIO or a moto server) for development and tests.
+"""
+import mimetypes
+import os
+import threading
+from typing import BinaryIO, Callable
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+
+DEFAULTS = {
+    "BUCKET": "omnipost-images",
+    "ENDPOINT_URL": None,
+    "REGION": None,
+    "PART_SIZE": 8 * 1024 * 1024,
+    "MAX_CONCURRENCY": 4,
+    # Deduplicated media is stored under CONTENT_PREFIX + sha256 + extension
+    "CONTENT_PREFIX": "media/sha256/",
+    # Per-platform variants of an image: DERIVED_PREFIX + sha256 of the source + "/" + profile id
+    "DERIVED_PREFIX": "media/derived/",
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_config() -> dict:
+    return {**DEFAULTS, **getattr(settings, "MEDIA_UPLOAD", {})}
+
+
+def get_client():
+    """
+    Return the process-wide S3 client, creating it on first use.
+
+    boto3 clients are thread safe once created, but creating one is not.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                config = get_config()
+                _client = boto3.client(
+                    "s3",
+                    aws_access_key_id=os.environ.get("AWS_ACCESS_KEY"),
+                    aws_secret_access_key=os.environ.get("AWS_SECRET_KEY"),
+                    endpoint_url=config["ENDPOINT_URL"],
+                    region_name=config["REGION"],
+                )
+    return _client
+
+
+def reset_client() -> None:
+    """
+    Drop the cached client, eg. after changing `MEDIA_UPLOAD` in tests.
+    """
+    global _client
+    with _client_lock:
+        _client = None
+
+
+class UploadProgress:
+    """
+    Callback for boto3 transfers that adds up the bytes sent by every part.
+
+    `on_progress(sent, total)` is called whenever another `step` fraction of the
+    file has been sent.
+    """
+    def __init__(self, total: int = None, on_progress: Callable[[int, int], None] = None, step: float = 0.1):
+        self.total = total
+        self.sent = 0
+        self.on_progress = on_progress
+        self._step_bytes = max(int((total or 0) * step), 1)
+        self._next_report = self._step_bytes
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_sent: int) -> None:
+        # Parts are uploaded from several threads
+        with self._lock:
+            self.sent += bytes_sent
+            report = self.on_progress is not None and self.sent >= self._next_report
+            if report:
+                self._next_report = self.sent + self._step_bytes
+            sent = self.sent
+        if report:
+            self.on_progress(sent, self.total)
+
+
+def upload_fileobj(
+    fileobj: BinaryIO,
+    key: str,
+    size: int = None,
+    content_type: str = None,
+    on_progress: Callable[[int, int], None] = None,
+    metadata: dict = None,
+) -> int:
+    """
+    Stream a file object to the media bucket under `key`.
+
+    Files larger than one part are sent as a multipart upload with up to
+    `MAX_CONCURRENCY` parts in flight, so only a few parts are held in memory.
+
+    Args:
+        fileobj (BinaryIO): Readable binary file, read from its current position
+        key (str): Object key in the bucket
+        size (int): Size of the file in bytes, used for progress reporting
+        content_type (str): Content-Type to store with the object
+        on_progress (Callable): Called with (bytes_sent, size) as the upload progresses
+        metadata (dict): User metadata to store with the object, str to str
+    Returns:
+        int: Number of bytes uploaded
+    """
+    config = get_config()
+    transfer_config = TransferConfig(
+        multipart_threshold=config["PART_SIZE"],
+        multipart_chunksize=config["PART_SIZE"],
+        max_concurrency=config["MAX_CONCURRENCY"],
+    )
+    progress = UploadProgress(total=size, on_progress=on_progress)
+    extra_args = {}
+    if content_type:
+        extra_args["ContentType"] = content_type
+    if metadata:
+        extra_args["Metadata"] = metadata
+
+    get_client().upload_fileobj(
+        fileobj,
+        config["BUCKET"],
+        key,
+        ExtraArgs=extra_args or None,
+        Config=transfer_config,
+        Callback=progress,
+    )
+    if on_progress is not None:
+        on_progress(progress.sent, size)
+    return progress.sent
+
+
+def upload_field_file(field_file, key: str = None, on_progress: Callable[[int, int], None] = None) -> int:
+    """
+    Stream the file of a `FileField`/`ImageField` to the media bucket.
+
+    The key defaults to the file's name in storage.
+    """
+    key = key or field_file.name
+    content_type, _ = mimetypes.guess_type(key)
+    with field_file.open("rb") as f:
+        return upload_fileobj(f, key, size=field_file.size, content_type=content_type, on_progress=on_progress)
+
+
+def object_size(key: str) -> int:
+    """
+    Size in bytes of an object in the media bucket.
+    """
+    return get_client().head_object(Bucket=get_config()["BUCKET"], Key=key)["ContentLength"]
+
+
+def read_range(key: str, start: int, length: int) -> bytes:
+    """
+    Read `length` bytes from `start` of an object in the media bucket with a ranged GET.
+    """
+    response = get_client().get_object(
+        Bucket=get_config()["BUCKET"],
+        Key=key,
+        Range=f"bytes={start}-{start + length - 1}",
+    )
+    with response["Body"] as body:
+        return body.read()
+
+
+def content_key(digest: str, extension: str = "") -> str:
+    """
+    Content-addressed key of a file in the media bucket, eg. `media/sha256/<digest>.mp4`.
+    """
+    return f"{get_config()['CONTENT_PREFIX']}{digest}{extension.lower()}"
+
+
+def public_url(key: str) -> str:
+    return f"{os.environ.get('BUCKET_URL')}/{key}"
+
+
+def object_metadata(key: str):
+    """
+    User metadata of an object in the media bucket, or None if there is no such object.
+    """
+    try:
+        return get_client().head_object(Bucket=get_config()["BUCKET"], Key=key)["Metadata"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def read_object(key: str) -> bytes:
+    response = get_client().get_object(Bucket=get_config()["BUCKET"], Key=key)
+    with response["Body"] as body:
+        return body.read()
+
+
+def delete_object(key: str) -> None:
+    get_client().delete_object(Bucket=get_config()["BUCKET"], Key=key)
+
+
+def delete_prefix(prefix: str) -> int:
+    """
+    Delete every object whose key starts with `prefix`. Returns the number of objects deleted.
+    """
+    config = get_config()
+    client = get_client()
+    deleted = 0
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=config["BUCKET"], Prefix=prefix):
+        objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+        if objects:
+            client.delete_objects(Bucket=config["BUCKET"], Delete={"Objects": objects})
+            deleted += len(objects)
+    return deleted
@@ -1,3 +1,734 @@
-from django.test import TestCase
+import datetime
+import io
+import struct
+import threading
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from omnipost_api import dispatcher, media_probe, notification_sink, post_variables, storage
+from omnipost_api.extraction import ExtractionError, Extractor, parse_path
+from omnipost_api.models import (
+    MEDIA_FAILED, POST_MODELS, DeadLetter, MediaObject, Notification, Platform, PlatformInstance, PostImage, PostText,
+    PostVideo, PublishIntent, User, _send_chunks, offload_media, run_action_chains, run_action_steps,
+)
+from omnipost_api.pagination import (
+    MAX_PAGE_SIZE, InvalidCursor, _merge_posts, _sort_keyed, decode_cursor, encode_cursor, get_page_size, paginate_posts,
+)
+from omnipost_api.rate_limit import _rate, get_buckets
+from omnipost_api.request_templates import CompiledStep, clear_compiled_actions, get_compiled_action
+from omnipost_api.retry import RetryPolicy, StepFailed
+
+
+def fake_response(body=None, headers=None, text=""):
+    def json():
+        if body is None:
+            raise ValueError("No JSON")
+        return body
+    return SimpleNamespace(json=json, headers=headers or {}, text=text)
+
+
+class ParsePathTests(SimpleTestCase):
+    def test_keys_and_indices(self):
+        self.assertEqual(parse_path("data.items[0].id"), ["data", "items", 0, "id"])
+        self.assertEqual(parse_path("media[-1]"), ["media", -1])
+
+    def test_quoted_keys(self):
+        self.assertEqual(parse_path("upload['url.v2']"), ["upload", "url.v2"])
+        self.assertEqual(parse_path('a["b[0]"].c'), ["a", "b[0]", "c"])
+
+    def test_malformed_paths(self):
+        for path in ("", ".id", "a[", "a[x]", "a['b]"):
+            with self.subTest(path=path):
+                with self.assertRaises(ValueError):
+                    parse_path(path)
+
+
+class ExtractorTests(SimpleTestCase):
+    def test_body_headers_and_terminal(self):
+        extractor = Extractor({
+            "data.id": "POST_ID",
+            "media[-1].id": "MEDIA_ID",
+            "headers.Location": "UPLOAD_URL",
+            "terminal_request": True,
+        })
+        response = fake_response({"data": {"id": "1"}, "media": [{"id": "a"}, {"id": "b"}]}, {"Location": "http://up"})
+        self.assertTrue(extractor.terminal)
+        self.assertEqual(extractor.extract(response), {"POST_ID": "1", "MEDIA_ID": "b", "UPLOAD_URL": "http://up"})
+
+    def test_defaults(self):
+        extractor = Extractor({
+            "data.cursor ?? null": "NEXT_CURSOR",
+            "data.count ?? 0": "COUNT",
+            "data.state ?? pending": "STATE",
+            "headers.X-Id ?? none": "HEADER_ID",
+        })
+        self.assertEqual(
+            extractor.extract(fake_response({"data": {}})),
+            {"NEXT_CURSOR": None, "COUNT": 0, "STATE": "pending", "HEADER_ID": "none"},
+        )
+
+    def test_missing_path_without_default(self):
+        with self.assertRaises(ExtractionError):
+            Extractor({"data.id": "POST_ID"}).extract(fake_response({"data": []}))
+
+    def test_headers_only_do_not_parse_the_body(self):
+        extractor = Extractor({"headers.Location": "UPLOAD_URL"})
+        self.assertEqual(extractor.extract(fake_response(headers={"Location": "x"})), {"UPLOAD_URL": "x"})
+
+    def test_body_that_is_not_json(self):
+        with self.assertRaises(ExtractionError):
+            Extractor({"id": "POST_ID"}).extract(fake_response(text="<html>"))
+
+
+class RequestTemplateTests(SimpleTestCase):
+    def render(self, request, *values):
+        return CompiledStep(request, 200, {}).render(*values)
+
+    def test_placeholders_in_values_and_keys(self):
+        request = {
+            "method": "POST",
+            "url": "https://graph/PAGE_ID/feed?access_token=ACCESS_TOKEN",
+            "data": {"message": "CAPTION", "FIELD_NAME": ["CAPTION", "PAGE_ID"]},
+        }
+        self.assertEqual(
+            self.render(request, {"PAGE_ID": 7, "ACCESS_TOKEN": "t", "CAPTION": "hi", "FIELD_NAME": "text"}),
+            {
+                "method": "POST",
+                "url": "https://graph/7/feed?access_token=t",
+                "data": {"message": "hi", "text": ["hi", "7"]},
+            },
+        )
+
+    def test_whole_words_only(self):
+        request = {"a": "ID PAGE_ID IDS xID ID_2", "b": "ID"}
+        self.assertEqual(self.render(request, {"ID": "1"}), {"a": "1 PAGE_ID IDS xID ID_2", "b": "1"})
+
+    def test_unknown_words_and_non_strings_are_kept(self):
+        request = {"method": "POST", "privacy": "PUBLIC", "count": 3, "draft": False, "parent": None}
+        self.assertEqual(self.render(request, {}), request)
+
+    def test_first_dict_wins(self):
+        self.assertEqual(self.render({"t": "TOKEN"}, {"TOKEN": "instance"}, {"TOKEN": "post"}), {"t": "instance"})
+        self.assertEqual(self.render({"t": "TOKEN"}, {}, {"TOKEN": "post"}), {"t": "post"})
+
+    def test_renders_are_independent(self):
+        step = CompiledStep({"data": {"ids": ["ID"]}}, 200, {})
+        first = step.render({"ID": "1"})
+        first["data"]["ids"].append("x")
+        self.assertEqual(step.render({"ID": "2"}), {"data": {"ids": ["2"]}})
+
+
+class CompiledActionCacheTests(SimpleTestCase):
+    def setUp(self):
+        clear_compiled_actions()
+        self.addCleanup(clear_compiled_actions)
+        self.platform = SimpleNamespace(
+            id=1, name="Fake", config_version=1,
+            config={"ACTIONS": {"POST_TEXT": [[{"url": "https://fake/ID"}, 200, {"id": "ID"}]]}},
+        )
+
+    def test_cached_per_config_version(self):
+        steps = get_compiled_action(self.platform, "POST_TEXT")
+        self.assertIs(get_compiled_action(self.platform, "POST_TEXT"), steps)
+
+        self.platform.config = {"ACTIONS": {"POST_TEXT": [[{"url": "https://other/ID"}, 201, {}]]}}
+        self.platform.config_version = 2
+        steps = get_compiled_action(self.platform, "POST_TEXT")
+        self.assertEqual(steps[0].expected_response_code, 201)
+        self.assertEqual(steps[0].render({"ID": "5"}), {"url": "https://other/5"})
+
+    def test_unknown_action(self):
+        with self.assertRaises(ValueError):
+            get_compiled_action(self.platform, "POST_VIDEO")
+
+
+class RetryPolicyTests(SimpleTestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=5, backoff=1.0, max_backoff=10.0, retry_on=[429, 503])
+
+    def test_exponential_bound_capped_at_max_backoff(self):
+        with mock.patch("omnipost_api.retry.random.uniform", side_effect=lambda low, high: high) as uniform:
+            self.assertEqual([self.policy.delay(attempt) for attempt in (1, 2, 3, 4)], [1.0, 2.0, 4.0, 8.0])
+            self.assertEqual(RetryPolicy(9, 1.0, 10.0, []).delay(5), 10.0)
+        self.assertEqual(uniform.call_args.args, (0, 10.0))
+
+    def test_full_jitter(self):
+        for _ in range(100):
+            self.assertTrue(0 <= self.policy.delay(3) <= 4.0)
+
+    def test_gives_up_after_max_attempts(self):
+        self.assertIsNone(self.policy.delay(5))
+        self.assertIsNone(RetryPolicy(1, 1.0, 10.0, []).delay(1))
+
+    def test_retry_after(self):
+        with mock.patch("omnipost_api.retry.random.uniform", return_value=0.5):
+            self.assertEqual(self.policy.delay(1, retry_after=7.0), 7.0)
+            self.assertEqual(self.policy.delay(1, retry_after=0.1), 0.5)
+            self.assertEqual(self.policy.delay(1, retry_after=10.0), 10.0)
+        # Longer than max_backoff: left to the dead-letter replay
+        self.assertIsNone(self.policy.delay(1, retry_after=11.0))
+
+    def test_retries(self):
+        self.assertTrue(self.policy.retries(None))
+        self.assertTrue(self.policy.retries(503))
+        self.assertFalse(self.policy.retries(500))
+
+    def test_step_options_override_settings(self):
+        with self.settings(STEP_RETRY={"MAX_ATTEMPTS": 2, "BACKOFF": 0.5}):
+            policy = RetryPolicy.from_options({"retry": {"max_attempts": 4, "retry_on": ["429"]}})
+        self.assertEqual((policy.max_attempts, policy.backoff, policy.retry_on), (4, 0.5, frozenset({429})))
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        created_at = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+        self.assertEqual(
+            decode_cursor(encode_cursor(created_at, 42, "IMAGE")),
+            {"created_at": created_at, "id": 42, "post_type": "IMAGE"},
+        )
+        self.assertIsNone(decode_cursor(encode_cursor(created_at, 42))["post_type"])
+
+    def test_invalid_cursor(self):
+        for cursor in ("", "not base64!", "e30=", encode_cursor(timezone.now(), 1)[:-4]):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(cursor)
+
+    def test_page_size(self):
+        self.assertEqual(get_page_size(None), 50)
+        self.assertEqual(get_page_size("", default=10), 10)
+        self.assertEqual(get_page_size("20"), 20)
+        self.assertEqual(get_page_size(10000), MAX_PAGE_SIZE)
+        for value in ("x", "0", -1):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    get_page_size(value)
+
+    def test_merge_breaks_ties_by_post_type_rank(self):
+        created_at = timezone.now()
+        earlier = created_at - datetime.timedelta(seconds=1)
+        streams = [
+            _sort_keyed([{"id": 5, "created_at": created_at}, {"id": 4, "created_at": earlier}], "TEXT", 0),
+            _sort_keyed([{"id": 5, "created_at": created_at}, {"id": 3, "created_at": created_at}], "IMAGE", 1),
+        ]
+        posts, next_cursor = _merge_posts(streams, 3)
+        self.assertEqual(
+            [(post["post_type"], post["id"]) for post in posts],
+            [("TEXT", 5), ("IMAGE", 5), ("IMAGE", 3)],
+        )
+        self.assertEqual(decode_cursor(next_cursor), {"created_at": created_at, "id": 3, "post_type": "IMAGE"})
+
+    def test_merge_last_page_has_no_cursor(self):
+        posts, next_cursor = _merge_posts([_sort_keyed([{"id": 1, "created_at": timezone.now()}], "TEXT", 0)], 1)
+        self.assertEqual(len(posts), 1)
+        self.assertIsNone(next_cursor)
+
+
+class PaginatePostsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("pages")
+        cls.created_at = timezone.now()
+        for i in range(3):
+            PostText.objects.create(user=cls.user, text=f"text {i}")
+            PostImage.objects.create(user=cls.user, caption=f"image {i}")
+        # Every post at the same time, and the same ids in both tables, so only the tiebreaks order them
+        for model in (PostText, PostImage):
+            for new_id, post in enumerate(model.objects.order_by("id"), start=1000):
+                model.objects.filter(pk=post.pk).update(id=new_id, created_at=cls.created_at)
+
+    def pages(self, page_size):
+        posts, cursor = paginate_posts(POST_MODELS, self.user, False, page_size=page_size)
+        pages = [posts]
+        while cursor:
+            posts, cursor = paginate_posts(POST_MODELS, self.user, False, cursor=cursor, page_size=page_size)
+            pages.append(posts)
+        return pages
+
+    def test_every_post_once_in_order(self):
+        expected = [(post_type, id) for id in (1002, 1001, 1000) for post_type in ("TEXT", "IMAGE")]
+        for page_size in (1, 2, 4, 6):
+            with self.subTest(page_size=page_size):
+                pages = self.pages(page_size)
+                self.assertTrue(all(len(page) <= page_size for page in pages))
+                self.assertEqual([(post["post_type"], post["id"]) for page in pages for post in page], expected)
+
+    def test_created_range(self):
+        posts, _ = paginate_posts(POST_MODELS, self.user, False, created_after=self.created_at + datetime.timedelta(seconds=1))
+        self.assertEqual(posts, [])
+        posts, _ = paginate_posts(POST_MODELS, self.user, True)
+        self.assertEqual(posts, [])
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_rate(self):
+        self.assertEqual(_rate({"requests": 200, "per": 3600}), (200 / 3600, 200.0))
+        self.assertEqual(_rate({"requests": 5, "burst": 2}), (5.0, 2.0))
+        self.assertEqual(_rate({"requests": 1, "per": 60, "burst": 0}), (1 / 60, 1.0))
+        for limit in ({"requests": 0}, {"requests": 1, "per": 0}, {"requests": -1}):
+            with self.subTest(limit=limit):
+                with self.assertRaises(ValueError):
+                    _rate(limit)
+
+    def test_buckets(self):
+        platform = SimpleNamespace(id=3, config={"RATE_LIMITS": {
+            "PLATFORM": {"requests": 10},
+            "INSTANCE": {"requests": 60, "per": 60, "burst": 5},
+        }})
+        self.assertEqual(get_buckets(platform, 8), [
+            ("omnipost:ratelimit:platform:3", 10.0, 10.0),
+            ("omnipost:ratelimit:instance:8", 1.0, 5.0),
+        ])
+        platform.config = {"RATE_LIMITS": {"INSTANCE": {"requests": 1}}}
+        self.assertEqual(get_buckets(platform, 8), [("omnipost:ratelimit:instance:8", 1.0, 1.0)])
+        platform.config = None
+        self.assertEqual(get_buckets(platform, 8), [])
+
+
+class SendChunksTests(TestCase):
+    def test_reads_the_media_object_key_without_a_local_file(self):
+        user = User.objects.create_user("chunks")
+        media_object = MediaObject.objects.create(
+            digest="a" * 64, key=storage.content_key("a" * 64, ".mp4"), size=5, ref_count=1, uploaded=True,
+        )
+        # Offloaded from another host: the file is not in this one's local storage
+        post = PostVideo.objects.create(user=user, video="media/elsewhere.mp4", media_object=media_object)
+        step = CompiledStep({"payload": {}}, 204, {}, {"upload": {"chunk_size": 3}})
+
+        with mock.patch("omnipost_api.storage.object_size", return_value=5) as object_size, \
+                mock.patch("omnipost_api.storage.read_range", side_effect=[b"abc", b"de"]) as read_range, \
+                mock.patch("omnipost_api.models._send_with_retries") as send:
+            _send_chunks(post, None, None, step, ({},))
+
+        object_size.assert_called_once_with(media_object.key)
+        self.assertEqual(read_range.call_args_list, [mock.call(media_object.key, 0, 3), mock.call(media_object.key, 3, 2)])
+        self.assertEqual([call.kwargs["data"] for call in send.call_args_list], [b"abc", b"de"])
+
+
+PASSWORD = "Vq8#rT2!mZp9@Lw4"
+
+
+class PublishTestCase(TestCase):
+    """
+    A user with an instance of a one-step platform and a text post.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("publisher")
+        cls.platform = Platform.objects.create(name="Fake", config={
+            "INSTANCE": {"ACCESS_TOKEN": ""},
+            "ACTIONS": {"POST_TEXT": [[
+                {"base_url": "https://fake", "endpoint": "/posts", "method": "POST",
+                 "headers": {"Authorization": "Bearer ACCESS_TOKEN"}, "params": {}, "payload": {"text": "TEXT"}},
+                200,
+                {"id": "POST_ID", "terminal_request": True},
+            ]]},
+        })
+        cls.platform_instance = PlatformInstance(platform=cls.platform, user=cls.user, credentials={"ACCESS_TOKEN": "t"})
+        cls.platform_instance.save(password=PASSWORD)
+        cls.post = PostText.objects.create(user=cls.user, text="hello")
+
+    def setUp(self):
+        clear_compiled_actions()
+        self.addCleanup(clear_compiled_actions)
+        for target, value in (
+            ("omnipost_api.platform_registry.get_platform", self.platform),
+            ("omnipost_api.rate_limit.acquire", 0),
+            ("omnipost_api.events.publish", None),
+        ):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class RunActionStepsTests(PublishTestCase):
+    def run_steps(self, **responses):
+        with self.settings(STEP_RETRY={"MAX_ATTEMPTS": 3}), \
+                mock.patch("omnipost_api.http_pool.request", **responses) as request, \
+                mock.patch("omnipost_api.models.time.sleep") as sleep, \
+                mock.patch("omnipost_api.notification_sink.add") as notify:
+            with self.assertRaises(Exception) as raised:
+                run_action_steps(self.post, self.platform_instance, "POST_TEXT", PASSWORD)
+        return raised.exception, request, sleep, notify
+
+    def test_read_timeout_is_retried_then_dead_lettered(self):
+        error, request, sleep, notify = self.run_steps(side_effect=requests.ReadTimeout("read timed out"))
+
+        self.assertIsInstance(error, StepFailed)
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        dead_letter = DeadLetter.objects.get()
+        self.assertEqual((dead_letter.step, dead_letter.attempts, dead_letter.status_code), (0, 3, None))
+        notify.assert_called_once()
+        self.assertTrue(notify.call_args.kwargs["error"])
+        self.assertIn("read timed out", notify.call_args.kwargs["notification"])
+
+    def test_extraction_error_is_notified(self):
+        response = mock.Mock(status_code=200, headers={}, text="{}")
+        response.json.return_value = {}
+        error, request, _, notify = self.run_steps(return_value=response)
+
+        self.assertIsInstance(error, ExtractionError)
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(DeadLetter.objects.get().attempts, 1)
+        notify.assert_called_once()
+        self.assertTrue(notify.call_args.kwargs["error"])
+
+
+class RunActionChainsTests(PublishTestCase):
+    def test_no_platform_instances_left(self):
+        with mock.patch("omnipost_api.job_secrets.resolve_secret", return_value=PASSWORD), \
+                mock.patch("omnipost_api.models.run_action_steps") as run_steps, \
+                self.assertLogs("omnipost_api.models", "WARNING"):
+            self.assertTrue(run_action_chains("TEXT", self.post.pk, [self.platform_instance.pk + 1], "POST_TEXT", "secret"))
+        run_steps.assert_not_called()
+
+
+class PostVariablesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("variables")
+
+    def setUp(self):
+        self.post = PostText.objects.create(user=self.user, text="hello", post_configs={
+            "Fake": {"TEXT": "hello", "CONTAINER_ID": "1"},
+            "Other": {"TEXT": "hello"},
+        })
+
+    def post_configs(self):
+        return PostText.objects.values_list("post_configs", flat=True).get(pk=self.post.pk)
+
+    def test_merge_leaves_sibling_keys(self):
+        post_variables.merge(PostText, self.post.pk, "Fake", {"CONTAINER_ID": "2", "POST_ID": "3"})
+        self.assertEqual(self.post_configs(), {
+            "Fake": {"TEXT": "hello", "CONTAINER_ID": "2", "POST_ID": "3"},
+            "Other": {"TEXT": "hello"},
+        })
+        self.assertEqual(post_variables.read(PostText, self.post.pk, "Other"), {"TEXT": "hello"})
+        self.assertFalse(PostText.objects.get(pk=self.post.pk).published)
+
+    def test_merge_creates_missing_slices(self):
+        post_variables.merge(PostText, self.post.pk, "New", {"POST_ID": "4"}, published=True)
+        self.assertEqual(self.post_configs()["New"], {"POST_ID": "4"})
+        self.assertEqual(self.post_configs()["Fake"], {"TEXT": "hello", "CONTAINER_ID": "1"})
+        self.assertTrue(PostText.objects.get(pk=self.post.pk).published)
+
+        PostText.objects.filter(pk=self.post.pk).update(post_configs=None)
+        post_variables.merge(PostText, self.post.pk, "Fake", {"POST_ID": "5"})
+        self.assertEqual(self.post_configs(), {"Fake": {"POST_ID": "5"}})
+        self.assertEqual(post_variables.read(PostText, self.post.pk, "Missing"), {})
+
+
+class DispatcherTests(PublishTestCase):
+    def setUp(self):
+        super().setUp()
+        self.due_at = timezone.now() + datetime.timedelta(hours=1)
+        self.scheduled = PostText.objects.create(user=self.user, text="later", schedule=self.due_at)
+        self.queue = mock.MagicMock()
+        patcher = mock.patch("omnipost_api.dispatcher.get_queue", return_value=self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_scheduled_post_is_claimed_once(self):
+        intent, = self.scheduled.publish("POST_TEXT", [self.platform_instance], PASSWORD)
+        self.assertIsInstance(intent, PublishIntent)
+        self.assertEqual(dispatcher.dispatch_due(now=self.due_at - datetime.timedelta(seconds=1)), 0)
+
+        self.assertEqual(dispatcher.dispatch_due(now=self.due_at), 1)
+        self.assertEqual(dispatcher.dispatch_due(now=self.due_at), 0)
+        job, = self.queue.enqueue_many.call_args.args[0]
+        self.assertEqual(job.kwargs["post_id"], self.scheduled.pk)
+        self.assertEqual(job.kwargs["platform_instance_ids"], [self.platform_instance.pk])
+        intent.refresh_from_db()
+        self.assertIsNotNone(intent.dispatched_at)
+        self.assertEqual(intent.secret, "")
+
+    def test_reschedule(self):
+        intent, = self.scheduled.publish("POST_TEXT", [self.platform_instance], PASSWORD)
+        later = self.due_at + datetime.timedelta(days=1)
+        self.assertEqual(self.scheduled.reschedule(later), 1)
+        self.assertEqual(dispatcher.dispatch_due(now=self.due_at), 0)
+        self.assertEqual(dispatcher.dispatch_due(now=later), 1)
+        # Dispatched intents are no longer moved
+        self.assertEqual(self.scheduled.reschedule(self.due_at), 0)
+        intent.refresh_from_db()
+        self.assertEqual(intent.due_at, later)
+
+    def test_cancel_schedule(self):
+        intent, = self.scheduled.publish("POST_TEXT", [self.platform_instance], PASSWORD)
+        self.assertEqual(self.scheduled.cancel_schedule(), 1)
+        self.assertEqual(dispatcher.dispatch_due(now=self.due_at), 0)
+        self.queue.enqueue_many.assert_not_called()
+        intent.refresh_from_db()
+        self.assertIsNotNone(intent.cancelled_at)
+        self.assertEqual(intent.secret, "")
+        self.assertIsNone(PostText.objects.get(pk=self.scheduled.pk).schedule)
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+class DispatcherSkipLockedTests(TransactionTestCase):
+    def test_skips_intents_another_dispatcher_holds(self):
+        user = User.objects.create_user("locked")
+        post = PostText.objects.create(user=user, text="due")
+        intent = PublishIntent.objects.create(
+            user=user, content_type=ContentType.objects.get_for_model(post), object_id=post.pk, post_type="TEXT",
+            action="POST_TEXT", platform_instance_ids=[], secret="s", due_at=timezone.now(),
+        )
+        locked, release = threading.Event(), threading.Event()
+
+        def other_dispatcher():
+            try:
+                with transaction.atomic():
+                    list(PublishIntent.objects.select_for_update().filter(pk=intent.pk))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_dispatcher)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            with mock.patch("omnipost_api.dispatcher.get_queue") as get_queue:
+                self.assertEqual(dispatcher.dispatch_due(), 0)
+            get_queue.assert_not_called()
+        finally:
+            release.set()
+            thread.join()
+        self.assertIsNone(PublishIntent.objects.get(pk=intent.pk).dispatched_at)
+
+
+class MediaObjectTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("media")
+        cls.digest = "b" * 64
+
+    def setUp(self):
+        for target in ("omnipost_api.storage.delete_object", "omnipost_api.storage.delete_prefix"):
+            patcher = mock.patch(target)
+            setattr(self, target.rsplit(".", 1)[1], patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def shared_posts(self):
+        posts = []
+        for _ in range(2):
+            media_object = MediaObject.acquire(self.digest, ".png", 10)
+            posts.append(PostImage.objects.create(user=self.user, media_object=media_object))
+        MediaObject.objects.filter(pk=media_object.pk).update(uploaded=True)
+        return posts
+
+    def test_same_digest_shares_one_object(self):
+        first, second = self.shared_posts()
+        self.assertEqual(first.media_object_id, second.media_object_id)
+        media_object = MediaObject.objects.get()
+        self.assertEqual((media_object.key, media_object.ref_count), (storage.content_key(self.digest, ".png"), 2))
+
+    def test_deleted_with_the_last_post(self):
+        first, second = self.shared_posts()
+        key = first.media_object.key
+
+        first.delete()
+        self.assertEqual(MediaObject.objects.get().ref_count, 1)
+        self.delete_object.assert_not_called()
+
+        second.delete()
+        self.assertFalse(MediaObject.objects.exists())
+        self.delete_object.assert_called_once_with(key)
+        self.delete_prefix.assert_called_once()
+
+    def test_failed_offload_releases_its_reference(self):
+        other = PostImage.objects.create(user=self.user, media_object=MediaObject.acquire(self.digest, ".png", 10))
+        post = PostImage.objects.create(user=self.user, image="media/failing.png")
+        with mock.patch("omnipost_api.media_probe.probe", return_value={"digest": self.digest, "size": 10}), \
+                mock.patch.object(PostImage, "save_to_aws_s3", side_effect=OSError("bucket unreachable")), \
+                mock.patch("omnipost_api.events.publish"), \
+                mock.patch("omnipost_api.notification_sink.add") as notify:
+            with self.assertRaises(OSError):
+                offload_media("IMAGE", post.pk)
+
+        self.assertEqual(MediaObject.objects.get(pk=other.media_object_id).ref_count, 1)
+        post.refresh_from_db()
+        self.assertEqual((post.media_status, post.media_object_id), (MEDIA_FAILED, None))
+        notify.assert_called_once()
+        self.delete_object.assert_not_called()
+
+
+def mp4_box(kind: bytes, *payload: bytes) -> bytes:
+    data = b"".join(payload)
+    return struct.pack(">I4s", len(data) + 8, kind) + data
+
+
+def mp4_track(handler: bytes, codec: bytes, width: int = 0, height: int = 0) -> bytes:
+    return mp4_box(
+        b"trak",
+        mp4_box(b"tkhd", bytes(76), struct.pack(">II", width << 16, height << 16)),
+        mp4_box(
+            b"mdia",
+            mp4_box(b"hdlr", bytes(8), handler, bytes(12)),
+            mp4_box(b"minf", mp4_box(b"stbl", mp4_box(b"stsd", struct.pack(">II", 0, 1), struct.pack(">I4s", 16, codec), bytes(8)))),
+        ),
+    )
+
+
+def mp4_file(brand: bytes = b"isom", timescale: int = 1000, duration: int = 12500) -> bytes:
+    return b"".join([
+        mp4_box(b"ftyp", brand, bytes(4)),
+        # Media data before the moov box, as in files that were not made for streaming
+        mp4_box(b"mdat", bytes(64)),
+        mp4_box(
+            b"moov",
+            mp4_box(b"mvhd", bytes(12), struct.pack(">II", timescale, duration), bytes(80)),
+            mp4_track(b"soun", b"mp4a"),
+            mp4_track(b"vide", b"avc1", 1080, 1920),
+        ),
+    ])
+
+
+class MediaProbeTests(SimpleTestCase):
+    def probe(self, data: bytes) -> dict:
+        return media_probe.probe_video(io.BytesIO(data), len(data), "video/mp4")
+
+    def test_mp4(self):
+        self.assertEqual(self.probe(mp4_file()), {
+            "container": "mp4", "duration": 12.5, "width": 1080, "height": 1920,
+            "video_codec": "avc1", "audio_codec": "mp4a",
+        })
+
+    def test_mov(self):
+        info = self.probe(mp4_file(brand=b"qt  ", timescale=600, duration=900))
+        self.assertEqual((info["container"], info["duration"]), ("mov", 1.5))
+
+    def test_truncated(self):
+        data = mp4_file()
+        moov = data.index(b"moov") - 4
+        for length in (moov + 30, len(data) - 20):
+            with self.subTest(length=length):
+                with self.assertRaises(media_probe.ProbeError):
+                    self.probe(data[:length])
+
+    def test_corrupt_box_size(self):
+        data = mp4_file().replace(struct.pack(">I4s", 72, b"mdat"), struct.pack(">I4s", 4, b"mdat"))
+        with self.assertRaises(media_probe.ProbeError):
+            self.probe(data)
+
+
+class NotificationSinkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("notified")
+
+    def setUp(self):
+        notification_sink._buffer.clear()
+        self.addCleanup(notification_sink._buffer.clear)
+        for target in ("omnipost_api.notification_sink._ensure_flusher", "omnipost_api.events.publish_many"):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add(self, *notifications):
+        for notification in notifications:
+            notification_sink.add(user=self.user, notification=notification)
+
+    def test_batch_kept_while_the_database_is_unreachable(self):
+        self.add("first", "second")
+        with mock.patch.object(Notification.objects, "bulk_create", side_effect=OperationalError("gone")), \
+                mock.patch.object(Notification, "save", side_effect=OperationalError("gone")), \
+                self.assertLogs("omnipost_api.notification_sink", "WARNING"):
+            self.assertEqual(notification_sink.flush(), 0)
+        self.assertEqual([notification.notification for notification in notification_sink._buffer], ["first", "second"])
+
+        self.assertEqual(notification_sink.flush(), 2)
+        self.assertEqual(sorted(Notification.objects.values_list("notification", flat=True)), ["first", "second"])
+
+    def test_rows_saved_one_by_one_when_the_batch_fails(self):
+        self.add("first", "second")
+        with mock.patch.object(Notification.objects, "bulk_create", side_effect=IntegrityError("bad row")), \
+                self.assertLogs("omnipost_api.notification_sink", "WARNING"):
+            self.assertEqual(notification_sink.flush(), 2)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(notification_sink._buffer, [])
+
+    def test_nested_flushing_writes_once(self):
+        @notification_sink.flushing
+        def inner():
+            self.add("inner")
+
+        @notification_sink.flushing
+        def outer():
+            self.add("outer")
+            inner()
+            self.add("after")
+
+        with mock.patch.object(Notification.objects, "bulk_create", wraps=Notification.objects.bulk_create) as bulk_create:
+            outer()
+        bulk_create.assert_called_once()
+        self.assertEqual(Notification.objects.count(), 3)
+
+
+class BulkPublishApiTests(PublishTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.queue = mock.MagicMock()
+        self.queue.enqueue_many.side_effect = lambda jobs, pipeline: list(jobs)
+        patcher = mock.patch("omnipost_api.models.get_queue", return_value=self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish(self, entries, password=PASSWORD):
+        return self.client.post(reverse("omnipost_api:publish_bulk"), {"entries": entries, "password": password}, format="json")
+
+    def test_mixed_batch(self):
+        stranger = User.objects.create_user("stranger")
+        strangers_post = PostText.objects.create(user=stranger, text="not yours")
+        instance_id = self.platform_instance.pk
+        response = self.publish([
+            {"post_type": "TEXT", "post_id": self.post.pk, "platform_instance_ids": [instance_id]},
+            {"post_type": ["TEXT"], "post_id": self.post.pk, "platform_instance_ids": [instance_id]},
+            {"post_type": "POLL", "post_id": self.post.pk, "platform_instance_ids": [instance_id]},
+            {"post_type": "TEXT", "platform_instance_ids": [instance_id]},
+            {"post_type": "TEXT", "post_id": self.post.pk, "platform_instance_ids": []},
+            {"post_type": "TEXT", "post_id": strangers_post.pk, "platform_instance_ids": [instance_id]},
+            {"post_type": "TEXT", "post_id": self.post.pk, "platform_instance_ids": [instance_id + 1]},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["queued"], body["failed"]), (1, 6))
+        self.assertEqual(body["results"][0], {
+            "index": 0, "post_type": "TEXT", "post_id": self.post.pk, "status": "queued", "jobs": 1,
+        })
+        self.assertEqual(
+            [(result["index"], result["status"], result["error"]) for result in body["results"][1:]],
+            [
+                (1, "error", "Invalid post type"),
+                (2, "error", "Invalid post type"),
+                (3, "error", "Each entry needs a post_type, a post_id and platform_instance_ids"),
+                (4, "error", "No platform instances given"),
+                (5, "error", "Post does not exist"),
+                (6, "error", "Platform instance does not exist"),
+            ],
+        )
+        job, = self.queue.enqueue_many.call_args.args[0]
+        self.assertEqual(job.kwargs["platform_instance_ids"], [instance_id])
+
+    def test_invalid_request(self):
+        entry = {"post_type": "TEXT", "post_id": self.post.pk, "platform_instance_ids": [self.platform_instance.pk]}
+        with self.settings(PUBLISH_FANOUT={"BULK_MAX_ENTRIES": 2}):
+            response = self.publish([entry] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "At most 2 entries can be published at once"})
+
+        self.assertEqual(self.publish([]).status_code, 400)
+        self.assertEqual(self.publish([entry], password=None).status_code, 400)
+        self.queue.enqueue_many.assert_not_called()
@@ -0,0 +1,31 @@
+"""
+Upload handlers for media sent to the API.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes the SHA-256 of every uploaded file while its chunks stream in.
+
+    It only observes the data and passes every chunk on to the next handler, which
+    stores the file as usual. The digests end up in `request.upload_digests`, by form
+    field name, so the media does not have to be read again to be deduplicated
+    (see `MediaObject`). Listed first in `settings.FILE_UPLOAD_HANDLERS`.
+    """
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, "upload_digests"):
+            self.request.upload_digests = {}
+        self.request.upload_digests[self.field_name] = self.digest.hexdigest()
+        # The next handler returns the file
+        return None
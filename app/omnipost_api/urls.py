@@ -11,10 +11,21 @@ app_name = 'omnipost_api'
 urlpatterns = [
     path('', include(router.urls)),
     path('publish/', omnipost_views.PublishApiView.as_view(), name='publish'),
-    path('platform_instance/', omnipost_views.CreatePlatformInstanceView.as_view(), name='platform_instance'),
-    path('post/', omnipost_views.CreatePostView.as_view(), name='post'),
+    path('publish/bulk/', omnipost_views.BulkPublishApiView.as_view(), name='publish_bulk'),
+    # GET is served by async views, see omnipost_views.AsyncReadView
+    path('platform_instance/', omnipost_views.read_write_view(
+        omnipost_views.PlatformInstancesListView.as_view(), omnipost_views.CreatePlatformInstanceView.as_view()
+    ), name='platform_instance'),
+    path('post/', omnipost_views.read_write_view(
+        omnipost_views.PostsListView.as_view(), omnipost_views.CreatePostView.as_view()
+    ), name='post'),
+    path('post/status/', omnipost_views.PostStatusView.as_view(), name='post_status'),
+    path('post/schedule/', omnipost_views.PostScheduleView.as_view(), name='post_schedule'),
     path('drafts/', omnipost_views.DraftsListView.as_view(), name='drafts'),
     path('notifications', omnipost_views.ListNotificationsView.as_view(), name='notifications'),
+    path('events/', omnipost_views.EventStreamView.as_view(), name='events'),
+    path('dead_letters/', omnipost_views.DeadLettersView.as_view(), name='dead_letters'),
+    path('dead_letters/replay/', omnipost_views.ReplayDeadLettersView.as_view(), name='replay_dead_letters'),
 
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('auth/', include('dj_rest_auth.urls')),
@@ -1,8 +1,23 @@
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, connections
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
 import datetime
 from rest_framework import viewsets
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder as DRFJSONEncoder
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 from .models import (
     User,
@@ -14,8 +29,16 @@ from .models import (
     ShortFormVideo,
     StoryImage,
     StoryVideo,
-    Notification
+    Notification,
+    DeadLetter,
+    MediaNotReady,
+    POST_MODELS,
+    get_fanout_config,
+    publish_many,
+    replay_dead_letters,
 )
+from .pagination import apaginate_posts, apaginate_queryset, get_page_size, paginate_queryset
+from . import events, media_probe, platform_registry
 
 # Remove commented code along with the serializers
 
@@ -32,6 +55,79 @@ from .serializers import (
 )
 
 
+def parse_datetime_param(value):
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def set_next_page_headers(response, request, next_cursor):
+    if next_cursor:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        response['X-Next-Cursor'] = next_cursor
+        response['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def paginated_response(request, results, next_cursor):
+    """
+    Return a page as a plain list, with the cursor of the next page in the
+    `X-Next-Cursor` header and a `Link: <...>; rel="next"` header.
+    """
+    return set_next_page_headers(Response(results, status=200), request, next_cursor)
+
+
+def json_response(data, status=200):
+    # Rendered like DRF's JSONRenderer renders it
+    return JsonResponse(data, status=status, safe=False, encoder=DRFJSONEncoder)
+
+
+def paginated_json_response(request, results, next_cursor):
+    """
+    `paginated_response` for the async views.
+    """
+    return set_next_page_headers(json_response(results), request, next_cursor)
+
+
+def timeline_params(query_params) -> tuple:
+    """
+    The post models and the `paginate_posts` arguments of a timeline request.
+    
+    Query params: `cursor`, `page_size`, `post_type` (comma separated),
+    `created_after` and `created_before` (ISO 8601).
+    
+    Raises:
+        ValueError: If a param is invalid
+    """
+    post_types = query_params.get('post_type')
+    if post_types:
+        post_types = post_types.split(',')
+        if any(post_type not in POST_MODELS for post_type in post_types):
+            raise ValueError("Invalid post type")
+        post_models = {post_type: model for post_type, model in POST_MODELS.items() if post_type in post_types}
+    else:
+        post_models = POST_MODELS
+    return post_models, {
+        "cursor": query_params.get('cursor'),
+        "page_size": get_page_size(query_params.get('page_size')),
+        "created_after": parse_datetime_param(query_params.get('created_after')),
+        "created_before": parse_datetime_param(query_params.get('created_before')),
+    }
+
+
+async def post_timeline_response(request, published):
+    """
+    A page of the user's posts across all post types, newest first, see `timeline_params`.
+    """
+    try:
+        post_models, params = timeline_params(request.GET)
+        posts, next_cursor = await apaginate_posts(post_models, user=request.user, published=published, **params)
+    except ValueError as e:
+        return json_response({"error": f"{e}"}, status=400)
+    
+    return paginated_json_response(request, posts, next_cursor)
+
+
 class PublishApiView(APIView):
     """
     API endpoint that allows actions to be run.
@@ -41,30 +137,24 @@ class PublishApiView(APIView):
         post_type = request.data.get('post_type')
         post_id = request.data.get('post_id')
         password = request.data.get('password')
-        delay = 5
         match post_type:
             case 'TEXT':
                 post = PostText.objects.get(id=post_id)
                 action = "POST_TEXT"
             case 'IMAGE':
                 post = PostImage.objects.get(id=post_id)
-                delay = 10
                 action = "POST_IMAGE"
             case 'VIDEO':
                 post = PostVideo.objects.get(id=post_id)
-                delay = 30
                 action = "POST_VIDEO"
             case 'SHORT_FORM_VIDEO':
                 post = ShortFormVideo.objects.get(id=post_id)
-                delay = 30
                 action = "POST_SHORT_FORM_VIDEO"
             case 'STORY_IMAGE':
                 post = StoryImage.objects.get(id=post_id)
-                delay = 10
                 action = "POST_STORY_IMAGE"
             case 'STORY_VIDEO':
                 post = StoryVideo.objects.get(id=post_id)
-                delay = 30
                 action = "POST_STORY_VIDEO"
             case _:
                 return Response({"error": "Invalid post type"}, status=400)
@@ -72,20 +162,110 @@ class PublishApiView(APIView):
         if post.user != request.user:
             return Response({"error": "You do not have permission to perform this action"}, status=403)
         
-        for platform_instance_id in platform_instance_ids:
-            platform_instance = PlatformInstance.objects.get(id=platform_instance_id)
-            post.run_action(action=action,platform_instance=platform_instance, password=password, delay=delay)
+        platform_instance_ids = set(platform_instance_ids or [])
+        platform_instances = list(
+            PlatformInstance.objects.select_related('platform').filter(id__in=platform_instance_ids, user=request.user)
+        )
+        if len(platform_instances) != len(platform_instance_ids):
+            return Response({"error": "Platform instance does not exist"}, status=400)
+        
+        try:
+            post.publish(action=action, platform_instances=platform_instances, password=password)
+        except MediaNotReady as e:
+            return Response({"error": f"{e}", "media_status": post.media_status}, status=409)
+        except ValueError as e:
+            return Response({"error": f"{e}"}, status=400)
         return Response({"status": "Action executed"}, status=200)
     
+class BulkPublishApiView(APIView):
+    """
+    API endpoint that publishes many posts to many platform instances in one request.
+    
+    Body: `password` and `entries`, a list of `{"post_type", "post_id", "platform_instance_ids"}`.
+    Ownership of all the posts and instances is checked with one query per post type and
+    one for the instances, and the jobs of every valid entry are enqueued in one Redis
+    pipeline. The response has a result for every entry, in order; invalid entries are
+    reported there and do not stop the others.
+    """
+    def post(self, request):
+        entries = request.data.get('entries')
+        password = request.data.get('password')
+        if not isinstance(entries, list) or not entries:
+            return Response({"error": "entries must be a non-empty list"}, status=400)
+        max_entries = get_fanout_config()["BULK_MAX_ENTRIES"]
+        if len(entries) > max_entries:
+            return Response({"error": f"At most {max_entries} entries can be published at once"}, status=400)
+        if password is None:
+            return Response({"error": "Password is required to decrypt credentials."}, status=400)
+        
+        results = []
+        requested = []
+        post_ids = {}
+        instance_ids = set()
+        for index, entry in enumerate(entries):
+            result = {"index": index}
+            results.append(result)
+            try:
+                post_type = entry['post_type']
+                post_id = int(entry['post_id'])
+                ids = {int(platform_instance_id) for platform_instance_id in entry.get('platform_instance_ids') or []}
+            except (KeyError, TypeError, ValueError):
+                result.update(status="error", error="Each entry needs a post_type, a post_id and platform_instance_ids")
+                continue
+            result.update(post_type=post_type, post_id=post_id)
+            # A list or an object from the JSON body can not be looked up in POST_MODELS
+            if not isinstance(post_type, str) or post_type not in POST_MODELS:
+                result.update(status="error", error="Invalid post type")
+                continue
+            if not ids:
+                result.update(status="error", error="No platform instances given")
+                continue
+            requested.append((result, post_type, post_id, ids))
+            post_ids.setdefault(post_type, set()).add(post_id)
+            instance_ids |= ids
+        
+        # Only rows owned by the user are found, anything else is reported as missing
+        posts = {
+            (post_type, post.id): post
+            for post_type, ids in post_ids.items()
+            for post in POST_MODELS[post_type].objects.filter(user=request.user, id__in=ids)
+        }
+        platform_instances = PlatformInstance.objects.select_related('platform').filter(id__in=instance_ids, user=request.user)
+        platform_instances = {platform_instance.id: platform_instance for platform_instance in platform_instances}
+        
+        publishable = []
+        for result, post_type, post_id, ids in requested:
+            post = posts.get((post_type, post_id))
+            if post is None:
+                result.update(status="error", error="Post does not exist")
+                continue
+            if not ids <= platform_instances.keys():
+                result.update(status="error", error="Platform instance does not exist")
+                continue
+            action = f"POST_{post_type}"
+            instances = [platform_instances[platform_instance_id] for platform_instance_id in sorted(ids)]
+            try:
+                post.check_publishable(action, instances, password)
+            except MediaNotReady as e:
+                result.update(status="error", error=f"{e}", media_status=post.media_status)
+                continue
+            except ValueError as e:
+                result.update(status="error", error=f"{e}")
+                continue
+            publishable.append((result, (post, action, instances)))
+        
+        if publishable:
+            jobs = publish_many([entry for _, entry in publishable], password)
+            for (result, _), entry_jobs in zip(publishable, jobs):
+                result.update(status="queued", jobs=len(entry_jobs))
+        
+        return Response({"queued": len(publishable), "failed": len(results) - len(publishable), "results": results}, status=200)
+
+
 class CreatePlatformInstanceView(APIView):
     """
     API endpoint that allows platform instances to be created.
     """
-    def get(self, request):
-        # Return a list of platforms whose instances can be created along with their required configuration
-        platforms = PlatformInstance.objects.filter(user=request.user)
-        return Response ([{"id":platform.id,"platform":platform.platform.name, "instance_name":platform.instance_name,} for platform in platforms], status=200)
-    
     def post(self, request):
         # Create a new platform instance
         print(request.data.keys())
@@ -164,134 +344,319 @@ class CreatePostView(APIView):
             case _:
                 return Response({"error": "Invalid post type"}, status=400)
         
+        # Computed by HashingUploadHandler while the file streamed in; the offload job
+        # uses it to reuse the bucket copy of media that was uploaded before
+        digest = getattr(request, 'upload_digests', {}).get('media')
+        if media and digest:
+            post.media_info = {"digest": digest}
         post.save()
         
-        return Response({"status": "Post created", "post_id": post.id}, status=201)
-    
+        # Media is uploaded to the cloud in the background, poll /post/status/ until it is READY
+        return Response({"status": "Post created", "post_id": post.id, "media_status": post.media_status}, status=201)
+
+
+class PostStatusView(APIView):
+    """
+    API endpoint to poll the media upload and publish state of a post.
     
+    Once the media is READY, `media_info` holds what was probed from the file and
+    `incompatible_platforms` the platforms that would reject it.
+    """
     def get(self, request):
-    # API endpoint to list all posts that has been published by the user
-    
-        # Return a list of all published posts from all post types for this user
-        user = User.objects.get(id=request.user.id)
-        
-        # Query each model type
-        text_posts = PostText.objects.filter(user=user, published=True).values()
-        image_posts = PostImage.objects.filter(user=user, published=True).values()
-        video_posts = PostVideo.objects.filter(user=user, published=True).values()
-        short_form_videos = ShortFormVideo.objects.filter(user=user, published=True).values()
-        story_images = StoryImage.objects.filter(user=user, published=True).values()
-        story_videos = StoryVideo.objects.filter(user=user, published=True).values()
-        
-        # Add a 'post_type' field to each result
-        for post in text_posts:
-            post['post_type'] = 'TEXT'
-        for post in image_posts:
-            post['post_type'] = 'IMAGE'
-        for post in video_posts:
-            post['post_type'] = 'VIDEO'
-        for post in short_form_videos:
-            post['post_type'] = 'SHORT_FORM_VIDEO'
-        for post in story_images:
-            post['post_type'] = 'STORY_IMAGE'
-        for post in story_videos:
-            post['post_type'] = 'STORY_VIDEO'
-        
-        # Combine all results
-        all_posts = list(text_posts) + list(image_posts) + list(video_posts) + \
-                    list(short_form_videos) + list(story_images) + list(story_videos)
-        
-        # Sort by creation date (newest first)
-        all_posts.sort(key=lambda x: x['created_at'], reverse=True)
+        post_type = request.query_params.get('post_type')
+        post_id = request.query_params.get('post_id')
+        if post_type not in POST_MODELS:
+            return Response({"error": "Invalid post type"}, status=400)
         
-        return Response(all_posts, status=200)
+        model = POST_MODELS[post_type]
+        fields = ['id', 'media_status', 'media_info', 'published']
+        if model.media_url_field:
+            fields.append(model.media_url_field)
+        try:
+            status = model.objects.filter(user=request.user).values(*fields).get(id=post_id)
+        except (model.DoesNotExist, ValueError):
+            return Response({"error": "Post does not exist"}, status=404)
+        status['post_type'] = post_type
+        # Platforms whose MEDIA_LIMITS the media does not meet, with the reasons
+        status['incompatible_platforms'] = media_probe.incompatible_platforms(
+            status['media_info'], platform_registry.get_platforms().values()
+        )
+        return Response(status, status=200)
+
+
+
+class PostScheduleView(APIView):
+    """
+    API endpoint to move or cancel the scheduled publishes of a post.
+    
+    POST takes the `post_type`, `post_id` and new `schedule` of the post; DELETE takes the
+    `post_type` and `post_id` and cancels the publishes that have not been dispatched yet.
+    Both only update the post's `PublishIntent`s, see `omnipost_api.dispatcher`.
+    """
+    def get_post(self, request):
+        post_type = request.data.get('post_type')
+        if not isinstance(post_type, str) or post_type not in POST_MODELS:
+            return None, Response({"error": "Invalid post type"}, status=400)
+        try:
+            return POST_MODELS[post_type].objects.get(user=request.user, id=request.data.get('post_id')), None
+        except (POST_MODELS[post_type].DoesNotExist, ValueError, TypeError):
+            return None, Response({"error": "Post does not exist"}, status=404)
+    
+    def post(self, request):
+        post, error = self.get_post(request)
+        if error is not None:
+            return error
+        try:
+            schedule = parse_datetime_param(request.data.get('schedule'))
+        except (ValueError, AttributeError):
+            return Response({"error": "Invalid schedule"}, status=400)
+        if schedule is None:
+            return Response({"error": "Schedule is required"}, status=400)
+        if timezone.is_naive(schedule):
+            schedule = timezone.make_aware(schedule)
+        if schedule < datetime.datetime.now(datetime.timezone.utc):
+            return Response({"error": "Schedule time cannot be in the past"}, status=400)
+        rescheduled = post.reschedule(schedule)
+        return Response({"status": "Post rescheduled", "schedule": schedule, "rescheduled": rescheduled}, status=200)
+    
+    def delete(self, request):
+        post, error = self.get_post(request)
+        if error is not None:
+            return error
+        cancelled = post.cancel_schedule()
+        return Response({"status": "Schedule cancelled", "cancelled": cancelled}, status=200)
+
+# Per event loop, as a semaphore belongs to the loop it was first used on
+_database_slots = weakref.WeakKeyDictionary()
+
+
+def database_slots() -> asyncio.Semaphore:
+    """
+    Bounds the async read views of this process that use the database at the same time.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _database_slots.get(loop)
+    if slots is None:
+        max_concurrency = getattr(settings, 'ASYNC_READS', {}).get('MAX_DB_CONCURRENCY', 20)
+        slots = _database_slots[loop] = asyncio.Semaphore(max_concurrency)
+    return slots
+
+
+class AsyncReadView(View):
+    """
+    Base of the read-heavy endpoints, which are async views on Django's async ORM.
     
+    Under ASGI a request waiting on the database only suspends its coroutine instead of
+    holding a worker. Requests are authenticated with the API's authentication classes
+    and answered with JSON rendered like DRF's.
+    
+    Django runs the queries of every request on a thread of its own with a connection of
+    its own, so at most `ASYNC_READS["MAX_DB_CONCURRENCY"]` requests of a process query
+    at a time and close their connection before the next one starts; the others wait on
+    the event loop. A burst of clients then queues up instead of exhausting the
+    database's connections.
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        async with database_slots():
+            try:
+                user = await sync_to_async(authenticate_request)(request)
+                if user is None:
+                    return json_response({"error": "Authentication credentials were not provided."}, status=401)
+                request.user = user
+                return await super().dispatch(request, *args, **kwargs)
+            finally:
+                await sync_to_async(close_old_connections)()
+
+
+def read_write_view(read_view, write_view):
+    """
+    Serve one URL with an async read view for GET and HEAD and a DRF view for the other methods.
+    """
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await read_view(request, *args, **kwargs)
+        # As Django runs a sync view under ASGI
+        return await sync_to_async(write_view)(request, *args, **kwargs)
+    # DRF views are exempt and do their own CSRF checks
+    return csrf_exempt(view)
+
+
+class PostsListView(AsyncReadView):
+    """
+    API endpoint that allows published posts to be listed, see `timeline_params`.
+    """
+    async def get(self, request):
+        return await post_timeline_response(request, published=True)
+
 
-class DraftsListView(APIView):
+class PlatformInstancesListView(AsyncReadView):
+    """
+    API endpoint that allows the user's platform instances to be listed.
+    """
+    async def get(self, request):
+        platform_instances = PlatformInstance.objects.filter(user=request.user).order_by('id')
+        return json_response([
+            {"id": platform_instance["id"], "platform": platform_instance["platform__name"], "instance_name": platform_instance["instance_name"]}
+            async for platform_instance in platform_instances.values('id', 'platform__name', 'instance_name')
+        ])
+
+
+class DraftsListView(AsyncReadView):
     """
     API endpoint that allows drafts to be listed.
     """
-    def get(self, request):
+    async def get(self, request):
         # Return a list of all drafts from all post types for this user
-        user = request.user
+        return await post_timeline_response(request, published=False)
+
+
+def notifications_queryset(user, query_params):
+    """
+    The user's notifications filtered by the query params of `ListNotificationsView`.
+    
+    Raises:
+        ValueError: If a param is invalid
+    """
+    post_id = query_params.get('post_id')
+    post_type_str = query_params.get('post_type')
+    
+    notifications = Notification.objects.filter(user=user)
+    
+    if post_id or post_type_str:
+        if not post_id:
+            raise ValueError("Post ID is required")
+        if not post_type_str:
+            raise ValueError("Post type is required")
+        if post_type_str not in POST_MODELS:
+            raise ValueError("Invalid post type")
+        try:
+            post_id = int(post_id)
+        except ValueError:
+            raise ValueError("Invalid post ID")
+        # get_for_model is served from ContentType's in-process cache after the first call
+        content_type_obj = ContentType.objects.get_for_model(POST_MODELS[post_type_str])
+        notifications = notifications.filter(content_type=content_type_obj, object_id=post_id)
+    
+    if query_params.get('errors_only', '').lower() in ('1', 'true', 'yes'):
+        notifications = notifications.filter(error=True)
+    
+    since = parse_datetime_param(query_params.get('since'))
+    if since is not None:
+        notifications = notifications.filter(created_at__gt=since)
+    return notifications
+
+
+class ListNotificationsView(AsyncReadView):
+    """
+    API endpoint that allows notifications to be listed.
+    
+    Without `post_id` and `post_type` this is the feed of all the user's notifications.
+    Query params: `post_id` and `post_type`, `since` (ISO 8601, only newer notifications),
+    `errors_only`, `cursor` and `page_size`.
+    """
+    async def get(self, request):
+        # Return a page of notifications for this user, newest first
+        try:
+            notifications = await sync_to_async(notifications_queryset)(request.user, request.GET)
+            results, next_cursor = await apaginate_queryset(
+                notifications,
+                cursor=request.GET.get('cursor'),
+                page_size=get_page_size(request.GET.get('page_size')),
+            )
+        except ValueError as e:
+            return json_response({"error": f"{e}"}, status=400)
         
-        # Query each model type
-        text_posts = PostText.objects.filter(user=user, published=False).values()
-        image_posts = PostImage.objects.filter(user=user, published=False).values()
-        video_posts = PostVideo.objects.filter(user=user, published=False).values()
-        short_form_videos = ShortFormVideo.objects.filter(user=user, published=False).values()
-        story_images = StoryImage.objects.filter(user=user, published=False).values()
-        story_videos = StoryVideo.objects.filter(user=user, published=False).values()
+        return paginated_json_response(request, results, next_cursor)
+
+
+class DeadLettersView(APIView):
+    """
+    API endpoint that lists the user's action steps that failed for good, newest first.
+    
+    Query params: `replayed` (`true` or `false`), `cursor` and `page_size`.
+    """
+    def get(self, request):
+        dead_letters = DeadLetter.objects.filter(user=request.user)
+        replayed = request.query_params.get('replayed', '').lower()
+        if replayed in ('1', 'true', 'yes'):
+            dead_letters = dead_letters.filter(replayed_at__isnull=False)
+        elif replayed in ('0', 'false', 'no'):
+            dead_letters = dead_letters.filter(replayed_at__isnull=True)
         
-        # Add a 'post_type' field to each result
-        for post in text_posts:
-            post['post_type'] = 'TEXT'
-        for post in image_posts:
-            post['post_type'] = 'IMAGE'
-        for post in video_posts:
-            post['post_type'] = 'VIDEO'
-        for post in short_form_videos:
-            post['post_type'] = 'SHORT_FORM_VIDEO'
-        for post in story_images:
-            post['post_type'] = 'STORY_IMAGE'
-        for post in story_videos:
-            post['post_type'] = 'STORY_VIDEO'
+        try:
+            results, next_cursor = paginate_queryset(
+                dead_letters,
+                cursor=request.query_params.get('cursor'),
+                page_size=get_page_size(request.query_params.get('page_size')),
+            )
+        except ValueError as e:
+            return Response({"error": f"{e}"}, status=400)
         
-        # Combine all results
-        all_posts = list(text_posts) + list(image_posts) + list(video_posts) + \
-                    list(short_form_videos) + list(story_images) + list(story_videos)
+        return paginated_response(request, results, next_cursor)
+
+
+class ReplayDeadLettersView(APIView):
+    """
+    API endpoint that replays dead letters from the step that failed.
+    
+    Body: `ids` of the dead letters and the `password` to decrypt the credentials.
+    """
+    def post(self, request):
+        ids = request.data.get('ids')
+        password = request.data.get('password')
+        if not isinstance(ids, list) or not ids:
+            return Response({"error": "ids must be a non-empty list"}, status=400)
         
-        # Sort by creation date (newest first)
-        all_posts.sort(key=lambda x: x['created_at'], reverse=True)
+        dead_letters = list(
+            DeadLetter.objects.select_related('platform_instance__platform').filter(user=request.user, id__in=ids)
+        )
+        if len(dead_letters) != len(set(ids)):
+            return Response({"error": "Dead letter does not exist"}, status=400)
         
-        return Response(all_posts, status=200)
+        try:
+            jobs = replay_dead_letters(dead_letters, password)
+        except MediaNotReady as e:
+            return Response({"error": f"{e}"}, status=409)
+        except ValueError as e:
+            return Response({"error": f"{e}"}, status=400)
+        return Response({"status": "Replay queued", "replayed": len(dead_letters), "jobs": len(jobs)}, status=200)
 
 
-class ListNotificationsView(APIView):
+def authenticate_request(request):
     """
-    API endpoint that allows notifications to be listed.
+    The user of a plain Django request, authenticated with the API's authentication classes.
     """
-    def get(self, request):
-        # Return a list of all notifications for this user
-        user = User.objects.get(id=request.user.id)
-        post_id = int(request.query_params.get('post_id')) # Use request.query_params for GET requests
-        post_type_str = request.query_params.get('post_type') # Use request.query_params
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
 
-        if not post_id:
-            return Response({"error": "Post ID is required"}, status=400)
-        if not post_type_str:
-            return Response({"error": "Post type is required"}, status=400)
-        
-        # Validate post type and get the model class
-        model_class = None
-        if post_type_str == 'TEXT':
-            model_class = PostText
-        elif post_type_str == 'IMAGE':
-            model_class = PostImage
-        elif post_type_str == 'VIDEO':
-            model_class = PostVideo
-        elif post_type_str == 'SHORT_FORM_VIDEO':
-            model_class = ShortFormVideo
-        elif post_type_str == 'STORY_IMAGE':
-            model_class = StoryImage
-        elif post_type_str == 'STORY_VIDEO':
-            model_class = StoryVideo
-        else:
-            return Response({"error": "Invalid post type"}, status=400)
 
-        print(request.query_params,model_class)
+class EventStreamView(View):
+    """
+    API endpoint that streams the user's new notifications and post state changes as
+    server-sent events, see `omnipost_api.events`.
+    
+    Under ASGI (`app.asgi`) the path is served by `omnipost_api.event_stream` before it
+    reaches this view, without a thread per client. This view serves it elsewhere, eg.
+    under `runserver`, where every open stream holds a thread.
+    """
+    def authenticate(self, request):
         try:
-            # Get the ContentType for the model
-            content_type_obj = ContentType.objects.get_for_model(model_class)
-        except ContentType.DoesNotExist:
-            return Response({"error": "Could not find content type for the given post type"}, status=500)
-
-        print(user, content_type_obj)
-        # Query notifications based on user, object_id, and content_type
-        notifications = Notification.objects.filter(
-            user=user, 
-            object_id=post_id,
-            content_type=content_type_obj
-        ).values() 
-
-        return Response(list(notifications), status=200)
+            return authenticate_request(request)
+        finally:
+            # The request's DB connection would otherwise stay open for as long as the stream
+            connections.close_all()
+    
+    async def get(self, request):
+        user = await sync_to_async(self.authenticate)(request)
+        if user is None:
+            return JsonResponse({"error": "Authentication credentials were not provided."}, status=401)
+        
+        response = StreamingHttpResponse(events.stream(user.id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Proxies must pass events through as they come instead of buffering the response
+        response['X-Accel-Buffering'] = 'no'
+        return response